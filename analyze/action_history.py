@@ -0,0 +1,301 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+WRIT = 'WRITOFRESTITUTION'
+DISMISSALS = ['DISMISSEDWITHPREJUDICE', 'DISMISSEDWITHOUTPREJUDICE']
+
+# One row per action on a case, as scraped.  seq is the position of the action
+# in the case's action history.
+EVENT_COLUMNS = [
+    'case_number',
+    'date',
+    'room',
+    'seq',
+    'timestamp',
+    'description',
+    'action',
+    'status',
+]
+
+CASE_KEYS = ['case_number', 'date', 'room']
+
+# Format of action dates on case pages.
+ACT_DATE_FORMAT = '%m/%d/%Y'
+
+# Flags computed by historyFlags and eventFlags.  Bump DERIVATION_VERSION
+# whenever the way they are computed changes, so flags memoized by
+# analyze.derived_memo are dropped.
+FLAG_COLUMNS = ['writ_of_restitution', 'evicted_flag']
+DERIVATION_VERSION = 2
+
+# Fewer histories than this are not worth sending to another process.
+MIN_CHUNK_ROWS = 5000
+
+
+def historyEvents(actionHistories):
+    """historyEvents.  Split every action history once into a long table of
+    events with columns case, timestamp, action and status.
+
+    case is the position of the history in actionHistories, action is
+    normalized as in derived_columns.normalizeStr, and timestamps that cannot
+    be read are NaT.
+
+    Parameters
+    ----------
+    actionHistories : pandas.Series
+        values from the action_history column
+    """
+
+    histories = (pd.Series(actionHistories)
+                 .reset_index(drop=True)
+                 .fillna('')
+                 .astype(str))
+
+    entries = histories.str.split(',').explode()
+    parts = (entries.astype(str).str.split('|', expand=True)
+             .reindex(columns=[0, 1, 2])
+             .fillna('')
+             .astype(str))
+
+    return pd.DataFrame({
+        'case': entries.index.values,
+        'timestamp': pd.to_datetime(parts[0].str.strip(),
+                                    format=ACT_DATE_FORMAT, errors='coerce'),
+        'action': normalizeActions(parts[1]),
+        'status': parts[2],
+    }).reset_index(drop=True)
+
+
+def normalizeActions(actions):
+    """normalizeActions.  Vectorized derived_columns.normalizeStr.  Removes all
+    non-alphanumeric characters and converts to upper case.
+
+    Parameters
+    ----------
+    actions : pandas.Series
+        action descriptions
+    """
+    return (actions.fillna('')
+            .str.upper()
+            .str.replace(r'[\W_]+', '', regex=True))
+
+
+def historyFlags(actionHistories, processes=None):
+    """historyFlags.  Compute the action history flags for every case at once.
+    Returns a dataframe with one row per history, in order, and one column per
+    flag.
+
+    Parameters
+    ----------
+    actionHistories : pandas.Series
+        values from the action_history column
+    processes : int
+        size of the process pool to split the histories across.  Computed in
+        this process by default, and for fewer than MIN_CHUNK_ROWS histories.
+    """
+    numCases = len(actionHistories)
+    if processes and processes > 1 and numCases >= MIN_CHUNK_ROWS:
+        return parallelHistoryFlags(actionHistories, processes)
+
+    events = historyEvents(actionHistories)
+
+    return pd.DataFrame({
+        'writ_of_restitution': writOfRestitutionFlags(events, numCases),
+        'evicted_flag': evictedFlags(events, numCases),
+    })
+
+
+def parallelHistoryFlags(actionHistories, processes):
+    """parallelHistoryFlags.  historyFlags across a process pool.  Flags only
+    depend on their own history, so the histories are cut into contiguous
+    chunks, a few per process to even out the load, and the results are put
+    back together in order.
+
+    Parameters
+    ----------
+    actionHistories : pandas.Series
+        values from the action_history column
+    processes : int
+        size of the process pool
+    """
+    histories = pd.Series(actionHistories).reset_index(drop=True)
+    numChunks = min(processes * 4, len(histories) // MIN_CHUNK_ROWS)
+    bounds = np.linspace(0, len(histories), numChunks + 1).astype(int)
+    chunks = [histories.iloc[start:end]
+              for start, end in zip(bounds[:-1], bounds[1:])]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        flags = list(executor.map(historyFlags, chunks))
+
+    return pd.concat(flags, ignore_index=True)
+
+
+def anyPerCase(mask, events, numCases):
+    """anyPerCase.  Whether mask holds for any event of each case.
+
+    Parameters
+    ----------
+    mask : pandas.Series
+        boolean per event
+    events : pandas.DataFrame
+        output of historyEvents
+    numCases : int
+        number of histories the events came from
+    """
+    return (mask.groupby(events['case']).any()
+            .reindex(range(numCases), fill_value=False)
+            .astype(bool)
+            .values)
+
+
+def writOfRestitutionFlags(events, numCases):
+    """writOfRestitutionFlags.  Whether each case had a writ of restitution.
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        output of historyEvents
+    numCases : int
+        number of histories the events came from
+    """
+    return anyPerCase(events['action'] == WRIT, events, numCases)
+
+
+def evictedFlags(events, numCases):
+    """evictedFlags.  Whether each case had a writ of restitution that was not
+    followed by a dismissal.
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        output of historyEvents
+    numCases : int
+        number of histories the events came from
+    """
+    isWrit = events['action'] == WRIT
+    latestWrit = (events['timestamp'].where(isWrit)
+                  .groupby(events['case']).max())
+
+    # Dismissals on or after the latest writ mean the parties settled or the
+    # case was thrown out.
+    dismissedAfterWrit = (
+        events['action'].isin(DISMISSALS) &
+        (events['timestamp'] >= events['case'].map(latestWrit))
+    )
+
+    return (anyPerCase(isWrit, events, numCases) &
+            ~anyPerCase(dismissedAfterWrit, events, numCases))
+
+
+def splitActionHistory(actionHistory):
+    """splitActionHistory.  Split an action_history string back into a list of
+    [act date, description, status] actions.  Only for records scraped before
+    actions were kept on their own, since descriptions containing commas do not
+    survive the round trip.
+
+    Parameters
+    ----------
+    actionHistory : str
+        a value from the action_history column
+    """
+    actions = []
+    for entry in (actionHistory or '').split(','):
+        parts = entry.strip().split('|')
+        if len(parts) == 3:
+            actions.append(parts)
+
+    return actions
+
+
+def eventTable(records):
+    """eventTable.  Build a typed action events dataframe.  Timestamps are
+    datetime64, action is the normalized action code, and repeated strings are
+    categoricals, so the table stays small and filters on codes rather than
+    strings.
+
+    Parameters
+    ----------
+    records : pandas.DataFrame
+        rows with EVENT_COLUMNS, less timestamp and action, and with the raw
+        act date in act_date.
+    """
+    # Columns of an empty frame may have come out as floats.
+    if records.shape[0] == 0:
+        records = pd.DataFrame(columns=records.columns, dtype=object)
+
+    df = pd.DataFrame({
+        'case_number': records['case_number'].astype(str),
+        'date': records['date'].astype('category'),
+        'room': records['room'].astype('category'),
+        'seq': records['seq'].astype('int16'),
+        'timestamp': pd.to_datetime(records['act_date'].str.strip(),
+                                    format=ACT_DATE_FORMAT, errors='coerce'),
+        'description': records['description'].astype('category'),
+        'action': normalizeActions(records['description']).astype('category'),
+        'status': records['status'].astype('category'),
+    }, columns=EVENT_COLUMNS)
+
+    return df.reset_index(drop=True)
+
+
+def saveEvents(events, path):
+    """saveEvents.  Write an action events table to parquet.
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        output of eventTable
+    path : str
+        parquet file to write
+    """
+    events.to_parquet(path, index=False)
+
+
+def eventFlags(events):
+    """eventFlags.  Action history flags straight from an action events table,
+    without any string parsing.  Returns one row per case with CASE_KEYS and a
+    column per flag.
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        output of eventTable
+    """
+    keys = events[CASE_KEYS].astype(str)
+    grouped = keys.groupby(CASE_KEYS, sort=False)
+    cases = grouped.size().reset_index()[CASE_KEYS]
+
+    caseEvents = pd.DataFrame({
+        'case': grouped.ngroup().values,
+        'timestamp': events['timestamp'].values,
+        'action': events['action'].astype(str).values,
+    })
+    numCases = cases.shape[0]
+
+    cases['writ_of_restitution'] = writOfRestitutionFlags(caseEvents, numCases)
+    cases['evicted_flag'] = evictedFlags(caseEvents, numCases)
+
+    return cases
+
+
+def caseFlags(cases, events):
+    """caseFlags.  eventFlags of every case in cases, one row per row of cases,
+    in order.  Cases without any events have no writ, so all their flags are
+    False.
+
+    Parameters
+    ----------
+    cases : pandas.DataFrame
+        cases with CASE_KEYS
+    events : pandas.DataFrame
+        output of eventTable for those cases
+    """
+    flags = eventFlags(events)
+
+    return (cases[CASE_KEYS].astype(str)
+            .merge(flags, on=CASE_KEYS, how='left')
+            .reindex(columns=FLAG_COLUMNS)
+            .fillna(False)
+            .astype(bool)
+            .reset_index(drop=True))
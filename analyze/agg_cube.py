@@ -0,0 +1,279 @@
+from analyze.dates import parseDates
+from analyze.rollup_store import COUNTS, DIMENSIONS, ROLLUPS
+import pandas as pd
+
+# Periods from finest to coarsest, with the pandas frequency of each.  Weeks
+# start on Monday.
+PERIOD_FREQS = {
+    'day': 'D',
+    'week': 'W-SUN',
+    'month': 'M',
+    'quarter': 'Q',
+    'year': 'A',
+}
+
+# Period of the first key of each stored rollup.
+KEY_PERIODS = {
+    'date': 'day',
+    'month_start': 'month',
+}
+
+# Periods each period can be rolled up into.  Weeks do not nest in months.
+ROLLS_UP_TO = {
+    'day': ['day', 'week', 'month', 'quarter', 'year'],
+    'week': ['week'],
+    'month': ['month', 'quarter', 'year'],
+    'quarter': ['quarter', 'year'],
+    'year': ['year'],
+}
+
+
+class AggCube:
+    """AggCube.  Case counts broken down by any combination of DIMENSIONS and
+    any period.
+
+    The case table is grouped once, by day and every dimension, or the
+    rollups a RollupStore keeps up to date across runs are read as the finest
+    cuboids.  Each slice is then rolled up from the smallest cuboid already
+    computed that is at least as fine, and cached, so coarse breakdowns never
+    go back to the case table.  A store only holds the breakdowns its ROLLUPS
+    list, e.g. plaintiffs per month but not per week.
+    """
+
+    def __init__(self, casesDf, dimensions=None, store=None):
+        """__init__.  Build the finest cuboid of casesDf.
+
+        Parameters
+        ----------
+        casesDf : pandas.DataFrame
+            processed and deduped cases, with derived columns.  None to read
+            the finest cuboid from store.
+        dimensions : list[str]
+            columns to allow breakdowns by.  DIMENSIONS by default, and always
+            with a store.
+        store : analyze.rollup_store.RollupStore
+            persisted rollups to read when casesDf is None
+        """
+        if casesDf is None:
+            self.dimensions = list(DIMENSIONS)
+            self.cuboids = {}
+            for name, keys in ROLLUPS.items():
+                dimensions = self.ordered(keys[1:])
+                rollup = store.rollup(name)
+                rollup.insert(0, 'period_start', parseDates(
+                    rollup.pop(keys[0]), errors='coerce').values)
+                self.cuboids[(KEY_PERIODS[keys[0]], tuple(dimensions))] = (
+                    rollup[rollup['period_start'].notna()]
+                    [['period_start'] + dimensions + COUNTS]
+                    .astype({count: 'int64' for count in COUNTS})
+                    .reset_index(drop=True))
+            return
+
+        self.dimensions = list(dimensions or DIMENSIONS)
+        missing = [dim for dim in self.dimensions
+                   if dim not in casesDf.columns]
+        if missing:
+            raise ValueError('Cases have no %s column.' % ', '.join(missing))
+
+        base = pd.DataFrame({
+            dim: casesDf[dim].fillna('').astype(str).values
+            for dim in self.dimensions
+        })
+        base['period_start'] = (parseDates(casesDf['date'])
+                                .dt.normalize().values)
+        base['num_fed_hearings'] = 1
+        base['num_writ_restitution'] = (casesDf['writ_of_restitution']
+                                        .fillna(False).astype(bool)
+                                        .astype(int).values)
+        base['num_evictions'] = (casesDf['evicted_flag']
+                                 .fillna(False).astype(bool)
+                                 .astype(int).values)
+
+        self.cuboids = {
+            ('day', tuple(self.dimensions)): (
+                base.groupby(['period_start'] + self.dimensions)[COUNTS]
+                .sum()
+                .reset_index()),
+        }
+
+    def build(self, cuboids):
+        """build.  Compute and cache several cuboids at once, finest first, so
+        each coarser one rolls up from the finer ones.
+
+        Parameters
+        ----------
+        cuboids : list[tuple]
+            (period, dimensions) pairs
+        """
+        periods = list(PERIOD_FREQS)
+        for period, dimensions in sorted(
+                cuboids, key=lambda c: (periods.index(c[0]), -len(c[1]))):
+            self.cuboid(period, dimensions)
+
+    def slice(self, period='month', dimensions=(), **filters):
+        """slice.  Counts and rates per period and per value of dimensions,
+        for cases matching filters.  Ordered by period, then dimensions.
+
+        Parameters
+        ----------
+        period : str
+            one of PERIOD_FREQS
+        dimensions : list[str]
+            columns to break down by
+        filters : dict
+            dimension to a value, or list of values, to keep.  Filtered
+            dimensions are summed over unless also in dimensions.
+        """
+        dimensions = list(dimensions)
+        df = self.cuboid(period, dimensions + list(filters))
+
+        for dim, values in filters.items():
+            if isinstance(values, str) or not hasattr(values, '__iter__'):
+                values = [values]
+            df = df[df[dim].isin(values)]
+
+        # Sum over filtered dimensions that are not broken down by.
+        if set(filters) - set(dimensions):
+            keys = ['period_start'] + self.ordered(dimensions)
+            df = df.groupby(keys)[COUNTS].sum().reset_index()
+
+        df = df.reset_index(drop=True)
+        df.insert(0, period, periodLabels(df.pop('period_start'), period))
+
+        return addRateColumns(df)
+
+    def cuboid(self, period, dimensions):
+        """cuboid.  Counts per period start and per value of dimensions,
+        computed from the smallest finer cuboid and cached.
+
+        Parameters
+        ----------
+        period : str
+            one of PERIOD_FREQS
+        dimensions : list[str]
+            columns to break down by
+        """
+        if period not in PERIOD_FREQS:
+            raise ValueError('Unknown period %s.' % period)
+
+        key = (period, tuple(self.ordered(dimensions)))
+        if key not in self.cuboids:
+            parents = [k for k in self.cuboids
+                       if period in ROLLS_UP_TO[k[0]] and
+                       set(key[1]) <= set(k[1])]
+            if not parents:
+                raise ValueError('No rollup to break down by %s per %s.'
+                                 % (', '.join(key[1]) or 'nothing', period))
+            parent = min(parents, key=lambda k: self.cuboids[k].shape[0])
+            self.cuboids[key] = rollUp(self.cuboids[parent], period,
+                                       list(key[1]))
+
+        return self.cuboids[key]
+
+    def ordered(self, dimensions):
+        """ordered.  Deduped dimensions in the cube's order.  Raises
+        ValueError on unknown dimensions.
+
+        Parameters
+        ----------
+        dimensions : list[str]
+            columns to break down by
+        """
+        unknown = [dim for dim in dimensions if dim not in self.dimensions]
+        if unknown:
+            raise ValueError('Unknown dimension %s.' % ', '.join(unknown))
+
+        return [dim for dim in self.dimensions if dim in dimensions]
+
+
+def isStored(period, dimensions):
+    """isStored.  Whether a breakdown can be summed from the rollups a
+    RollupStore keeps, see ROLLUPS.
+
+    Parameters
+    ----------
+    period : str
+        one of PERIOD_FREQS
+    dimensions : list[str]
+        columns to break down by
+    """
+    return any(period in ROLLS_UP_TO[KEY_PERIODS[keys[0]]] and
+               set(dimensions) <= set(keys[1:])
+               for keys in ROLLUPS.values())
+
+
+def rollUp(cuboid, period, dimensions):
+    """rollUp.  Roll a cuboid up to a coarser (or the same) period and fewer
+    (or the same) dimensions.
+
+    Parameters
+    ----------
+    cuboid : pandas.DataFrame
+        counts per period_start and dimensions
+    period : str
+        period to roll up to
+    dimensions : list[str]
+        dimensions to keep
+    """
+    return (cuboid
+            .assign(period_start=periodStarts(cuboid['period_start'], period))
+            .groupby(['period_start'] + dimensions)[COUNTS]
+            .sum()
+            .reset_index())
+
+
+def periodStarts(starts, period):
+    """periodStarts.  Start of the period each date falls in.  Computed once
+    per distinct date.
+
+    Parameters
+    ----------
+    starts : pandas.Series
+        datetime64 dates
+    period : str
+        one of PERIOD_FREQS
+    """
+    uniques = pd.DatetimeIndex(starts.unique())
+    mapping = pd.Series(
+        uniques.to_period(PERIOD_FREQS[period]).start_time, index=uniques)
+
+    return starts.map(mapping)
+
+
+def periodLabels(starts, period):
+    """periodLabels.  Readable labels for period starts: dates for days and
+    weeks (the Monday), 2020-09 for months, 2020Q3 for quarters and 2020 for
+    years.
+
+    Parameters
+    ----------
+    starts : pandas.Series
+        datetime64 period starts
+    period : str
+        one of PERIOD_FREQS
+    """
+    if period in ('day', 'week'):
+        return starts.dt.strftime('%Y-%m-%d')
+
+    return starts.dt.to_period(PERIOD_FREQS[period]).astype(str)
+
+
+def addRateColumns(aggDf):
+    """addRateColumns.  Adds eviction, judgement and mediation rates to a
+    rollup with count columns.
+
+    Parameters
+    ----------
+    aggDf : pandas.DataFrame
+        weekly or monthly rollup
+    """
+    aggDf = aggDf.copy()
+    aggDf['eviction_rate'] = (
+        aggDf['num_evictions'] / aggDf['num_fed_hearings'])
+    aggDf['judgement_rate'] = (
+        aggDf['num_writ_restitution'] / aggDf['num_fed_hearings'])
+    aggDf['mediation_rate'] = (
+        (aggDf['num_writ_restitution'] - aggDf['num_evictions']) /
+        aggDf['num_fed_hearings'])
+
+    return aggDf
@@ -1,67 +1,258 @@
 from IPython import embed
-from datetime import timedelta
+from analyze.agg_cube import (AggCube, addRateColumns, periodLabels,
+                              periodStarts)
+from analyze.dates import parseDates, toDateStrings, weekStarts
+from analyze.rollup_store import (CONTRIBUTION_COLUMNS, DIMENSIONS,
+                                  RollupStore, contributionDigests)
+from analyze.timeline_metrics import timelineHistogram, timelineStats
 import numpy as np
 import pandas as pd
 
 
 class AggTables:
-    def __init__(self, processedEvictionDf):
+    """AggTables.  Weekly and monthly rollups of the case history, and
+    breakdowns by room, plaintiff or attorney over any period.
+
+    Rollups by day and room, and by month and plaintiff or attorney, live in a
+    RollupStore.  Given a persisted store and the batch of cases that changed
+    since it was last updated, only that batch is rolled up and merged in.
+    Otherwise the rollups are built from the whole history.  Weeks, months and
+    breakdowns are then summed from the stored rollups by an
+    analyze.agg_cube.AggCube.
+
+    Percentiles of case timelines (days to writ, continuances and so on) are
+    not kept in the store, since they cannot be merged batch by batch.  They
+    are computed from the whole history on request, from its TIMELINE_METRICS
+    columns where it has them, and joined onto the rollups and breakdowns when
+    timelines is set.
+    """
+
+    def __init__(self, processedEvictionDf, store=None, changedCases=None,
+                 timelines=False, verify=True):
         """__init__.
 
         Parameters
         ----------
         processedEvictionDf : pandas.DataFrame
-            Database of evictions which has been processed and deduped.
+            Database of evictions which has been processed and deduped, with
+            entity columns from analyze.entity_resolution.addEntityColumns.
+            None to read the rollups already in store, e.g. when the history
+            was rolled up a chunk at a time by analyze.chunked.ChunkedHistory.
+        store : analyze.rollup_store.RollupStore
+            persisted rollups to update.  Rollups are kept in memory and built
+            from processedEvictionDf by default.
+        changedCases : pandas.DataFrame
+            rows of processedEvictionDf that are new or changed since store was
+            last updated.  The store is rebuilt from processedEvictionDf if
+            None, or if the store does not match the rest of
+            processedEvictionDf.  See inSync.
+        timelines : bool
+            whether aggStatsMonthly, aggStatsWeekly and breakdown include
+            percentiles of analyze.timeline_metrics.TIMELINE_METRICS.  Needs
+            processedEvictionDf.
+        verify : bool
+            whether inSync compares what every unchanged case contributes with
+            the store, which catches hand edits.  Otherwise only their number
+            is compared, for when the cases outside changedCases are known to
+            be what the store was last updated with.
+        """
+        self.casesDf = processedEvictionDf
+        self.timelines = timelines
+        self.verify = verify
+        self.store = store or RollupStore(':memory:')
+
+        if processedEvictionDf is None:
+            print('Using %d stored rows.' % self.store.numRows())
+        elif changedCases is not None and self.inSync(processedEvictionDf,
+                                                      changedCases):
+            print('Rolling up %d changed cases.' % changedCases.shape[0])
+            self.store.update(caseContributions(changedCases))
+        else:
+            if changedCases is not None:
+                print('Stored rollups do not match the cases.')
+            print('Rolling up all %d cases.' % processedEvictionDf.shape[0])
+            self.store.rebuild(caseContributions(processedEvictionDf))
+
+        self.cube = AggCube(None, store=self.store)
+
+    def inSync(self, processedEvictionDf, changedCases):
+        """inSync.  Whether the store holds exactly what the cases of
+        processedEvictionDf outside changedCases contribute, so applying
+        changedCases brings it up to date.  Cases edited, added or removed by
+        hand in the sheet since the last update make it fall out of sync.
+        Without verify, edits are not looked for and only the number of
+        unchanged cases is compared.
+
+        Parameters
+        ----------
+        processedEvictionDf : pandas.DataFrame
+            all cases
+        changedCases : pandas.DataFrame
+            new or changed cases
         """
-        self.evictionDf = processedEvictionDf.copy()
-        self.evictionDf['date'] = pd.to_datetime(processedEvictionDf['date'])
-        self.evictionDf = self.evictionDf.sort_values('date')
+        changed = changedCases['case_number'].astype(str).unique()
+        unchanged = processedEvictionDf[
+            ~processedEvictionDf['case_number'].astype(str).isin(changed)]
+        if not self.verify:
+            return (self.store.numRows() -
+                    self.store.numRows(changed.tolist()) ==
+                    unchanged.shape[0])
+
+        stored = self.store.digests()
+        stored = stored[~stored['case_number'].isin(changed)]
+
+        return np.array_equal(
+            np.sort(contributionDigests(caseContributions(unchanged))),
+            np.sort(stored['digest'].values))
 
     def aggStatsMonthly(self):
-        """aggStatsMonthly.  Group by year and month and compute basic stats.  """
+        """aggStatsMonthly.  Group by year and month and compute basic stats.
+        Months are in chronological order.  """
+
+        aggDf = self.cube.cuboid('month', [])
+        starts = aggDf['period_start']
+        aggDf = self.addDerivedColumns(
+            aggDf.drop('period_start', axis=1)
+            .set_index([starts.dt.year.astype(str).rename('year'),
+                        starts.dt.month.astype(str).rename('month')]))
 
-        # FIXME: This results in the months in alphabetical order.  They should
-        # be in chronological order.
-        aggDf = (self.evictionDf
-                 .groupby(['year', 'month'])
-                 .agg(
-                     num_fed_hearings=('case_number', np.size),
-                     num_writ_restitution=('writ_of_restitution', np.sum),
-                     num_evictions=('evicted_flag', np.sum)
-                 ))
+        if self.timelines:
+            aggDf = aggDf.merge(
+                self.timelineStatsMonthly().drop('num_cases', axis=1),
+                on=['year', 'month'], how='left')
 
-        return self.addDerivedColumns(aggDf)
+        return aggDf
 
     def aggStatsWeekly(self):
-        """aggStatsMonthly.  Group by year and month and compute basic stats.  """
-
-        aggDf = (self.evictionDf
-                 .groupby(['year', 'week'])
-                 .agg(
-                     week_start=('date', np.min),
-                     num_fed_hearings=('case_number', np.size),
-                     num_writ_restitution=('writ_of_restitution', np.sum),
-                     num_evictions=('evicted_flag', np.sum)
-                 ))
-
-        # Correct date so all are Sunday
-        aggDf['week_start'] = (
-            aggDf['week_start']
-            .apply(lambda date: self.getStartOfWeek(date))
-        )
-
-        aggDf = (aggDf
-                 .reset_index()
-                 .drop(['week', 'year'], axis=1)
-                 .set_index('week_start'))
-
-        return self.addDerivedColumns(aggDf)
+        """aggStatsWeekly.  Group by week, keyed by the Monday it starts on,
+        and compute basic stats.  Weeks are in chronological order.  """
 
-    def getStartOfWeek(self, date):
-        dateAsDateTime = pd.to_datetime(date)
-        dateDiff = dateAsDateTime - timedelta(days=dateAsDateTime.weekday())
+        aggDf = self.cube.cuboid('week', [])
+        aggDf = self.addDerivedColumns(
+            aggDf.drop('period_start', axis=1)
+            .set_index(aggDf['period_start'].dt.strftime('%Y-%m-%d')
+                       .rename('week_start')))
+
+        if self.timelines:
+            aggDf = aggDf.merge(
+                self.timelineStatsWeekly().drop('num_cases', axis=1),
+                on='week_start', how='left')
 
-        return str(dateDiff.date())
+        return aggDf
+
+    def breakdown(self, period='month', dimensions=(), **filters):
+        """breakdown.  Counts and rates per period and per value of
+        dimensions, summed from the stored daily rollups.  See
+        analyze.agg_cube.AggCube.slice.
+
+        Parameters
+        ----------
+        period : str
+            one of analyze.agg_cube.PERIOD_FREQS
+        dimensions : list[str]
+            columns of analyze.rollup_store.DIMENSIONS to break down by
+        filters : dict
+            dimension to a value, or list of values, to keep
+        """
+        aggDf = self.cube.slice(period, dimensions, **filters)
+
+        if self.timelines:
+            keys = [period] + list(dimensions)
+            casesDf = self.casesDf
+            for dim, values in filters.items():
+                if isinstance(values, str) or not hasattr(values, '__iter__'):
+                    values = [values]
+                casesDf = casesDf[casesDf[dim].isin(values)]
+            aggDf = aggDf.merge(
+                self.timelineStats(period, dimensions, casesDf)
+                .drop('num_cases', axis=1),
+                on=keys, how='left')
+
+        return aggDf
+
+    def timelineStats(self, period='month', by=(), casesDf=None):
+        """timelineStats.  Timeline percentiles per period, labeled as
+        breakdown labels them, and per value of by.
+
+        Parameters
+        ----------
+        period : str
+            one of analyze.agg_cube.PERIOD_FREQS
+        by : list[str]
+            case columns to also break down by, e.g. room or plaintiff
+        casesDf : pandas.DataFrame
+            cases to summarize.  All of them by default.
+        """
+        casesDf = self.withPeriod(period, casesDf)
+
+        return timelineStats(casesDf, [period] + list(by))
+
+    def timelineHistogram(self, metric, period='month', by=()):
+        """timelineHistogram.  Number of cases per period, and per value of
+        by, in each bin of a timeline metric.  See
+        analyze.timeline_metrics.timelineHistogram.
+
+        Parameters
+        ----------
+        metric : str
+            one of analyze.timeline_metrics.DAY_METRICS
+        period : str
+            one of analyze.agg_cube.PERIOD_FREQS
+        by : list[str]
+            case columns to also break down by, e.g. room or plaintiff
+        """
+        return timelineHistogram(self.withPeriod(period), metric,
+                                 [period] + list(by))
+
+    def withPeriod(self, period, casesDf=None):
+        """withPeriod.  Cases with a column named period holding the label
+        of the period each falls in.
+
+        Parameters
+        ----------
+        period : str
+            one of analyze.agg_cube.PERIOD_FREQS
+        casesDf : pandas.DataFrame
+            cases to label.  All of them by default.
+        """
+        if casesDf is None:
+            casesDf = self.casesDf
+        starts = periodStarts(parseDates(casesDf['date']), period)
+
+        return casesDf.assign(**{period: periodLabels(starts, period).values})
+
+    def timelineStatsMonthly(self, by=()):
+        """timelineStatsMonthly.  Timeline percentiles per year and month,
+        and per value of by.  Months are in chronological order.
+
+        Parameters
+        ----------
+        by : list[str]
+            case columns to also break down by, e.g. room or plaintiff
+        """
+        keys = ['year', 'month'] + list(by)
+        statsDf = timelineStats(self.casesDf.astype({'year': str,
+                                                     'month': str}), keys)
+
+        return (statsDf.iloc[chronologicalOrder(statsDf, keys[:2])]
+                .reset_index(drop=True))
+
+    def timelineStatsWeekly(self, by=()):
+        """timelineStatsWeekly.  Timeline percentiles per week, keyed by the
+        Monday it starts on, and per value of by.
+
+        Parameters
+        ----------
+        by : list[str]
+            case columns to also break down by, e.g. room or plaintiff
+        """
+        casesDf = self.casesDf.assign(
+            week_start=weekStarts(self.casesDf['date']).values)
+
+        return timelineStats(casesDf, ['week_start'] + list(by))
+
+    def getStartOfWeek(self, date):
+        return weekStarts(pd.Series([date])).iloc[0]
 
     def addDerivedColumns(self, aggDf):
         """addDerivedColumns.  Adds summary stats to aggregate dataframe.
@@ -69,17 +260,53 @@ class AggTables:
         Parameters
         ----------
         aggDf : pandas.DataFrame
-            Weekly or Monthly aggs from self.evictionDf
+            Weekly or Monthly aggs from self.store
         """
-        modifiedAggDf = aggDf.reset_index()
-        modifiedAggDf['eviction_rate'] = (
-            modifiedAggDf['num_evictions'] / modifiedAggDf['num_fed_hearings'])
-        modifiedAggDf['judgement_rate'] = (
-            modifiedAggDf['num_writ_restitution'] /
-            modifiedAggDf['num_fed_hearings'])
-        modifiedAggDf['mediation_rate'] = (
-            (modifiedAggDf['num_writ_restitution']
-             - modifiedAggDf['num_evictions']) /
-            modifiedAggDf['num_fed_hearings'])
-
-        return modifiedAggDf
+        return addRateColumns(aggDf.reset_index())
+
+
+def caseContributions(casesDf):
+    """caseContributions.  What each case row adds to the rollups: its
+    day, its breakdown columns and its counts.  One row per case row with
+    CONTRIBUTION_COLUMNS.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        processed and deduped cases, with derived columns
+    """
+    contributions = pd.DataFrame({
+        'case_number': casesDf['case_number'].astype(str).values,
+        'date': toDateStrings(casesDf['date']).values,
+        'num_fed_hearings': 1,
+        'num_writ_restitution': (casesDf['writ_of_restitution']
+                                 .fillna(False).astype(bool)
+                                 .astype(int).values),
+        'num_evictions': (casesDf['evicted_flag']
+                          .fillna(False).astype(bool)
+                          .astype(int).values),
+    })
+    for dim in DIMENSIONS:
+        contributions[dim] = (casesDf[dim].astype(object)
+                              .where(casesDf[dim].notna(), '')
+                              .astype(str).values)
+
+    return contributions[CONTRIBUTION_COLUMNS]
+
+
+def chronologicalOrder(aggDf, keys):
+    """chronologicalOrder.  Positions that sort aggDf by its numeric string
+    keys as numbers rather than as strings.
+
+    Parameters
+    ----------
+    aggDf : pandas.DataFrame
+        rollup with string period keys
+    keys : list[str]
+        period keys, most significant first
+    """
+    numeric = pd.DataFrame({key: pd.to_numeric(aggDf[key], errors='coerce')
+                            for key in keys})
+
+    return np.lexsort([numeric[key].values for key in reversed(keys)])
+
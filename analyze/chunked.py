@@ -0,0 +1,269 @@
+from analyze.agg_tables import caseContributions
+from ingest.schema import readCasesCsv
+import math
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+# Memory the chunked pipeline may use, in bytes.
+MEMORY_LIMIT = int(os.getenv('HISTORY_MEMORY_MB') or 512) * 2 ** 20
+
+# Processing a partition (sort, dedupe, merge) holds a few copies of it at
+# once, so partitions are kept to this fraction of the memory limit.
+WORKING_COPIES = 4
+
+# Partitions that are still too big are split again, at most this many times.
+MAX_SPLITS = 3
+
+
+class ChunkedHistory:
+    """ChunkedHistory.  A case history too big to hold in one dataframe,
+    spilled to disk in partitions by case number.
+
+    Every row of a case number lands in the same partition, so anything
+    computed per case number (dedupe, num_hearings, derived columns) can be
+    computed one partition at a time and gives the same rows as on the whole
+    history.  Rows are buffered until the buffer reaches the partition budget,
+    then hashed out to the partition files.  When read back, small partitions
+    are loaded together and oversized ones are split again, so no more than
+    a budget's worth of cases is in memory at once.
+
+    Rollups are summed across partitions in a RollupStore.
+    """
+
+    def __init__(self, workDir=None, memoryLimit=None, numPartitions=64):
+        """__init__.  Create an empty ChunkedHistory.
+
+        Parameters
+        ----------
+        workDir : str
+            directory for the partition files.  A fresh directory under out/
+            by default.  Removed by close.
+        memoryLimit : int
+            bytes the pipeline may use.  MEMORY_LIMIT by default.
+        numPartitions : int
+            partitions rows are first hashed into.
+        """
+        if workDir is None:
+            os.makedirs('out', exist_ok=True)
+            workDir = tempfile.mkdtemp(prefix='chunks__', dir='out')
+        os.makedirs(workDir, exist_ok=True)
+
+        self.workDir = workDir
+        self.budget = (memoryLimit or MEMORY_LIMIT) // WORKING_COPIES
+        self.numPartitions = numPartitions
+        self.columns = []
+        self.partitionFiles = [[] for _ in range(numPartitions)]
+        self.partitionBytes = [0] * numPartitions
+        self.buffer = []
+        self.bufferBytes = 0
+        self.numFiles = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, casesDf):
+        """add.  Add case rows to the history.  Rows may repeat case numbers,
+        within and across calls.
+
+        Parameters
+        ----------
+        casesDf : pandas.DataFrame
+            case rows with a case_number column
+        """
+        if casesDf.shape[0] == 0:
+            return
+
+        self.columns += [col for col in casesDf.columns
+                         if col not in self.columns]
+        self.buffer.append(casesDf)
+        self.bufferBytes += casesDf.memory_usage(deep=True).sum()
+
+        if self.bufferBytes >= self.budget:
+            self.flush()
+
+    def addCsv(self, path, rowsPerChunk=100000, transform=None):
+        """addCsv.  Add the rows of a csv, reading a chunk at a time.
+
+        Parameters
+        ----------
+        path : str
+            csv of case rows, read into the case schema
+        rowsPerChunk : int
+            rows read at once
+        transform : function
+            applied to each chunk before adding it, e.g. to filter rows
+        """
+        for chunk in readCasesCsv(path, chunksize=rowsPerChunk):
+            self.add(transform(chunk) if transform else chunk)
+
+    def flush(self):
+        """flush.  Write the buffered rows out to their partitions.  """
+        if not self.buffer:
+            return
+
+        df = pd.concat(self.buffer, ignore_index=True)
+        spilled = self.spill(df, self.numPartitions, 0, self.bufferBytes)
+        for i, (path, numBytes) in spilled.items():
+            self.partitionFiles[i].append(path)
+            self.partitionBytes[i] += numBytes
+
+        self.buffer = []
+        self.bufferBytes = 0
+
+    def partitions(self):
+        """partitions.  Generator over the history, one loaded group of whole
+        case numbers at a time.  Columns of every group are the union of the
+        columns added, in the order first seen.  """
+        self.flush()
+
+        # Keep the split partitions, so later passes do not split them again.
+        planned = self.plan(
+            list(zip(self.partitionFiles, self.partitionBytes)), 1)
+        self.partitionFiles = [files for files, _ in planned]
+        self.partitionBytes = [numBytes for _, numBytes in planned]
+
+        group, groupBytes = [], 0
+        for files, numBytes in planned:
+            if group and groupBytes + numBytes > self.budget:
+                yield self.load(group)
+                group, groupBytes = [], 0
+            group += files
+            groupBytes += numBytes
+
+        if group:
+            yield self.load(group)
+
+    def run(self, transform=None, outputPath=None, store=None):
+        """run.  Process the history a partition at a time.  Each processed
+        partition is appended to outputPath and rolled up into store.  Returns
+        the number of processed rows.
+
+        Parameters
+        ----------
+        transform : function
+            applied to each partition, e.g. dedupe then addDerivedColumns.
+            Must only combine rows of the same case number.
+        outputPath : str
+            csv to write the processed rows to.  Rows are grouped by
+            partition, not sorted.
+        store : analyze.rollup_store.RollupStore
+            rollups to add the processed rows to.  Rows need the derived
+            columns.  Emptied first, so it only holds this history.
+        """
+        if store is not None:
+            store.clear()
+
+        numRows = 0
+        for df in self.partitions():
+            if transform is not None:
+                df = transform(df)
+
+            if store is not None:
+                store.update(caseContributions(df))
+            if outputPath is not None:
+                df.to_csv(outputPath, mode='a' if numRows else 'w',
+                          header=not numRows, index=False)
+
+            numRows += df.shape[0]
+            print('Processed %d rows.' % numRows)
+
+        return numRows
+
+    def close(self):
+        """close.  Remove the partition files.  """
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def plan(self, partitions, level):
+        """plan.  Partitions to load, with those over the budget split again
+        into smaller ones.
+
+        Parameters
+        ----------
+        partitions : list[tuple]
+            (files, bytes) of each partition
+        level : int
+            times split so far
+        """
+        planned = []
+        for files, numBytes in partitions:
+            if numBytes <= self.budget or level > MAX_SPLITS:
+                planned.append((files, numBytes))
+                continue
+
+            numSplits = 2 * math.ceil(numBytes / self.budget)
+            splitFiles = [[] for _ in range(numSplits)]
+            splitBytes = [0] * numSplits
+            for path in files:
+                df = pd.read_pickle(path)
+                fileBytes = df.memory_usage(deep=True).sum()
+                for i, (splitPath, splitSize) in self.spill(
+                        df, numSplits, level, fileBytes).items():
+                    splitFiles[i].append(splitPath)
+                    splitBytes[i] += splitSize
+                os.remove(path)
+
+            planned += self.plan(list(zip(splitFiles, splitBytes)), level + 1)
+
+        return planned
+
+    def spill(self, df, numPartitions, level, numBytes):
+        """spill.  Write the rows of df to one new file per partition.
+        Returns partition index to (file, estimated bytes).
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            case rows
+        numPartitions : int
+            partitions to hash into
+        level : int
+            times split so far.  Each level hashes differently.
+        numBytes : int
+            memory used by df
+        """
+        codes = partitionCodes(df['case_number'], numPartitions, level)
+
+        spilled = {}
+        for i, part in df.groupby(codes, sort=False):
+            path = os.path.join(self.workDir, 'part-%06d.pkl' % self.numFiles)
+            self.numFiles += 1
+            part.to_pickle(path)
+            spilled[i] = (path, numBytes * part.shape[0] // df.shape[0])
+
+        return spilled
+
+    def load(self, files):
+        """load.  Read partition files into one dataframe.
+
+        Parameters
+        ----------
+        files : list[str]
+            partition files
+        """
+        return (pd.concat([pd.read_pickle(path) for path in files],
+                          ignore_index=True)
+                .reindex(columns=self.columns))
+
+
+def partitionCodes(caseNumbers, numPartitions, level=0):
+    """partitionCodes.  Partition of each case number.  Stable across runs and
+    processes.
+
+    Parameters
+    ----------
+    caseNumbers : pandas.Series
+        case numbers
+    numPartitions : int
+        partitions to hash into
+    level : int
+        hashes differently for each level
+    """
+    hashes = pd.util.hash_pandas_object(caseNumbers.astype(str), index=False,
+                                        hash_key='%016d' % level)
+
+    return (hashes.values % numPartitions).astype(int)
@@ -0,0 +1,157 @@
+from pandas.api.types import is_datetime64_any_dtype
+import numpy as np
+import pandas as pd
+
+# Formats tried, in order, before falling back to inference.  A format is used
+# for a column only if it reads every value in it.
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%m/%d/%Y',
+    '%m/%d/%y',
+    '%Y-%m-%d %H:%M:%S',
+    '%m/%d/%Y %H:%M:%S',
+]
+
+DATE_FEATURES = ['date', 'year', 'month', 'week', 'week_start']
+
+
+def dateFeatures(dates, errors='raise'):
+    """dateFeatures.  Normalize a column of dates and derive the features used
+    for filtering and rollups.  Every distinct value is parsed and derived
+    once, however many rows share it.
+
+    Returns a dataframe aligned with dates, with string columns date
+    (YYYY-MM-DD), year, month, week (ISO week number) and week_start (the
+    Monday starting the week).
+
+    Parameters
+    ----------
+    dates : pandas.Series
+        dates as strings in any one of DATE_FORMATS (or anything pandas can
+        infer), or as datetimes.
+    errors : str
+        passed to pandas.to_datetime.  'raise' by default.
+    """
+    dates = pd.Series(dates)
+    codes, uniques = uniqueDates(dates)
+    parsed = pd.Series(parseUnique(uniques, errors=errors))
+
+    weekday = pd.to_timedelta(parsed.dt.weekday.fillna(0), unit='D')
+    features = pd.DataFrame({
+        'date': parsed.dt.strftime('%Y-%m-%d'),
+        'year': parsed.dt.year.astype('Int64').astype(str),
+        'month': parsed.dt.month.astype('Int64').astype(str),
+        'week': parsed.dt.isocalendar().week.astype('Int64').astype(str),
+        'week_start': (parsed - weekday).dt.strftime('%Y-%m-%d'),
+    }, columns=DATE_FEATURES)
+
+    features = features.take(codes)
+    features.index = dates.index
+
+    return features
+
+
+def parseDates(dates, errors='raise'):
+    """parseDates.  Parse a column of dates to datetime64, parsing every
+    distinct value once.
+
+    Parameters
+    ----------
+    dates : pandas.Series
+        dates as strings or datetimes
+    errors : str
+        passed to pandas.to_datetime.  'raise' by default.
+    """
+    dates = pd.Series(dates)
+    codes, uniques = uniqueDates(dates)
+    parsed = parseUnique(uniques, errors=errors)
+
+    return pd.Series(parsed.take(codes), index=dates.index, name=dates.name)
+
+
+def toDateStrings(dates, errors='raise'):
+    """toDateStrings.  Normalize a column of dates to YYYY-MM-DD strings.
+
+    Parameters
+    ----------
+    dates : pandas.Series
+        dates as strings or datetimes
+    errors : str
+        passed to pandas.to_datetime.  'raise' by default.
+    """
+    return dateFeatures(dates, errors=errors)['date'].rename(
+        pd.Series(dates).name)
+
+
+def weekStarts(dates):
+    """weekStarts.  The Monday starting the week of each date, as YYYY-MM-DD
+    strings.
+
+    Parameters
+    ----------
+    dates : pandas.Series
+        dates as strings or datetimes
+    """
+    return dateFeatures(dates)['week_start'].rename(pd.Series(dates).name)
+
+
+def uniqueDates(dates):
+    """uniqueDates.  Factorize a column of dates.  Returns codes into the
+    distinct values, and the distinct values.  Missing values get a code one
+    past the last distinct value, so that position can be filled with NaT.
+
+    Parameters
+    ----------
+    dates : pandas.Series
+        dates as strings or datetimes
+    """
+    if not is_datetime64_any_dtype(dates):
+        dates = dates.astype(object).where(dates.notna(), None)
+
+    codes, uniques = pd.factorize(dates)
+    codes = np.where(codes == -1, len(uniques), codes)
+
+    return codes, uniques
+
+
+def parseUnique(uniques, errors='raise'):
+    """parseUnique.  Parse distinct date values, plus a trailing NaT for
+    missing values (see uniqueDates).  Returns a DatetimeIndex.
+
+    Parameters
+    ----------
+    uniques : array-like
+        distinct dates from uniqueDates
+    errors : str
+        passed to pandas.to_datetime.
+    """
+    if is_datetime64_any_dtype(uniques):
+        parsed = pd.DatetimeIndex(uniques)
+    else:
+        values = pd.Index(uniques, dtype=object).astype(str).str.strip()
+        fmt = detectFormat(values)
+        parsed = pd.DatetimeIndex(pd.to_datetime(
+            values, format=fmt, errors=errors,
+            infer_datetime_format=fmt is None))
+
+    return parsed.append(pd.DatetimeIndex([pd.NaT]))
+
+
+def detectFormat(values):
+    """detectFormat.  The first of DATE_FORMATS that reads every non-empty
+    value, or None if none does.
+
+    Parameters
+    ----------
+    values : pandas.Index
+        distinct date strings
+    """
+    values = values[values != '']
+    if len(values) == 0:
+        return None
+
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(values, format=fmt, errors='coerce').notna().all():
+            return fmt
+
+    return None
@@ -1,4 +1,6 @@
 from IPython import embed
+from analyze.action_history import historyFlags
+from analyze.dates import dateFeatures
 from datetime import date
 from functools import reduce
 import numpy as np
@@ -15,31 +17,44 @@ DERIVED_COLUMNS = [
 ]
 
 
-def addDerivedColumns(df):
+def addDerivedColumns(df, memo=None, processes=None, flags=None):
     """addDerivedColumns.  Adds flags and other helpful columns.
 
     Parameters
     ----------
     df : pandas.DataFrame
         All cases, including non-eviction cases.
+    memo : analyze.derived_memo.DerivedMemo
+        memoized flags.  Flags of action histories already in it are not
+        computed again.  All flags are computed by default.
+    processes : int
+        size of the process pool the action histories are split across.
+        Split in this process by default.  num_hearings is always counted
+        over the whole frame, since a case's rows may be in any chunk.
+    flags : pandas.DataFrame
+        flags already known, one row per row of df, e.g. from
+        action_history.caseFlags.  Computed from the action histories by
+        default.
     """
 
     # Infer scraped_on if not present
     if 'scraped_on' not in df.columns:
         df['scraped_on'] = str(date.today())
 
-    # Easier filtering
-    df['year'] = pd.to_datetime(df['date']).apply(
-        lambda date: date.year).astype(str)
-    df['month'] = pd.to_datetime(df['date']).apply(
-        lambda date: date.month).astype(str)
-    df['week'] = pd.to_datetime(df['date']).apply(
-        lambda date: date.week).astype(str)
-
-    # Add derived columns
-    df['writ_of_restitution'] = (df['action_history']
-                                 .apply(writOfRestitutionFlag))
-    df['evicted_flag'] = df['action_history'].apply(evictedFlag)
+    # Easier filtering.  Each distinct date is parsed once.
+    dateParts = dateFeatures(df['date'])
+    df['year'] = dateParts['year'].values
+    df['month'] = dateParts['month'].values
+    df['week'] = dateParts['week'].values
+
+    # Add derived columns.  The action histories are split once for all cases
+    # rather than once per case and flag.
+    if flags is None and memo is not None:
+        flags = memo.flags(df['action_history'], processes=processes)
+    elif flags is None:
+        flags = historyFlags(df['action_history'], processes=processes)
+    df['writ_of_restitution'] = flags['writ_of_restitution'].values
+    df['evicted_flag'] = flags['evicted_flag'].values
 
     # TODO: This might not be good to have here universally.
     numHearings = numHearingsPerCase(df)
@@ -66,7 +81,7 @@ def numHearingsPerCase(casesDf):
 
 def writOfRestitutionFlag(actionHistory):
     """writOfRestitutionFlag.  Simply looking for WRITOFRESTITUTION in the action
-    history.
+    history.  Single-case version of action_history.writOfRestitutionFlags.
 
     Parameters
     ----------
@@ -81,7 +96,7 @@ def writOfRestitutionFlag(actionHistory):
 
 def evictedFlag(actionHistory):
     """evictedFlag.  Flag true if the case had a writ of restitution, but was not
-    thrown out.
+    thrown out.  Single-case version of action_history.evictedFlags.
 
     Parameters
     ----------
@@ -0,0 +1,129 @@
+from analyze.action_history import (DERIVATION_VERSION, FLAG_COLUMNS,
+                                    historyFlags)
+from threading import Lock
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+
+
+class DerivedMemo:
+    """DerivedMemo.  Local memo of the action history flags, keyed by a hash of
+    the action history.
+
+    Flags depend on nothing but the action history, so a history seen on any
+    earlier run is looked up instead of parsed again.  Only new or changed
+    histories are computed.  The memo is stamped with
+    action_history.DERIVATION_VERSION and emptied when that changes.
+    """
+
+    def __init__(self, path='out/derived_memo.sqlite'):
+        """__init__.  Open (or create) a DerivedMemo.
+
+        Parameters
+        ----------
+        path : str
+            sqlite file for the memo.  Parent directories are created.
+            ':memory:' keeps the memo in memory.
+        """
+        self.path = path
+        self.lock = Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS flags (hash INTEGER PRIMARY KEY, %s)'
+            % ', '.join('%s INTEGER' % col for col in FLAG_COLUMNS))
+
+        version = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or version[0] != DERIVATION_VERSION:
+            if version is not None:
+                print('Derivation version changed from %s to %s.  Dropping '
+                      'memoized flags.' % (version[0], DERIVATION_VERSION))
+            self.conn.execute('DELETE FROM flags')
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (DERIVATION_VERSION,))
+        self.conn.commit()
+
+    def flags(self, actionHistories, processes=None):
+        """flags.  Same as action_history.historyFlags, computing only the
+        histories not memoized yet and memoizing them.
+
+        Parameters
+        ----------
+        actionHistories : pandas.Series
+            values from the action_history column
+        processes : int
+            size of the process pool to compute missing flags across.
+        """
+        # One history per distinct hash, taken where it first appears.
+        codes, hashes = pd.factorize(historyHashes(actionHistories))
+        firsts = np.unique(codes, return_index=True)[1]
+        histories = pd.Series(actionHistories).iloc[firsts]
+
+        with self.lock:
+            known = self.lookup(hashes)
+            missing = np.flatnonzero(~np.isin(hashes, known.index.values))
+
+            if len(missing) > 0:
+                computed = historyFlags(histories.iloc[missing],
+                                        processes=processes)
+                computed.index = hashes[missing]
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO flags VALUES (%s)'
+                    % ', '.join('?' * (len(FLAG_COLUMNS) + 1)),
+                    [[int(h)] + [bool(val) for val in row]
+                     for h, row in zip(computed.index, computed.values)])
+                self.conn.commit()
+                known = pd.concat([known, computed])
+
+        print('Derived flags for %d of %d distinct histories.'
+              % (len(missing), len(hashes)))
+
+        return (known.reindex(hashes[codes])
+                .reset_index(drop=True)
+                .astype(bool))
+
+    def lookup(self, hashes):
+        """lookup.  Memoized flags of hashes, indexed by hash.  Caller must
+        hold the lock.
+
+        Parameters
+        ----------
+        hashes : numpy.ndarray
+            history hashes to look up
+        """
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted '
+                          '(hash INTEGER PRIMARY KEY)')
+        self.conn.execute('DELETE FROM wanted')
+        self.conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)',
+                              [(int(h),) for h in hashes])
+
+        found = pd.read_sql_query(
+            'SELECT flags.* FROM flags JOIN wanted USING (hash)', self.conn)
+
+        return (found.set_index('hash')[FLAG_COLUMNS]
+                .astype(bool))
+
+
+def historyHashes(actionHistories):
+    """historyHashes.  64 bit hash of each action history, as signed integers
+    to fit sqlite.  Missing histories hash like empty ones.
+
+    Parameters
+    ----------
+    actionHistories : pandas.Series
+        values from the action_history column
+    """
+    histories = pd.Series(actionHistories).fillna('').astype(str)
+
+    return (pd.util.hash_pandas_object(histories, index=False)
+            .values.view(np.int64))
@@ -0,0 +1,481 @@
+from threading import Lock
+import os
+import pandas as pd
+import sqlite3
+
+# Tokens that say what kind of entity a name is rather than which one.
+LEGAL_TOKENS = [
+    'THE', 'LLC', 'LLLP', 'LLP', 'LP', 'INC', 'INCORPORATED', 'CO', 'COMPANY',
+    'CORP', 'CORPORATION', 'LTD', 'LIMITED', 'PLLC', 'PC', 'NA', 'DBA',
+]
+
+LEGAL_PATTERN = r'\b(?:%s)\b' % '|'.join(LEGAL_TOKENS)
+
+# Name columns resolved into entities, each to a <column>_entity column.
+ENTITY_COLUMNS = ['plaintiff', 'plaintiff_attorney']
+
+# Layout of the store.  Stores of an older version keep their entities and
+# have the 3-gram index built from their names.
+STORE_VERSION = 2
+
+
+class EntityResolver:
+    """EntityResolver.  Groups the spellings of plaintiff and attorney names
+    into entities with stable IDs, kept in sqlite across runs.
+
+    Names are normalized first, and a normalized name seen before keeps its
+    entity.  New names are only compared with names they share a rare word or
+    word pair with (the blocking index), scored by the Jaccard similarity of
+    their character 3-grams, and clustered with every name they match.  The
+    3-grams of every known name are stored with it, so only new names are
+    split into 3-grams.  A
+    cluster that reaches an existing entity joins it, otherwise it becomes a
+    new entity.  Existing entities are never renumbered.
+    """
+
+    def __init__(self, path='out/entities.sqlite', threshold=0.6,
+                 maxBlockSize=50):
+        """__init__.  Open (or create) an EntityResolver.
+
+        Parameters
+        ----------
+        path : str
+            sqlite file for the entities.  Parent directories are created.
+        threshold : float
+            3-gram Jaccard similarity at which two names are the same entity.
+        maxBlockSize : int
+            words and word pairs shared by more names than this are too
+            common to block on.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.maxBlockSize = maxBlockSize
+        self.lock = Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS names ('
+            'kind TEXT, name TEXT, entity_id INTEGER, '
+            'PRIMARY KEY (kind, name))')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entities ('
+            'kind TEXT, entity_id INTEGER, canonical TEXT, '
+            'PRIMARY KEY (kind, entity_id))')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS grams ('
+            'kind TEXT, name TEXT, gram TEXT)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS grams_name ON grams (kind, name)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+        version = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or version[0] != STORE_VERSION:
+            self.conn.execute('DELETE FROM grams')
+            known = pd.read_sql_query('SELECT kind, name FROM names',
+                                      self.conn)
+            for kind, names in known.groupby('kind')['name']:
+                self.insertGrams(kind, names.reset_index(drop=True),
+                                 nameGrams(names.reset_index(drop=True)))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (STORE_VERSION,))
+        self.conn.commit()
+
+    def resolveColumn(self, joined, kind, canonical=False):
+        """resolveColumn.  Entities for a column of joined names, such as
+        plaintiff.  Each value becomes its distinct entity IDs (or canonical
+        names), sorted and joined with '| '.
+
+        Parameters
+        ----------
+        joined : pandas.Series
+            names joined with '| ' as by DenverCaseScraper.collect
+        kind : str
+            kind of name, e.g. the column name.  Entities are per kind.
+        canonical : bool
+            the canonical names of the entities rather than their IDs
+        """
+        # Resolved once per distinct value.
+        codes, uniques = pd.factorize(joined.fillna('').astype(str))
+        names = splitNames(pd.Series(uniques))
+        entities = self.resolve(names['name'], kind).dropna().astype(int)
+        if canonical:
+            entities = entities.map(self.canonicalNames(kind)
+                                    .set_index('entity_id')['canonical'])
+
+        resolved = (entities
+                    .groupby(names['row']).agg(
+                        lambda x: '| '.join(str(i) for i in sorted(set(x))))
+                    .reindex(range(len(uniques)), fill_value=''))
+
+        return pd.Series(resolved.values[codes], index=joined.index)
+
+    def resolve(self, names, kind):
+        """resolve.  Entity ID of every name, assigning new entities to names
+        not seen before.  Empty names get None.
+
+        Parameters
+        ----------
+        names : pandas.Series
+            one name per value
+        kind : str
+            kind of name.  Entities are per kind.
+        """
+        normalized = normalizeNames(names)
+        unique = normalized[normalized != ''].unique()
+
+        with self.lock:
+            known = pd.read_sql_query(
+                'SELECT name, entity_id FROM names WHERE kind = ?',
+                self.conn, params=(kind,))
+            isNew = ~pd.Series(unique).isin(known['name'])
+
+            if isNew.any():
+                assigned = self.assignNew(kind, known, unique[isNew.values],
+                                          names, normalized)
+                known = pd.concat([known, assigned], ignore_index=True)
+                self.conn.commit()
+
+        entityIds = known.set_index('name')['entity_id']
+
+        return normalized.map(entityIds).where(normalized != '', None)
+
+    def assignNew(self, kind, known, newNames, names, normalized):
+        """assignNew.  Match new normalized names against each other and the
+        known ones, store their entities, and return them as name and
+        entity_id.  Caller must hold the lock.
+
+        Parameters
+        ----------
+        kind : str
+            kind of name
+        known : pandas.DataFrame
+            known names and their entity_id
+        newNames : numpy.ndarray
+            new normalized names
+        names : pandas.Series
+            raw names, for picking canonical spellings
+        normalized : pandas.Series
+            names, normalized
+        """
+        allNames = pd.Series(list(known['name']) + list(newNames))
+        numKnown = known.shape[0]
+
+        pairs = blockPairs(allNames, numKnown, self.maxBlockSize)
+        pairs = pairs[numbersAgree(allNames, pairs)]
+
+        # Known names' 3-grams come from the store.
+        newGrams = nameGrams(allNames[numKnown:])
+        knownPositions = pd.unique(pd.concat([pairs['a'], pairs['b']]))
+        grams = pd.concat([
+            self.storedGrams(kind, allNames,
+                             knownPositions[knownPositions < numKnown]),
+            newGrams], ignore_index=True)
+        pairs = pairs[jaccard(pairs, grams) >= self.threshold]
+
+        # Each cluster takes the lowest known entity in it.  Clusters of new
+        # names only get new entities.
+        clusterOf = clusters(len(allNames), pairs['a'].values,
+                             pairs['b'].values)
+        clusterEntity = {}
+        for cluster, entityId in zip(clusterOf[:numKnown], known['entity_id']):
+            clusterEntity[cluster] = min(entityId,
+                                         clusterEntity.get(cluster, entityId))
+
+        nextId = self.conn.execute(
+            'SELECT COALESCE(MAX(entity_id), 0) + 1 FROM entities '
+            'WHERE kind = ?', (kind,)).fetchone()[0]
+        newEntities = []
+        newIds = []
+        for cluster in clusterOf[numKnown:]:
+            if cluster not in clusterEntity:
+                clusterEntity[cluster] = nextId
+                newEntities.append(nextId)
+                nextId += 1
+            newIds.append(clusterEntity[cluster])
+
+        assigned = pd.DataFrame({
+            'name': allNames[numKnown:].values,
+            'entity_id': newIds,
+        })
+
+        # The most common raw spelling names a new entity.
+        spellings = (pd.DataFrame({'raw': names.values,
+                                   'name': normalized.values})
+                     .merge(assigned, on='name'))
+        canonical = (spellings[spellings['entity_id'].isin(newEntities)]
+                     .groupby(['entity_id', 'raw']).size()
+                     .reset_index(name='n')
+                     .sort_values(['entity_id', 'n', 'raw'],
+                                  ascending=[True, False, True])
+                     .drop_duplicates('entity_id'))
+
+        self.conn.executemany(
+            'INSERT INTO names VALUES (?, ?, ?)',
+            [(kind, name, int(entityId)) for name, entityId
+             in zip(assigned['name'], assigned['entity_id'])])
+        self.conn.executemany(
+            'INSERT INTO entities VALUES (?, ?, ?)',
+            [(kind, int(entityId), raw) for entityId, raw
+             in zip(canonical['entity_id'], canonical['raw'])])
+        self.insertGrams(kind, allNames, newGrams)
+
+        return assigned
+
+    def storedGrams(self, kind, names, positions):
+        """storedGrams.  Stored 3-grams of the known names at positions of
+        names, as name position and gram.  Caller must hold the lock.
+
+        Parameters
+        ----------
+        kind : str
+            kind of name
+        names : pandas.Series
+            distinct normalized names
+        positions : numpy.ndarray
+            positions of known names in names
+        """
+        positionOf = pd.Series(positions, index=names.iloc[positions].values)
+        chunks = []
+        for i in range(0, len(positions), 500):
+            chunk = positionOf.index[i:i + 500].tolist()
+            chunks.extend(self.conn.execute(
+                'SELECT name, gram FROM grams WHERE kind = ? AND name IN (%s)'
+                % ', '.join('?' * len(chunk)), [kind] + chunk).fetchall())
+
+        grams = pd.DataFrame(chunks, columns=['name', 'gram'])
+        grams['name'] = grams['name'].map(positionOf)
+
+        return grams
+
+    def insertGrams(self, kind, names, grams):
+        """insertGrams.  Store 3-grams of names, without committing.  Caller
+        must hold the lock, or be opening the store.
+
+        Parameters
+        ----------
+        kind : str
+            kind of name
+        names : pandas.Series
+            normalized names
+        grams : pandas.DataFrame
+            name positions in names and grams, as from nameGrams
+        """
+        self.conn.executemany(
+            'INSERT INTO grams VALUES (?, ?, ?)',
+            zip([kind] * grams.shape[0], names.loc[grams['name']].tolist(),
+                grams['gram'].tolist()))
+
+    def canonicalNames(self, kind):
+        """canonicalNames.  Every entity of a kind with its canonical name.
+
+        Parameters
+        ----------
+        kind : str
+            kind of name
+        """
+        with self.lock:
+            return pd.read_sql_query(
+                'SELECT entity_id, canonical FROM entities WHERE kind = ? '
+                'ORDER BY entity_id', self.conn, params=(kind,))
+
+
+def addEntityColumns(casesDf, resolver, columns=ENTITY_COLUMNS):
+    """addEntityColumns.  Add a <column>_entity column for each name column,
+    holding the canonical names of its entities joined with '| '.  Cases are
+    rolled up by landlord and attorney this way, rather than by spelling.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases
+    resolver : EntityResolver
+        resolver holding the entities
+    columns : list[str]
+        name columns to resolve
+    """
+    casesDf = casesDf.copy()
+    for col in columns:
+        casesDf[col + '_entity'] = resolver.resolveColumn(
+            casesDf[col], col, canonical=True)
+
+    return casesDf
+
+
+def splitNames(joined):
+    """splitNames.  Split a column of names joined with '| ' into one name per
+    row, with the position of the value it came from in row.  Names are only
+    split on '|', since a name itself may be 'LAST, FIRST'.
+
+    Parameters
+    ----------
+    joined : pandas.Series
+        names joined with '| '
+    """
+    parts = (joined.reset_index(drop=True)
+             .fillna('').astype(str)
+             .str.split('|')
+             .explode()
+             .str.strip())
+    parts = parts[parts != '']
+
+    return (parts.rename_axis('row')
+            .reset_index(name='name')[['row', 'name']])
+
+
+def normalizeNames(names):
+    """normalizeNames.  Upper case, '&' as AND, no punctuation (so L.L.C. is
+    LLC), no legal suffixes, single spaces.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        raw names
+    """
+    return (names.fillna('').astype(str)
+            .str.upper()
+            .str.replace('&', ' AND ', regex=False)
+            .str.replace('.', '', regex=False)
+            .str.replace(r'[^A-Z0-9 ]+', ' ', regex=True)
+            .str.replace(LEGAL_PATTERN, ' ', regex=True)
+            .str.split()
+            .str.join(' '))
+
+
+def blockPairs(names, numKnown, maxBlockSize):
+    """blockPairs.  Candidate pairs of names that share a word or a pair of
+    adjacent words, leaving out words and pairs shared by more than
+    maxBlockSize names.  Every pair involves a new name.  Returns positions a <
+    b.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        normalized names, known ones first
+    numKnown : int
+        number of known names at the start of names
+    maxBlockSize : int
+        largest block to pair up
+    """
+    words = names.str.split()
+    keys = (words + words.apply(
+        lambda w: [a + ' ' + b for a, b in zip(w[:-1], w[1:])]))
+    keys = (keys.explode().dropna()
+            .rename_axis('name').reset_index(name='key')
+            .drop_duplicates())
+
+    blockSize = keys.groupby('key')['name'].transform('size')
+    keys = keys[(blockSize > 1) & (blockSize <= maxBlockSize)]
+
+    pairs = (keys[keys['name'] >= numKnown]
+             .merge(keys, on='key', suffixes=('_new', '_other')))
+    pairs = pairs[pairs['name_new'] != pairs['name_other']]
+
+    a = pairs[['name_new', 'name_other']].min(axis=1)
+    b = pairs[['name_new', 'name_other']].max(axis=1)
+
+    return (pd.DataFrame({'a': a.values, 'b': b.values})
+            .drop_duplicates()
+            .reset_index(drop=True))
+
+
+def numbersAgree(names, pairs):
+    """numbersAgree.  Whether each pair of names has the same numbers in it.
+    Names like TOWER 1 and TOWER 2 are close by any string measure but are
+    usually different entities.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        normalized names
+    pairs : pandas.DataFrame
+        positions a and b into names
+    """
+    numbers = names.str.findall(r'\d+').str.join(' ')
+
+    return pd.Series(numbers.reindex(pairs['a']).values ==
+                     numbers.reindex(pairs['b']).values, index=pairs.index)
+
+
+def nameGrams(names):
+    """nameGrams.  Distinct character 3-grams of each name, padded with a
+    space either side, as name (the index label in names) and gram.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        normalized names
+    """
+    padded = ' ' + names + ' '
+
+    return (padded.apply(lambda s: [s[i:i + 3] for i in range(len(s) - 2)])
+            .explode()
+            .rename_axis('name').reset_index(name='gram')
+            .drop_duplicates()
+            .reset_index(drop=True))
+
+
+def jaccard(pairs, grams):
+    """jaccard.  Jaccard similarity of the character 3-grams of each pair of
+    names, counted with merges rather than per pair.
+
+    Parameters
+    ----------
+    pairs : pandas.DataFrame
+        name positions a and b
+    grams : pandas.DataFrame
+        name positions and their grams, as from nameGrams.  Must cover every
+        name in pairs.
+    """
+    if pairs.shape[0] == 0:
+        return pd.Series([], dtype=float)
+
+    sizes = grams.groupby('name').size()
+
+    shared = (pairs
+              .merge(grams, left_on='a', right_on='name')[['a', 'b', 'gram']]
+              .merge(grams, left_on=['b', 'gram'], right_on=['name', 'gram'])
+              .groupby(['a', 'b']).size())
+    shared = (pairs.set_index(['a', 'b']).index
+              .map(shared).fillna(0).values)
+
+    union = (sizes.reindex(pairs['a']).values +
+             sizes.reindex(pairs['b']).values - shared)
+
+    return pd.Series(shared / union, index=pairs.index)
+
+
+def clusters(numItems, a, b):
+    """clusters.  Connected components of pairs, by union-find.  Returns the
+    root of each item's component.
+
+    Parameters
+    ----------
+    numItems : int
+        number of items
+    a : numpy.ndarray
+        first item of each pair
+    b : numpy.ndarray
+        second item of each pair
+    """
+    parent = list(range(numItems))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(a, b):
+        rootI, rootJ = find(i), find(j)
+        if rootI != rootJ:
+            parent[max(rootI, rootJ)] = min(rootI, rootJ)
+
+    return [find(i) for i in range(numItems)]
@@ -0,0 +1,356 @@
+from threading import Lock
+import os
+import pandas as pd
+import sqlite3
+
+# Counts rolled up for every period.
+COUNTS = ['num_fed_hearings', 'num_writ_restitution', 'num_evictions']
+
+# Case columns the rollups can be broken down by.  The _entity columns group
+# spellings of a name, see analyze.entity_resolution.addEntityColumns.
+DIMENSIONS = ['room', 'plaintiff', 'plaintiff_attorney', 'plaintiff_entity',
+              'plaintiff_attorney_entity']
+
+# Keys of each stored rollup.  Totals and room breakdowns are summed from the
+# counts per day and room.  Plaintiffs and attorneys take too many values for
+# that to collapse, so they are kept per month, one name column (with its
+# entities) at a time.  Weeks, quarters and breakdowns are summed from these by
+# analyze.agg_cube.AggCube.
+ROLLUPS = {
+    'daily': ['date', 'room'],
+    'monthly_plaintiff': ['month_start', 'plaintiff', 'plaintiff_entity'],
+    'monthly_plaintiff_attorney': ['month_start', 'plaintiff_attorney',
+                                   'plaintiff_attorney_entity'],
+}
+
+CONTRIBUTION_COLUMNS = ['case_number', 'date'] + DIMENSIONS + COUNTS
+
+# Layout of the store.  Stores of another version are emptied, and rebuilt on
+# their next use.
+STORE_VERSION = 5
+
+
+class RollupStore:
+    """RollupStore.  Persisted rollups of the case history, broken down by
+    DIMENSIONS as ROLLUPS lists, kept in sqlite.
+
+    Alongside the per-day sums it keeps what each case row contributed to
+    them, so a batch of new or changed cases is applied by subtracting the old
+    contributions of those case numbers and adding the new ones.  Only the
+    days and months a batch touches are written.  Each contribution is stored
+    with a digest of itself, so callers can check the store still matches a
+    history.  Callers can also mark the store with the version of the history
+    it was last brought up to date with, see mark.
+    """
+
+    def __init__(self, path='out/rollups.sqlite'):
+        """__init__.  Open (or create) a RollupStore.
+
+        Parameters
+        ----------
+        path : str
+            sqlite file for the store.  Parent directories are created.
+            ':memory:' keeps the store in memory.
+        """
+        self.path = path
+        self.lock = Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+        version = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or version[0] != STORE_VERSION:
+            if version is not None:
+                print('Rollup store version changed from %s to %s.  Dropping '
+                      'stored rollups.' % (version[0], STORE_VERSION))
+            for name in ['contributions'] + list(ROLLUPS):
+                self.conn.execute('DROP TABLE IF EXISTS %s' % name)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (STORE_VERSION,))
+
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS contributions (%s, %s, digest INTEGER)'
+            % (', '.join('%s TEXT' % col for col in CONTRIBUTION_COLUMNS
+                         if col not in COUNTS),
+               ', '.join('%s INTEGER' % count for count in COUNTS)))
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS contributions_case_number '
+            'ON contributions (case_number)')
+        for name, keys in ROLLUPS.items():
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s (%s, %s, PRIMARY KEY (%s))' % (
+                    name,
+                    ', '.join('%s TEXT' % key for key in keys),
+                    ', '.join('%s INTEGER' % count for count in COUNTS),
+                    ', '.join(keys)))
+        self.conn.commit()
+
+    def numRows(self, caseNumbers=None):
+        """numRows.  Number of case rows rolled up.
+
+        Parameters
+        ----------
+        caseNumbers : list[str]
+            only count the rows of these case numbers.  Every row if None.
+        """
+        with self.lock:
+            if caseNumbers is None:
+                return self.conn.execute(
+                    'SELECT COUNT(*) FROM contributions').fetchone()[0]
+
+            numRows = 0
+            for i in range(0, len(caseNumbers), 500):
+                chunk = caseNumbers[i:i + 500]
+                numRows += self.conn.execute(
+                    'SELECT COUNT(*) FROM contributions '
+                    'WHERE case_number IN (%s)' % ', '.join('?' * len(chunk)),
+                    chunk).fetchone()[0]
+
+            return numRows
+
+    def digests(self):
+        """digests.  case_number and digest of every stored case row.  See
+        contributionDigests.  """
+        with self.lock:
+            return pd.DataFrame(
+                self.conn.execute(
+                    'SELECT case_number, digest FROM contributions'
+                ).fetchall(),
+                columns=['case_number', 'digest'])
+
+    def rebuild(self, contributions):
+        """rebuild.  Replace everything with rollups of contributions.
+
+        Parameters
+        ----------
+        contributions : pandas.DataFrame
+            one row per case row with CONTRIBUTION_COLUMNS
+        """
+        with self.lock:
+            self.deleteAll()
+            self.insertContributions(contributions)
+            contributions = withMonthStarts(contributions)
+            for name, keys in ROLLUPS.items():
+                sums = contributions.groupby(keys)[COUNTS].sum().reset_index()
+                self.conn.executemany(
+                    'INSERT INTO %s VALUES (%s)' % (
+                        name, ', '.join('?' * (len(keys) + len(COUNTS)))),
+                    rowsOf(sums, keys + COUNTS))
+            self.conn.commit()
+
+    def clear(self):
+        """clear.  Remove every case row and rollup.  """
+        with self.lock:
+            self.deleteAll()
+            self.conn.commit()
+
+    def deleteAll(self):
+        """deleteAll.  Delete every row of every table, and the mark, without
+        committing.  Caller must hold the lock.  """
+        self.conn.execute('DELETE FROM contributions')
+        for name in ROLLUPS:
+            self.conn.execute('DELETE FROM %s' % name)
+        self.conn.execute("DELETE FROM meta WHERE key = 'marker'")
+
+    def update(self, contributions):
+        """update.  Apply a batch of new or changed cases.  Every stored row
+        of a case number in the batch is replaced by the batch's rows.
+
+        Parameters
+        ----------
+        contributions : pandas.DataFrame
+            one row per case row with CONTRIBUTION_COLUMNS
+        """
+        # Nothing changed, and an empty batch would not sum.
+        if contributions.shape[0] == 0:
+            return
+
+        caseNumbers = contributions['case_number'].unique().tolist()
+
+        with self.lock:
+            old = self.oldContributions(caseNumbers)
+
+            signed = withMonthStarts(
+                pd.concat([contributions, old], ignore_index=True))
+            sign = [1] * contributions.shape[0] + [-1] * old.shape[0]
+            signed[COUNTS] = signed[COUNTS].mul(sign, axis=0)
+
+            for name, keys in ROLLUPS.items():
+                delta = signed.groupby(keys)[COUNTS].sum().reset_index()
+                delta = delta[(delta[COUNTS] != 0).any(axis=1)]
+                self.applyDelta(name, keys, delta)
+
+            self.replaceContributions(caseNumbers, contributions)
+            self.conn.execute("DELETE FROM meta WHERE key = 'marker'")
+            self.conn.commit()
+
+    def mark(self, marker):
+        """mark.  Record that the store matches the version marker of a
+        history, e.g. the modifiedTime of the worksheet it was uploaded to.
+        The mark is dropped by the next update, rebuild or clear.
+
+        Parameters
+        ----------
+        marker : str
+            version of the history
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('marker', ?)", (marker,))
+            self.conn.commit()
+
+    def marker(self):
+        """marker.  The version marked by mark since the store last changed,
+        or None.  """
+        with self.lock:
+            found = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'marker'").fetchone()
+
+        return None if found is None else found[0]
+
+    def rollup(self, name):
+        """rollup.  Sums per key for one of ROLLUPS.
+
+        Parameters
+        ----------
+        name : str
+            'daily', 'monthly_plaintiff' or 'monthly_plaintiff_attorney'
+        """
+        with self.lock:
+            return pd.read_sql_query('SELECT * FROM %s' % name, self.conn)
+
+    def applyDelta(self, name, keys, delta):
+        """applyDelta.  Add delta to the sums of the periods it touches.
+        Caller must hold the lock.
+
+        Parameters
+        ----------
+        name : str
+            rollup table
+        keys : list[str]
+            key columns of the rollup
+        delta : pandas.DataFrame
+            keys and count changes, one row per touched period
+        """
+        where = ' AND '.join('%s = ?' % key for key in keys)
+        for row in rowsOf(delta, keys + COUNTS):
+            key, counts = row[:len(keys)], row[len(keys):]
+            updated = self.conn.execute(
+                'UPDATE %s SET %s WHERE %s' % (
+                    name,
+                    ', '.join('%s = %s + ?' % (c, c) for c in COUNTS),
+                    where),
+                counts + key).rowcount
+            if updated == 0:
+                self.conn.execute(
+                    'INSERT INTO %s VALUES (%s)' % (
+                        name, ', '.join('?' * len(row))),
+                    row)
+
+        self.conn.execute(
+            'DELETE FROM %s WHERE num_fed_hearings <= 0' % name)
+
+    def oldContributions(self, caseNumbers):
+        """oldContributions.  Stored contributions of caseNumbers.  Caller must
+        hold the lock.
+
+        Parameters
+        ----------
+        caseNumbers : list[str]
+            case numbers to look up
+        """
+        chunks = []
+        for i in range(0, len(caseNumbers), 500):
+            chunk = caseNumbers[i:i + 500]
+            chunks.extend(self.conn.execute(
+                'SELECT %s FROM contributions WHERE case_number IN (%s)'
+                % (', '.join(CONTRIBUTION_COLUMNS),
+                   ', '.join('?' * len(chunk))), chunk).fetchall())
+
+        return pd.DataFrame(chunks, columns=CONTRIBUTION_COLUMNS)
+
+    def replaceContributions(self, caseNumbers, contributions):
+        """replaceContributions.  Drop the stored contributions of
+        caseNumbers and store contributions in their place.  Caller must hold
+        the lock.
+
+        Parameters
+        ----------
+        caseNumbers : list[str]
+            case numbers to replace
+        contributions : pandas.DataFrame
+            one row per case row with CONTRIBUTION_COLUMNS
+        """
+        for i in range(0, len(caseNumbers), 500):
+            chunk = caseNumbers[i:i + 500]
+            self.conn.execute(
+                'DELETE FROM contributions WHERE case_number IN (%s)'
+                % ', '.join('?' * len(chunk)), chunk)
+
+        self.insertContributions(contributions)
+
+    def insertContributions(self, contributions):
+        """insertContributions.  Store contributions with their digests.
+        Caller must hold the lock.
+
+        Parameters
+        ----------
+        contributions : pandas.DataFrame
+            one row per case row with CONTRIBUTION_COLUMNS
+        """
+        rows = contributions[CONTRIBUTION_COLUMNS].assign(
+            digest=contributionDigests(contributions))
+        self.conn.executemany(
+            'INSERT INTO contributions VALUES (%s)'
+            % ', '.join('?' * (len(CONTRIBUTION_COLUMNS) + 1)),
+            rowsOf(rows, CONTRIBUTION_COLUMNS + ['digest']))
+
+
+def contributionDigests(contributions):
+    """contributionDigests.  A 64-bit digest of each contribution, as signed
+    integers for sqlite.  Equal contributions have equal digests whatever
+    their dtypes, since every column is hashed as strings.
+
+    Parameters
+    ----------
+    contributions : pandas.DataFrame
+        one row per case row with CONTRIBUTION_COLUMNS
+    """
+    return (pd.util.hash_pandas_object(
+        contributions[CONTRIBUTION_COLUMNS].astype(str), index=False)
+        .values.view('int64'))
+
+
+def withMonthStarts(contributions):
+    """withMonthStarts.  contributions with a month_start column, the first
+    day of the month of each date as YYYY-MM-DD.
+
+    Parameters
+    ----------
+    contributions : pandas.DataFrame
+        one row per case row with CONTRIBUTION_COLUMNS
+    """
+    return contributions.assign(
+        month_start=contributions['date'].str[:8] + '01')
+
+
+def rowsOf(df, columns):
+    """rowsOf.  Rows of df as lists of plain python values, for sqlite.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        frame to read
+    columns : list[str]
+        columns to take, in order
+    """
+    return [[val.item() if hasattr(val, 'item') else val for val in row]
+            for row in df[columns].itertuples(index=False, name=None)]
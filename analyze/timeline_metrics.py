@@ -0,0 +1,263 @@
+from analyze.action_history import CASE_KEYS, DISMISSALS, WRIT, historyEvents
+import numpy as np
+import pandas as pd
+
+# Per case durations and counts read off the action history.
+TIMELINE_METRICS = [
+    'days_to_writ',
+    'days_writ_to_dismissal',
+    'days_to_judgment',
+    'num_continuances',
+    'hearings_before_judgment',
+]
+
+PERCENTILES = [0.25, 0.5, 0.75, 0.9]
+
+# Metrics measured in days, which histograms bin by DAY_BINS.
+DAY_METRICS = ['days_to_writ', 'days_writ_to_dismissal', 'days_to_judgment']
+
+# Histogram bins in days: [0, 7), [7, 14), ... [365, inf).
+DAY_BINS = [0, 7, 14, 30, 60, 90, 180, 365, np.inf]
+
+
+def timelineMetrics(actionHistories):
+    """timelineMetrics.  TIMELINE_METRICS for every case at once, in one pass
+    over the split action histories.  Returns a dataframe with one row per
+    history, in order.  For cases with an action events table, see
+    eventTimelineMetrics.
+
+    Parameters
+    ----------
+    actionHistories : pandas.Series
+        values from the action_history column
+    """
+    return caseMetrics(historyEvents(actionHistories), len(actionHistories))
+
+
+def eventTimelineMetrics(events):
+    """eventTimelineMetrics.  TIMELINE_METRICS straight from an action events
+    table, without splitting any action history.  Returns one row per case
+    with CASE_KEYS and a column per metric.
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        output of analyze.action_history.eventTable
+    """
+    keys = events[CASE_KEYS].astype(str)
+    grouped = keys.groupby(CASE_KEYS, sort=False)
+    cases = grouped.size().reset_index()[CASE_KEYS]
+
+    metrics = caseMetrics(pd.DataFrame({
+        'case': grouped.ngroup().values,
+        'timestamp': events['timestamp'].values,
+        'action': events['action'].values,
+    }), cases.shape[0])
+
+    return pd.concat([cases, metrics], axis=1)
+
+
+def caseMetrics(events, numCases):
+    """caseMetrics.  TIMELINE_METRICS per case from a long table of events.
+    Durations are NaN for cases that never reached the events they measure.
+
+    days_to_writ
+        first action to first writ of restitution
+    days_writ_to_dismissal
+        latest writ to the first dismissal on or after it
+    days_to_judgment
+        first action to first judgment
+    num_continuances
+        actions continuing the case
+    hearings_before_judgment
+        hearing actions before the first judgment
+
+    Parameters
+    ----------
+    events : pandas.DataFrame
+        case (position of the case, from 0), timestamp and normalized action
+        of every event
+    numCases : int
+        number of cases
+    """
+    case = events['case']
+    timestamp = events['timestamp']
+    # String matches run once per distinct action.
+    action = events['action'].astype('category')
+
+    def firstWhere(mask):
+        return (timestamp.where(mask).groupby(case).min()
+                .reindex(range(numCases)))
+
+    def lastWhere(mask):
+        return (timestamp.where(mask).groupby(case).max()
+                .reindex(range(numCases)))
+
+    def countWhere(mask):
+        return (mask.groupby(case).sum()
+                .reindex(range(numCases), fill_value=0))
+
+    firstAction = firstWhere(timestamp.notna())
+    firstWrit = firstWhere(action == WRIT)
+    latestWrit = lastWhere(action == WRIT)
+    dismissalAfterWrit = firstWhere(
+        action.isin(DISMISSALS) & (timestamp >= case.map(latestWrit)))
+    firstJudgment = firstWhere(action.str.startswith('JUDGMENT'))
+    hearingsBeforeJudgment = countWhere(
+        action.str.contains('HEARING') &
+        (timestamp < case.map(firstJudgment)))
+
+    return pd.DataFrame({
+        'days_to_writ': (firstWrit - firstAction).dt.days,
+        'days_writ_to_dismissal': (dismissalAfterWrit - latestWrit).dt.days,
+        'days_to_judgment': (firstJudgment - firstAction).dt.days,
+        'num_continuances': countWhere(action.str.contains('CONTINU')),
+        'hearings_before_judgment': (hearingsBeforeJudgment
+                                     .where(firstJudgment.notna())),
+    }, columns=TIMELINE_METRICS).reset_index(drop=True)
+
+
+def addTimelineColumns(casesDf, events=None):
+    """addTimelineColumns.  Adds TIMELINE_METRICS columns to cases, as
+    nullable integers.  Cases found in events get their metrics from it, and
+    the rest from their action history.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases with CASE_KEYS and action_history
+    events : pandas.DataFrame
+        action events of some or all of the cases, as from
+        analyze.action_history.eventTable
+    """
+    if events is None:
+        metrics = timelineMetrics(casesDf['action_history'])
+    else:
+        metrics = (casesDf[CASE_KEYS].astype(str).reset_index(drop=True)
+                   .merge(eventTimelineMetrics(events), on=CASE_KEYS,
+                          how='left', indicator=True))
+        missing = (metrics['_merge'] == 'left_only').values
+        if missing.any():
+            metrics.loc[missing, TIMELINE_METRICS] = timelineMetrics(
+                casesDf['action_history'][missing]).values
+
+    casesDf = casesDf.copy()
+    for col in TIMELINE_METRICS:
+        casesDf[col] = (metrics[col].astype(float).round()
+                        .astype('Int64').values)
+
+    return casesDf
+
+
+def fillTimelineColumns(casesDf):
+    """fillTimelineColumns.  Adds TIMELINE_METRICS to the cases that lack
+    them, such as cases kept from before the metrics were, from their action
+    history.  Cases with metrics keep them.  num_continuances is set for
+    every case with metrics.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases with action_history, some with TIMELINE_METRICS columns
+    """
+    if not all(col in casesDf.columns for col in TIMELINE_METRICS):
+        return addTimelineColumns(casesDf)
+
+    missing = casesDf['num_continuances'].isna().values
+    if not missing.any():
+        return casesDf
+
+    filled = addTimelineColumns(casesDf[missing])
+    casesDf = casesDf.copy()
+    for col in TIMELINE_METRICS:
+        values = casesDf[col].astype('Int64')
+        values[missing] = filled[col].values
+        casesDf[col] = values
+
+    return casesDf
+
+
+def timelineStats(casesDf, by, metrics=None, percentiles=None):
+    """timelineStats.  Percentiles of timeline metrics per group, e.g. per
+    week, room or plaintiff.  Columns are <metric>_p<percentile>, plus
+    num_cases.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases with action_history, or with TIMELINE_METRICS already added
+    by : list[str]
+        columns to group by
+    metrics : list[str]
+        metrics to summarize.  TIMELINE_METRICS by default.
+    percentiles : list[float]
+        percentiles as fractions.  PERCENTILES by default.
+    """
+    metrics = metrics or TIMELINE_METRICS
+    percentiles = percentiles or PERCENTILES
+    df = withMetrics(casesDf, by, metrics)
+
+    grouped = df.groupby(by)
+    stats = (grouped[metrics]
+             .quantile(percentiles)
+             .unstack(level=-1))
+    stats.columns = ['%s_p%d' % (metric, round(q * 100))
+                     for metric, q in stats.columns]
+    stats.insert(0, 'num_cases', grouped.size())
+
+    return stats.reset_index()
+
+
+def timelineHistogram(casesDf, metric, by, bins=None):
+    """timelineHistogram.  Number of cases per group falling in each bin of a
+    timeline metric.  One column per bin, labeled like [7, 14).  Cases
+    without the metric are not counted.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases with action_history, or with TIMELINE_METRICS already added
+    metric : str
+        one of TIMELINE_METRICS
+    by : list[str]
+        columns to group by
+    bins : list[float]
+        bin edges.  DAY_BINS by default.
+    """
+    bins = bins or DAY_BINS
+    labels = ['[%g, %g)' % edges for edges in zip(bins[:-1], bins[1:])]
+    df = withMetrics(casesDf, by, [metric])
+    binned = pd.cut(df[metric], bins, right=False, labels=labels)
+
+    histogram = (df.groupby(by + [binned], observed=True)
+                 .size()
+                 .unstack(fill_value=0)
+                 .reindex(columns=labels, fill_value=0))
+    histogram.columns = labels
+
+    return histogram.reset_index()
+
+
+def withMetrics(casesDf, by, metrics):
+    """withMetrics.  The by columns of cases next to the timeline metrics,
+    computing the metrics if they are not columns yet.
+
+    Parameters
+    ----------
+    casesDf : pandas.DataFrame
+        cases
+    by : list[str]
+        columns to group by
+    metrics : list[str]
+        metrics needed
+    """
+    if all(metric in casesDf.columns for metric in metrics):
+        return (casesDf[by + metrics].reset_index(drop=True)
+                .astype({metric: float for metric in metrics}))
+
+    computed = timelineMetrics(casesDf['action_history'])
+    df = casesDf[by].reset_index(drop=True)
+    for metric in metrics:
+        df[metric] = computed[metric].values
+
+    return df
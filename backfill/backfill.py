@@ -1,7 +1,15 @@
 from IPython import embed
+from analyze.chunked import ChunkedHistory
+from analyze.dates import toDateStrings
 from analyze.derived_columns import addDerivedColumns
+from analyze.derived_memo import DerivedMemo
+from analyze.entity_resolution import EntityResolver, addEntityColumns
+from analyze.rollup_store import RollupStore
+from ingest.sheet_cache import SheetCache
 from oauth2client.service_account import ServiceAccountCredentials
+import argparse
 import gspread
+import os
 import pandas as pd
 
 DENVER_DATA = {
@@ -23,16 +31,30 @@ class Backfill:
         'lit drop',
     ]
 
-    def __init__(self, serviceAccountConfigLoc):
+    def __init__(self, serviceAccountConfigLoc, derivedMemo=None,
+                 processes=None, cacheDir='out/sheet_cache', entities=None):
         """__init__.  Create a Backfill instance.
 
         Parameters
         ----------
         serviceAccountConfigLoc : str
             relative file path to the service account certificate json file.
+        derivedMemo : analyze.derived_memo.DerivedMemo
+            memoized flags, so histories seen by earlier runs are not derived
+            again.
+        processes : int
+            size of the process pool derived columns are computed across.
+        cacheDir : str
+            directory for local snapshots of downloaded tabs.
+        entities : analyze.entity_resolution.EntityResolver
+            plaintiff and attorney entities, shared with the sheet ingest.
+            Opened at its default path if None.
         """
 
         self.serviceAccountConfigLoc = serviceAccountConfigLoc
+        self.derivedMemo = derivedMemo
+        self.processes = processes
+        self.entities = entities or EntityResolver()
         self.scope = [
             'https://spreadsheets.google.com/feeds',
             'https://www.googleapis.com/auth/drive'
@@ -40,6 +62,7 @@ class Backfill:
         self.credentials = ServiceAccountCredentials.from_json_keyfile_name(
             serviceAccountConfigLoc, self.scope)
         self.gc = gspread.authorize(self.credentials)
+        self.cache = SheetCache(self.gc, cacheDir)
 
     def pullAllTabsAsOneDataframe(self, countySheetId):
         """pullAllTabsAsOneDataframe.  Download all the tabs, concatenate as one
@@ -51,6 +74,61 @@ class Backfill:
             google sheets ID of the sheet
         """
 
+        outDf = pd.DataFrame()
+        for title, df in self.tabDataframes(countySheetId):
+            try:
+                outDf = self.concatDedupe(outDf, df)
+            except:
+                print('Something went wrong.  Skipping %s.' % title)
+
+        return addEntityColumns(
+            addDerivedColumns(outDf, memo=self.derivedMemo,
+                              processes=self.processes),
+            self.entities)
+
+    def pullAllTabsChunked(self, countySheetId, outputPath, store=None,
+                           memoryLimit=None):
+        """pullAllTabsChunked.  Same as pullAllTabsAsOneDataframe, but holds
+        only one tab and one partition of the history in memory at a time.
+        Cases are written to outputPath, grouped by partition.  Returns the
+        number of cases.
+
+        Parameters
+        ----------
+        countySheetId : str
+            google sheets ID of the sheet
+        outputPath : str
+            csv to write the deduped cases to
+        store : analyze.rollup_store.RollupStore
+            rollups to replace with the cases.  Read them back with
+            AggTables(None, store=store).
+        memoryLimit : int
+            bytes to stay under.  analyze.chunked.MEMORY_LIMIT by default.
+        """
+
+        with ChunkedHistory(memoryLimit=memoryLimit) as history:
+            for title, df in self.tabDataframes(countySheetId):
+                history.add(df)
+
+            return history.run(
+                lambda df: addEntityColumns(
+                    addDerivedColumns(self.dedupe(df),
+                                      memo=self.derivedMemo,
+                                      processes=self.processes),
+                    self.entities),
+                outputPath=outputPath,
+                store=store)
+
+    def tabDataframes(self, countySheetId):
+        """tabDataframes.  Generator over the tabs worth backfilling, as
+        (title, dataframe) pairs of cleaned FED cases.
+
+        Parameters
+        ----------
+        countySheetId : str
+            google sheets ID of the sheet
+        """
+
         googleSheet = self.gc.open_by_key(countySheetId)
         worksheets = []
         for ws in googleSheet.worksheets():
@@ -58,14 +136,18 @@ class Backfill:
                     for colName in Backfill.IGNORE_TABS]):
                 worksheets.append(ws)
 
-        outDf = pd.DataFrame()
+        # One modifiedTime covers every tab of the sheet.
+        marker = self.cache.modifiedTime(countySheetId)
+
         for worksheet in worksheets:
             # x = input('Processing %s.  Skip? [yN]: ' % worksheet.title)
             # if len(x) > 0 and x[0].lower() == 'y':
             #     print('Skipping %s.' % worksheet.title)
             #     continue
 
-            data = worksheet.get_all_values()  # Empty for blank worksheet
+            # Empty for blank worksheet.
+            data = self.cache.getAllValues(countySheetId, worksheet.title,
+                                           marker=marker)
 
             try:
                 headers = data.pop(0)
@@ -100,20 +182,19 @@ class Backfill:
 
                 if any(df['date'] == '########'):
                     df = df[df['date'] != '########']
-
-                outDf = self.concatDedupe(outDf, df)
             except:
                 print('Something went wrong.  Skipping %s.' % worksheet.title)
+                continue
 
-        return addDerivedColumns(outDf)
+            yield worksheet.title, df
 
     def fixDates(self, df):
-        return (pd.to_datetime(df['date'], infer_datetime_format=True)
-                .apply(lambda date: str(date.date())))
+        return toDateStrings(df['date'])
 
     def concatDedupe(self, oldDf, newDf):
-        dataWithDupes = pd.concat([oldDf, newDf])
+        return self.dedupe(pd.concat([oldDf, newDf]))
 
+    def dedupe(self, dataWithDupes):
         return (dataWithDupes
                 .sort_values('date')
                 .groupby('case_number').last()
@@ -122,6 +203,20 @@ class Backfill:
 
 
 if __name__ == '__main__':
-    backfill = Backfill(serviceAccountConfigLoc='data/service_account.json')
-    df = backfill.pullAllTabsAsOneDataframe(
-        '1YiaZerWNqjkLYvo7CvO938CeVkjGFzWMMiRrDH84lxo')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunked', action='store_true',
+                        help='Process the history a partition at a time, '
+                        'under HISTORY_MEMORY_MB, writing the cases to '
+                        'out/backfill.csv and their rollups to '
+                        'out/rollups__backfill.sqlite.')
+    args = parser.parse_args()
+
+    backfill = Backfill(serviceAccountConfigLoc='data/service_account.json',
+                        derivedMemo=DerivedMemo(),
+                        processes=int(os.getenv('DERIVED_PROCESSES') or 1))
+    if args.chunked:
+        backfill.pullAllTabsChunked(
+            DENVER_DATA['sheet_id'], 'out/backfill.csv',
+            store=RollupStore('out/rollups__backfill.sqlite'))
+    else:
+        df = backfill.pullAllTabsAsOneDataframe(DENVER_DATA['sheet_id'])
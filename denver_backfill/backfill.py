@@ -1,14 +1,15 @@
 from IPython import embed
 from analyze.agg_tables import AggTables
 from analyze.derived_columns import addDerivedColumns, DERIVED_COLUMNS
+from analyze.derived_memo import DerivedMemo
 from dotenv import load_dotenv
 from glob import glob
+from ingest.schema import readCasesCsv
 from ingest.sheets_ingest import SheetsIngest
 from itertools import product
 from scrapers.denver_case_scraper import DenverCaseScraper
 from scrapers.denver_dockets import DenverDocketScraper
 import os
-import pandas as pd
 
 DENVER_DATA = {
     'sheet_id': '1-7maDH9l0Gg2EZ07aJNq_jeW1XujxDByLNruERT184c',
@@ -16,11 +17,13 @@ DENVER_DATA = {
 
 filenames = glob('data/*.csv')
 sheetsIngest = SheetsIngest(serviceAccountConfigLoc=os.getenv('GOOGLE_TOKEN'))
+derivedMemo = DerivedMemo(os.getenv('DERIVED_MEMO') or
+                          'out/derived_memo.sqlite')
+derivedProcesses = int(os.getenv('DERIVED_PROCESSES') or 1)
 
 for filename in filenames:
     print('Processing %s...' % filename)
-    file = pd.read_csv(filename).dropna(
-        subset=['case_number']).reset_index(drop=True)
+    file = readCasesCsv(filename)
     file = file[file['type'] == 'FED']
 
     if 'party_disposition' in file.columns:
@@ -29,7 +32,8 @@ for filename in filenames:
     if (len([col for col in DERIVED_COLUMNS if col in file.columns])
             < len(DERIVED_COLUMNS)):
         print('Missing derived columns.  Adding back...')
-        file = addDerivedColumns(file)
+        file = addDerivedColumns(file, memo=derivedMemo,
+                                 processes=derivedProcesses)
 
     sheetsIngest.ingestNewBatchAndUpload(
         newlyScrapedCases=file[file['type'] == 'FED'],
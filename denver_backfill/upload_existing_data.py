@@ -1,14 +1,15 @@
 from IPython import embed
 from analyze.agg_tables import AggTables
 from analyze.derived_columns import addDerivedColumns, DERIVED_COLUMNS
+from analyze.derived_memo import DerivedMemo
 from dotenv import load_dotenv
 from glob import glob
+from ingest.schema import readCasesCsv
 from ingest.sheets_ingest import SheetsIngest
 from itertools import product
 from scrapers.denver_case_scraper import DenverCaseScraper
 from scrapers.denver_dockets import DenverDocketScraper
 import os
-import pandas as pd
 
 DENVER_DATA = {
     'sheet_id': '1eZq7IVnLhzGGkRsVHLlpr3U_e7ul_F11tXlUJ6W7yHo',
@@ -16,15 +17,16 @@ DENVER_DATA = {
 
 filenames = glob('data/*.csv')
 sheetsIngest = SheetsIngest(serviceAccountConfigLoc=os.getenv('GOOGLE_TOKEN'))
+derivedMemo = DerivedMemo(os.getenv('DERIVED_MEMO') or
+                          'out/derived_memo.sqlite')
+derivedProcesses = int(os.getenv('DERIVED_PROCESSES') or 1)
 
 for filename in filenames:
     x = input('Processing %s... Skip? [yN]: ' % filename)
     if len(x) > 0 and x[0].lower() == 'y':
         continue
 
-    file = (pd.read_csv(filename)
-            .dropna(subset=['case_number']).reset_index(drop=True)
-            .fillna(''))
+    file = readCasesCsv(filename)
     file = file[file['type'] == 'FED']
 
     if 'party_disposition' in file.columns:
@@ -37,7 +39,8 @@ for filename in filenames:
                          axis=1)
 
     # Just recompute the derived columns and make sure the notes are at the end.
-    toIngestDf = addDerivedColumns(coreCols).join(noteCols)
+    toIngestDf = addDerivedColumns(coreCols, memo=derivedMemo,
+                                   processes=derivedProcesses).join(noteCols)
 
     sheetsIngest.ingestNewBatchAndUpload(
         newlyScrapedCases=toIngestDf[toIngestDf['type'] == 'FED'],
@@ -0,0 +1,253 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from gspread.exceptions import WorksheetNotFound
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import a1_to_rowcol
+from threading import Lock
+import re
+
+
+class LocalSheetsClient:
+    """LocalSheetsClient.  In-memory stand-in for the parts of gspread.Client
+    the ingest uses, for running ingest, caching and uploads offline.
+
+    Spreadsheets are created on first open.  Every write bumps the
+    spreadsheet's Drive modifiedTime, and every call is counted in calls, by
+    name, to check how many requests a run would make.
+    """
+
+    def __init__(self):
+        """__init__.  Create an empty LocalSheetsClient.  """
+        self.spreadsheets = {}
+        self.calls = Counter()
+        self.lock = Lock()
+
+    def open_by_key(self, key):
+        """open_by_key.  The spreadsheet with id key, created empty if new.
+
+        Parameters
+        ----------
+        key : str
+            sheet id
+        """
+        self.count('open_by_key')
+        with self.lock:
+            if key not in self.spreadsheets:
+                self.spreadsheets[key] = LocalSpreadsheet(self, key)
+
+            return self.spreadsheets[key]
+
+    def count(self, name):
+        """count.  Count a call to name.  """
+        with self.lock:
+            self.calls[name] += 1
+
+    def request(self, method, endpoint, params=None, **kwargs):
+        """request.  Answers Drive file metadata requests, the only raw
+        requests the ingest makes.
+
+        Parameters
+        ----------
+        method : str
+            'get'
+        endpoint : str
+            Drive v3 file url
+        params : dict
+            query parameters
+        """
+        prefix = DRIVE_FILES_API_V3_URL + '/'
+        if method != 'get' or not endpoint.startswith(prefix):
+            raise NotImplementedError('%s %s' % (method, endpoint))
+
+        self.count('drive_get')
+        spreadsheet = self.open_by_key(endpoint[len(prefix):])
+
+        return LocalResponse({'modifiedTime': spreadsheet.modifiedTime()})
+
+
+class LocalResponse:
+    """LocalResponse.  Response with a json body.  """
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class LocalSpreadsheet:
+    """LocalSpreadsheet.  In-memory gspread.models.Spreadsheet.  """
+
+    def __init__(self, client, key):
+        self.client = client
+        self.id = key
+        self.tabs = []
+        self.version = 0
+
+    def modifiedTime(self):
+        """modifiedTime.  RFC 3339 time that moves on with every write.  """
+        return (datetime(2020, 1, 1) + timedelta(seconds=self.version)
+                ).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def touch(self):
+        self.version += 1
+
+    def worksheets(self):
+        self.client.count('fetch_sheet_metadata')
+        return list(self.tabs)
+
+    def worksheet(self, title):
+        self.client.count('fetch_sheet_metadata')
+        return self.find(title)
+
+    def find(self, title):
+        for tab in self.tabs:
+            if tab.title == title:
+                return tab
+
+        raise WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows, cols):
+        self.client.count('add_worksheet')
+        with self.client.lock:
+            tab = LocalWorksheet(self, title, len(self.tabs), rows, cols)
+            self.tabs.append(tab)
+            self.touch()
+
+        return tab
+
+    def values_batch_get(self, ranges, params=None):
+        """values_batch_get.  Contents of whole worksheets, ranges naming
+        them, without trailing empty cells in each row as the API returns
+        them.  """
+        self.client.count('values_batch_get')
+        valueRanges = []
+        for name in ranges:
+            title = re.match(r"^'(.*)'$", name).group(1).replace("''", "'")
+            values = self.find(title).values()
+            for row in values:
+                while row and row[-1] == '':
+                    row.pop()
+            valueRanges.append({'range': name, 'values': values})
+
+        return {'spreadsheetId': self.id, 'valueRanges': valueRanges}
+
+    def values_batch_update(self, params=None, body=None):
+        """values_batch_update.  Write each range in body['data'].  """
+        self.client.count('values_batch_update')
+        with self.client.lock:
+            for data in body['data']:
+                title, a1 = re.match(r"^'(.*)'!(.*)$", data['range']).groups()
+                tab = self.find(title.replace("''", "'"))
+                row, col = a1_to_rowcol(a1.split(':')[0])
+                tab.write(row, col, data['values'])
+            self.touch()
+
+        return {'totalUpdatedRanges': len(body['data'])}
+
+    def batch_update(self, body):
+        """batch_update.  Apply addSheet, updateSheetProperties (grid size)
+        and deleteDimension (rows) requests, in order.  """
+        self.client.count('batch_update')
+        replies = []
+        with self.client.lock:
+            for request in body['requests']:
+                replies.append(self.applyRequest(request))
+            self.touch()
+
+        return {'replies': replies}
+
+    def applyRequest(self, request):
+        if 'addSheet' in request:
+            properties = request['addSheet']['properties']
+            grid = properties['gridProperties']
+            tab = LocalWorksheet(self, properties['title'], len(self.tabs),
+                                 grid['rowCount'], grid['columnCount'])
+            self.tabs.append(tab)
+            return {'addSheet': {'properties': {'sheetId': tab.id,
+                                                'title': tab.title}}}
+
+        if 'updateSheetProperties' in request:
+            properties = request['updateSheetProperties']['properties']
+            grid = properties['gridProperties']
+            tab = self.byId(properties['sheetId'])
+            tab.resize(grid.get('rowCount', tab.row_count),
+                       grid.get('columnCount', tab.col_count))
+            return {}
+
+        if 'deleteDimension' in request:
+            deleted = request['deleteDimension']['range']
+            if deleted['dimension'] != 'ROWS':
+                raise NotImplementedError(deleted['dimension'])
+            tab = self.byId(deleted['sheetId'])
+            del tab.grid[deleted['startIndex']:deleted['endIndex']]
+            return {}
+
+        raise NotImplementedError(list(request))
+
+    def byId(self, sheetId):
+        return [tab for tab in self.tabs if tab.id == sheetId][0]
+
+
+class LocalWorksheet:
+    """LocalWorksheet.  In-memory gspread.models.Worksheet, as a grid of
+    strings.  """
+
+    def __init__(self, spreadsheet, title, id, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = id
+        self.grid = [[''] * cols for _ in range(rows)]
+
+    @property
+    def row_count(self):
+        return len(self.grid)
+
+    @property
+    def col_count(self):
+        return len(self.grid[0]) if self.grid else 0
+
+    def get_all_values(self):
+        """get_all_values.  Cells up to the last non-empty row and column.  """
+        self.spreadsheet.client.count('get_all_values')
+        return self.values()
+
+    def values(self):
+        rows = [list(row) for row in self.grid]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        width = max([max([i + 1 for i, val in enumerate(row) if val] or [0])
+                     for row in rows] or [0])
+
+        return [row[:width] for row in rows]
+
+    def add_rows(self, rows):
+        self.spreadsheet.client.count('add_rows')
+        with self.spreadsheet.client.lock:
+            self.resize(self.row_count + rows, self.col_count)
+            self.spreadsheet.touch()
+
+    def add_cols(self, cols):
+        self.spreadsheet.client.count('add_cols')
+        with self.spreadsheet.client.lock:
+            self.resize(self.row_count, self.col_count + cols)
+            self.spreadsheet.touch()
+
+    def resize(self, rows, cols):
+        """resize.  Make the grid rows by cols, cutting or padding with empty
+        cells.  """
+        self.grid = [row[:cols] + [''] * (cols - len(row[:cols]))
+                     for row in self.grid[:rows]]
+        self.grid += [[''] * cols for _ in range(rows - len(self.grid))]
+
+    def write(self, row, col, values):
+        """write.  Put values at row, col (1-based).  Raises IndexError when
+        they fall outside the grid, as the API does.  """
+        if (row - 1 + len(values) > self.row_count
+                or col - 1 + max(len(vals) for vals in values)
+                > self.col_count):
+            raise IndexError('Range exceeds grid limits of %s.' % self.title)
+
+        for i, vals in enumerate(values):
+            for j, val in enumerate(vals):
+                self.grid[row - 1 + i][col - 1 + j] = str(val)
@@ -0,0 +1,220 @@
+from analyze.dates import toDateStrings
+from analyze.derived_columns import DERIVED_COLUMNS
+from analyze.timeline_metrics import TIMELINE_METRICS
+from pandas.api.types import is_bool_dtype
+from scrapers.denver_case_scraper import DenverCaseScraper
+import numpy as np
+import pandas as pd
+
+# Kind of each case column that is not free text.  Dates are YYYY-MM-DD
+# strings, periods (year, month, week) are integer labels kept as strings, and
+# categories are strings that repeat across many cases.
+COLUMN_KINDS = {
+    'date': 'date',
+    'room': 'category',
+    'type': 'category',
+    'plaintiff': 'category',
+    'plaintiff_attorney': 'category',
+    'defendant_attorney': 'category',
+    'scraped_on': 'date',
+    'year': 'period',
+    'month': 'period',
+    'week': 'period',
+    'writ_of_restitution': 'flag',
+    'evicted_flag': 'flag',
+    'num_hearings': 'count',
+    'days_to_writ': 'count',
+    'days_writ_to_dismissal': 'count',
+    'days_to_judgment': 'count',
+    'num_continuances': 'count',
+    'hearings_before_judgment': 'count',
+}
+
+# Kind of every column of a case table, in order.
+CASE_SCHEMA = {col: COLUMN_KINDS.get(col, 'text')
+               for col in (DenverCaseScraper.outputColumns + DERIVED_COLUMNS
+                           + TIMELINE_METRICS)}
+
+# dtype of each kind, as (default, compact).  The default layout keeps strings
+# as python strings, the way the rest of the ingest compares and writes them.
+# The compact layout stores repeated strings as categoricals.
+KIND_DTYPES = {
+    'text': (object, object),
+    'date': (object, 'category'),
+    'category': (object, 'category'),
+    'period': (object, 'category'),
+    'flag': ('boolean', 'boolean'),
+    'count': ('Int64', 'Int16'),
+}
+
+# Spellings of flags in sheets and csvs.  Blank flags are missing.
+FLAG_VALUES = {
+    'true': True,
+    'false': False,
+    '1': True,
+    '0': False,
+    '1.0': True,
+    '0.0': False,
+    '': None,
+}
+
+
+def caseDtypes(compact=False):
+    """caseDtypes.  dtype of every case column.
+
+    Parameters
+    ----------
+    compact : bool
+        dtypes of the compact layout
+    """
+    return {col: KIND_DTYPES[kind][int(compact)]
+            for col, kind in CASE_SCHEMA.items()}
+
+
+def coerceCases(df, compact=False):
+    """coerceCases.  Cast the case columns of df to CASE_SCHEMA.  Columns not
+    in the schema, like organizers' notes, are left as they are.  Each column
+    is cast as a whole, and dates are parsed once per distinct value.
+
+    Raises on flags that are not true, false or blank, and on counts that
+    are not integers.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        case rows, typically all strings as read from sheets or csv
+    compact : bool
+        store repeated strings as categoricals and counts in small integers.
+        Python strings by default.
+    """
+    df = df.copy()
+    dtypes = caseDtypes(compact)
+    for col in df.columns:
+        if col in CASE_SCHEMA:
+            df[col] = (COERCE[CASE_SCHEMA[col]](df[col])
+                       .astype(dtypes[col]))
+
+    return df
+
+
+def readCasesCsv(path, compact=False, chunksize=None):
+    """readCasesCsv.  Read a csv of cases into CASE_SCHEMA.  Every column is
+    read as strings first, so blanks stay blank and case numbers are never
+    read as numbers.  Rows without a case number are dropped.
+
+    Parameters
+    ----------
+    path : str
+        csv of case rows
+    compact : bool
+        see coerceCases
+    chunksize : int
+        rows per chunk.  Returns a generator of chunks if given.
+    """
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False,
+                         chunksize=chunksize)
+    if chunksize is None:
+        return withCaseNumbers(coerceCases(reader, compact))
+
+    return (withCaseNumbers(coerceCases(chunk, compact)) for chunk in reader)
+
+
+def readCasesParquet(path, compact=False):
+    """readCasesParquet.  Read a parquet file of cases into CASE_SCHEMA.
+
+    Parameters
+    ----------
+    path : str
+        parquet file of case rows
+    compact : bool
+        see coerceCases
+    """
+    return coerceCases(pd.read_parquet(path), compact)
+
+
+def withCaseNumbers(df):
+    return df[df['case_number'] != ''].reset_index(drop=True)
+
+
+def textValues(values):
+    """textValues.  Strings, with missing values blank.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        column to cast
+    """
+    return values.astype(object).where(values.notna(), '').astype(str)
+
+
+def dateValues(values):
+    """dateValues.  YYYY-MM-DD strings, with blanks missing.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        column of dates
+    """
+    text = textValues(values).str.strip()
+    present = text != ''
+    dates = pd.Series(np.nan, index=values.index, dtype=object)
+    dates[present] = toDateStrings(text[present]).values
+
+    return dates.rename(values.name)
+
+
+def periodValues(values):
+    """periodValues.  Integer labels as strings, without the '.0' left by
+    columns read as floats.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        column of years, months or weeks
+    """
+    return textValues(values).str.strip().str.replace(r'\.0$', '',
+                                                      regex=True)
+
+
+def flagValues(values):
+    """flagValues.  Nullable booleans from FLAG_VALUES spellings, in any case.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        column of flags
+    """
+    if is_bool_dtype(values):
+        return values.astype('boolean')
+
+    text = textValues(values).str.strip().str.lower()
+    unknown = ~text.isin(list(FLAG_VALUES))
+    if unknown.any():
+        raise ValueError('%s has values that are not flags: %s'
+                         % (values.name, sorted(text[unknown].unique())[:5]))
+
+    return text.map(FLAG_VALUES).astype('boolean')
+
+
+def countValues(values):
+    """countValues.  Integers, with blanks missing.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        column of counts
+    """
+    text = textValues(values).str.strip()
+
+    return pd.to_numeric(text.where(text != ''))
+
+
+# Cast of each kind.
+COERCE = {
+    'text': textValues,
+    'date': dateValues,
+    'category': textValues,
+    'period': periodValues,
+    'flag': flagValues,
+    'count': countValues,
+}
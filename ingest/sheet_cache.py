@@ -0,0 +1,219 @@
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from threading import Lock
+import hashlib
+import os
+import pandas as pd
+import sqlite3
+import time
+
+
+class SheetCache:
+    """SheetCache.  Local snapshots of worksheet contents, reused while the
+    spreadsheet is unchanged.
+
+    Each snapshot is stamped with the spreadsheet's modifiedTime from Drive.
+    Reading a worksheet costs one Drive metadata call while the stamp still
+    matches, and a full download otherwise: Drive only tracks revisions per
+    spreadsheet, and the Sheets API has no way to ask for the cells changed
+    since one, so any change to a spreadsheet refreshes its worksheets the
+    next time they are read.
+
+    Writers record what they wrote with wrote, so our own uploads do not
+    invalidate the snapshots.  Snapshots are parquet files of the raw cell
+    strings, one per worksheet, indexed in sqlite.
+    """
+
+    def __init__(self, gc, cacheDir='out/sheet_cache'):
+        """__init__.  Open (or create) a SheetCache.
+
+        Parameters
+        ----------
+        gc : gspread.Client
+            authorized client, or ingest.local_sheets.LocalSheetsClient
+        cacheDir : str
+            directory for the snapshots.  Created if missing.
+        """
+        self.gc = gc
+        self.cacheDir = cacheDir
+        self.lock = Lock()
+
+        os.makedirs(cacheDir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cacheDir, 'index.sqlite'),
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshots ('
+            'sheet_id TEXT, worksheet TEXT, modified_time TEXT, path TEXT, '
+            'fetched_at REAL, PRIMARY KEY (sheet_id, worksheet))')
+        self.conn.commit()
+
+    def getAllValues(self, countySheetId, worksheetName, marker=None):
+        """getAllValues.  Contents of a worksheet, as get_all_values returns
+        them, from the snapshot if the spreadsheet has not changed since.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        worksheetName : str
+            page name
+        marker : str
+            modifiedTime of the spreadsheet, if already known
+        """
+        if marker is None:
+            marker = self.modifiedTime(countySheetId)
+
+        values = self.lookup(countySheetId, worksheetName, marker)
+        if values is not None:
+            print('Using cached %s.' % worksheetName)
+            return values
+
+        print('Downloading %s.' % worksheetName)
+        values = (self.gc.open_by_key(countySheetId)
+                  .worksheet(worksheetName)
+                  .get_all_values())
+        self.store(countySheetId, worksheetName, values, marker)
+
+        return values
+
+    def wrote(self, countySheetId, worksheetName, values, marker):
+        """wrote.  Record the contents we just wrote to a worksheet.  See
+        wroteAll.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        worksheetName : str
+            page name
+        values : list[list[str]]
+            worksheet contents after the write, header first
+        marker : str
+            modifiedTime the write was based on
+        """
+        self.wroteAll(countySheetId, {worksheetName: values}, marker)
+
+    def wroteAll(self, countySheetId, contents, marker, newMarker=None):
+        """wroteAll.  Record the contents we just wrote to worksheets of one
+        spreadsheet.
+
+        If the spreadsheet was unchanged from marker up to the writes, every
+        snapshot of it stamped marker is still good and is stamped with the
+        new modifiedTime.  Edits by others in the moment between the writes
+        and reading the new modifiedTime are not seen until the spreadsheet
+        changes again.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        contents : dict
+            worksheet contents after the writes, header first, by page name
+        marker : str
+            modifiedTime the writes were based on
+        newMarker : str
+            modifiedTime right after the writes.  Read from Drive if None.
+        """
+        if newMarker is None:
+            newMarker = self.modifiedTime(countySheetId)
+        for worksheetName, values in contents.items():
+            self.store(countySheetId, worksheetName, values, newMarker)
+
+        with self.lock:
+            self.conn.execute(
+                'UPDATE snapshots SET modified_time = ? '
+                'WHERE sheet_id = ? AND modified_time = ?',
+                (newMarker, countySheetId, marker))
+            self.conn.commit()
+
+    def modifiedTime(self, countySheetId):
+        """modifiedTime.  Drive's modifiedTime of a spreadsheet.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        """
+        return self.gc.request(
+            'get', '%s/%s' % (DRIVE_FILES_API_V3_URL, countySheetId),
+            params={'fields': 'modifiedTime', 'supportsAllDrives': True}
+        ).json()['modifiedTime']
+
+    def marker(self, countySheetId, worksheetName):
+        """marker.  modifiedTime the snapshot of a worksheet is stamped with,
+        or None if there is no snapshot.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        worksheetName : str
+            page name
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT modified_time FROM snapshots '
+                'WHERE sheet_id = ? AND worksheet = ?',
+                (countySheetId, worksheetName)).fetchone()
+
+        return None if found is None else found[0]
+
+    def lookup(self, countySheetId, worksheetName, marker):
+        """lookup.  Snapshot of a worksheet if stamped marker, else None.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        worksheetName : str
+            page name
+        marker : str
+            current modifiedTime of the spreadsheet
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT modified_time, path FROM snapshots '
+                'WHERE sheet_id = ? AND worksheet = ?',
+                (countySheetId, worksheetName)).fetchone()
+
+        if found is None or found[0] != marker:
+            return None
+        if found[1] is None:
+            return []
+        if not os.path.exists(found[1]):
+            return None
+
+        return pd.read_parquet(found[1]).values.tolist()
+
+    def store(self, countySheetId, worksheetName, values, marker):
+        """store.  Save the snapshot of a worksheet.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        worksheetName : str
+            page name
+        values : list[list[str]]
+            worksheet contents, header first
+        marker : str
+            modifiedTime of the spreadsheet the contents are from
+        """
+        path = None
+        if values:
+            width = max(len(row) for row in values)
+            path = os.path.join(self.cacheDir, '%s.parquet' % hashlib.sha1(
+                ('%s\n%s' % (countySheetId, worksheetName)).encode()
+            ).hexdigest())
+            # Positional column names, since headers can repeat or be blank.
+            pd.DataFrame(
+                [list(row) + [''] * (width - len(row)) for row in values],
+                columns=['c%d' % i for i in range(width)],
+                dtype=str
+            ).to_parquet(path, index=False)
+
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                (countySheetId, worksheetName, marker, path, time.time()))
+            self.conn.commit()
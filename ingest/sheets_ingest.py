@@ -1,38 +1,97 @@
 from IPython import embed
+from analyze.agg_cube import PERIOD_FREQS, isStored
 from analyze.agg_tables import AggTables
+from analyze.chunked import ChunkedHistory
 from analyze.derived_columns import DERIVED_COLUMNS, numHearingsPerCase
-from df2gspread import df2gspread as d2g
+from analyze.entity_resolution import (ENTITY_COLUMNS, EntityResolver,
+                                       addEntityColumns)
+from analyze.rollup_store import DIMENSIONS, RollupStore
+from analyze.timeline_metrics import (DAY_METRICS, TIMELINE_METRICS,
+                                      fillTimelineColumns)
 from dotenv import load_dotenv
 from glob import glob
+from ingest.schema import coerceCases
+from ingest.sheet_cache import SheetCache
+from ingest.upload_scheduler import TabUpload, UploadScheduler
 from oauth2client.service_account import ServiceAccountCredentials
 import gspread
 import numpy as np
 import os
 import pandas as pd
+import tempfile
 
 load_dotenv()
 
+# Breakdown worksheets uploaded with the weekly and monthly totals.  See
+# parseBreakdowns.
+DEFAULT_BREAKDOWNS = ('month:room,quarter:plaintiff_entity,'
+                      'quarter:plaintiff_attorney_entity')
+
+# Marks the rows of the new batch while it is partitioned with the history.
+# See SheetsIngest.joinChunked.
+BATCH_COLUMN = '__new_batch'
+
+# How each period reads in worksheet names, e.g. monthly_by_room.
+PERIOD_NAMES = {
+    'day': 'daily',
+    'week': 'weekly',
+    'month': 'monthly',
+    'quarter': 'quarterly',
+    'year': 'yearly',
+}
+
 
 class SheetsIngest:
     """SheetsIngest.  A class for handling the ingest of data into google sheets.  """
 
-    def __init__(self, serviceAccountConfigLoc):
+    def __init__(self, serviceAccountConfigLoc, rollupDir='out',
+                 cacheDir='out/sheet_cache', rateLimiter=None, gc=None,
+                 breakdowns=None, memoryLimit=None):
         """__init__.  Create a SheetsIngest instance.
 
         Parameters
         ----------
         serviceAccountConfigLoc : str
             relative file path to the service account certificate json file.
+        rollupDir : str
+            directory for the persisted daily rollups of each sheet, and for
+            the plaintiff and attorney entities.
+        cacheDir : str
+            directory for local snapshots of downloaded worksheets.
+        rateLimiter : scrapers.rate_limiter.RateLimiter
+            limiter every Sheets API call waits on.  See
+            ingest.upload_scheduler.UploadScheduler for the default.
+        gc : gspread.Client
+            client to use instead of one authorized with the certificate,
+            e.g. ingest.local_sheets.LocalSheetsClient.
+        breakdowns : list[tuple]
+            (period, dimensions) pairs to upload a breakdown worksheet for,
+            as parseBreakdowns returns them.  DEFAULT_BREAKDOWNS if None.
+        memoryLimit : int
+            bytes to stay under while joining a batch with the history, which
+            is then done a partition at a time, see joinChunked.  The whole
+            history is joined at once if None.
         """
 
         self.serviceAccountConfigLoc = serviceAccountConfigLoc
+        self.rollupDir = rollupDir
+        self.memoryLimit = memoryLimit
+        self.entities = EntityResolver(os.path.join(rollupDir,
+                                                    'entities.sqlite'))
+        self.breakdowns = (parseBreakdowns(DEFAULT_BREAKDOWNS)
+                           if breakdowns is None else breakdowns)
         self.scope = [
             'https://spreadsheets.google.com/feeds',
             'https://www.googleapis.com/auth/drive'
         ]
-        self.credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            serviceAccountConfigLoc, self.scope)
-        self.gc = gspread.authorize(self.credentials)
+        if gc is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                serviceAccountConfigLoc, self.scope)
+            gc = gspread.authorize(credentials)
+        self.gc = gc
+        self.cache = SheetCache(self.gc, cacheDir)
+        self.uploads = UploadScheduler(self.gc, cache=self.cache,
+                                       rateLimiter=rateLimiter)
 
     def ingestNewBatchAndUpload(self, newlyScrapedCases, countySheetId):
         """ingestNewBatchAndUpload.  Performs ingest (i.e., processing and
@@ -47,11 +106,34 @@ class SheetsIngest:
         """
 
         fullDf = self.ingestNewBatchToDf(newlyScrapedCases, countySheetId)
-        self.uploadAggDfs(fullDf, countySheetId)
-        self.uploadToSheets(fullDf, countySheetId, worksheetName='all_cases')
-
-    def uploadAggDfs(self, fullDf, countySheetId):
-        """uploadAggDfs.  Uploads weekly and monthly rollups of fullDf to sheets.
+        changedCases = fullDf[fullDf['case_number'].isin(
+            newlyScrapedCases['case_number'])]
+
+        # all_cases can only have been edited by hand if it changed since the
+        # upload the rollups were marked with.
+        store = self.rollupStore(countySheetId)
+        marker = self.cache.marker(countySheetId, 'all_cases')
+        verify = marker is None or marker != store.marker()
+
+        # Only new and changed cases are written.  Notes columns kept by
+        # organizers are left alone on existing rows.
+        caseColumns = ([col + '_entity' for col in ENTITY_COLUMNS] +
+                       TIMELINE_METRICS)
+        notesColumns = [col for col in fullDf.columns
+                        if col not in newlyScrapedCases.columns and
+                        col not in caseColumns]
+
+        # The rollups and all_cases are diffed together and share calls.
+        self.uploads.upload(countySheetId, self.aggUploads(
+            fullDf, countySheetId, changedCases=changedCases, store=store,
+            verify=verify) + [
+            TabUpload(fullDf, 'all_cases', key='case_number',
+                      preserveColumns=notesColumns)])
+        store.mark(self.cache.marker(countySheetId, 'all_cases'))
+
+    def uploadAggDfs(self, fullDf, countySheetId, changedCases=None):
+        """uploadAggDfs.  Uploads weekly and monthly rollups of fullDf, its
+        breakdowns and its timeline histograms, to sheets.
 
         Parameters
         ----------
@@ -59,18 +141,74 @@ class SheetsIngest:
             fullDf cases to be rolled up
         countySheetId : str
             ID for sheets target
+        changedCases : pandas.DataFrame
+            rows of fullDf that are new or changed in this batch.  Only these
+            are rolled up into the persisted rollups.  All of fullDf is rolled
+            up if None.
+        """
+        fullDf = fillTimelineColumns(addEntityColumns(fullDf, self.entities))
+        if changedCases is not None:
+            changedCases = fullDf[fullDf['case_number'].isin(
+                changedCases['case_number'])]
+
+        self.uploads.upload(countySheetId, self.aggUploads(
+            fullDf, countySheetId, changedCases=changedCases))
+
+    def aggUploads(self, fullDf, countySheetId, changedCases=None,
+                   store=None, verify=True):
+        """aggUploads.  Weekly and monthly rollups of fullDf, its breakdowns
+        with their timeline percentiles, and monthly histograms of
+        DAY_METRICS, as uploads to their worksheets.  See uploadAggDfs.
+
+        Parameters
+        ----------
+        fullDf : pandas.DataFrame
+            fullDf cases to be rolled up, with entity and timeline columns
+        countySheetId : str
+            ID for sheets target
+        changedCases : pandas.DataFrame
+            rows of fullDf that are new or changed in this batch
+        store : analyze.rollup_store.RollupStore
+            persisted rollups of the sheet.  See rollupStore for the default.
+        verify : bool
+            whether to check every other case of fullDf against store for
+            hand edits.  See analyze.agg_tables.AggTables.
         """
-        aggTables = AggTables(fullDf)
+        aggTables = AggTables(fullDf,
+                              store=store or self.rollupStore(countySheetId),
+                              changedCases=changedCases, timelines=True,
+                              verify=verify)
+
+        # Rollups are in period order, so usually only the last rows change.
+        return [TabUpload(aggTables.aggStatsWeekly(), 'weekly_totals',
+                          clearColumns=True),
+                TabUpload(aggTables.aggStatsMonthly(), 'monthly_totals',
+                          clearColumns=True)] + [
+                TabUpload(aggTables.breakdown(period, dimensions),
+                          breakdownName(period, dimensions),
+                          clearColumns=True)
+                for period, dimensions in self.breakdowns] + [
+                TabUpload(aggTables.timelineHistogram(metric, 'month'),
+                          '%s_%s_histogram' % (PERIOD_NAMES['month'], metric),
+                          clearColumns=True)
+                for metric in DAY_METRICS]
+
+    def rollupStore(self, countySheetId):
+        """rollupStore.  The persisted rollups of a sheet.
 
-        # Since we have fullDf, we can just overwrite here.
-        self.uploadToSheets(aggTables.aggStatsWeekly(),
-                            countySheetId, worksheetName='weekly_totals')
-        self.uploadToSheets(aggTables.aggStatsMonthly(),
-                            countySheetId, worksheetName='monthly_totals')
+        Parameters
+        ----------
+        countySheetId : str
+            ID for sheets target
+        """
+        return RollupStore(os.path.join(
+            self.rollupDir, 'rollups__%s.sqlite' % countySheetId))
 
     def ingestNewBatchToDf(self, newlyScrapedCases, countySheetId):
         """ingestNewBatchToDf.  Performs ingest of scraped cases into a
-        dataframe.
+        dataframe, with the plaintiff and attorney entities and the timeline
+        metrics of every case.  Metrics are kept in the sheet, so only cases
+        without them have their action history read.
 
         Parameters
         ----------
@@ -85,13 +223,56 @@ class SheetsIngest:
         # Lowercase columns for easy comparisons
         oldCases.columns = oldCases.columns.str.lower()
         newlyScrapedCases.columns = newlyScrapedCases.columns.str.lower()
+        # Metrics of new rows win over the old rows' when cases are deduped.
+        newlyScrapedCases = fillTimelineColumns(newlyScrapedCases)
 
-        if oldCases.shape[0] > 0:
-            fullDf = self.joinWithOldCasesAndNotes(newlyScrapedCases, oldCases)
-        else:
+        if oldCases.shape[0] == 0:
             fullDf = newlyScrapedCases
+        elif self.memoryLimit is not None:
+            return self.joinChunked(newlyScrapedCases, oldCases)
+        else:
+            fullDf = self.joinWithOldCasesAndNotes(newlyScrapedCases, oldCases)
+
+        return fillTimelineColumns(addEntityColumns(
+            fullDf.sort_values('date', kind='mergesort'), self.entities))
 
-        return fullDf.sort_values('date')
+    def joinChunked(self, newlyScrapedCases, oldCases):
+        """joinChunked.  joinWithOldCasesAndNotes, adding the entity and
+        timeline columns, one partition of case numbers at a time.  Beyond the
+        history as downloaded, only a partition's worth of rows is worked on
+        at once, under memoryLimit.  See analyze.chunked.ChunkedHistory.
+
+        Parameters
+        ----------
+        newlyScrapedCases : pandas.DataFrame
+            dataframe to process, with timeline columns
+        oldCases : pandas.DataFrame
+            dataframe of previously existing cases downloaded from sheets.
+        """
+        newColumns = list(newlyScrapedCases.columns)
+        oldColumns = list(oldCases.columns)
+
+        def join(part):
+            isNew = part.pop(BATCH_COLUMN).astype(bool).values
+            old = part[~isNew][oldColumns]
+            if old.shape[0] > 0:
+                part = self.joinWithOldCasesAndNotes(part[isNew][newColumns],
+                                                     old)
+            else:
+                part = part[isNew][newColumns]
+
+            return fillTimelineColumns(addEntityColumns(part, self.entities))
+
+        os.makedirs(self.rollupDir, exist_ok=True)
+        workDir = tempfile.mkdtemp(prefix='chunks__', dir=self.rollupDir)
+        with ChunkedHistory(workDir=workDir,
+                            memoryLimit=self.memoryLimit) as history:
+            history.add(oldCases.assign(**{BATCH_COLUMN: False}))
+            history.add(newlyScrapedCases.assign(**{BATCH_COLUMN: True}))
+            parts = [join(part) for part in history.partitions()]
+
+        return (pd.concat(parts, ignore_index=True)
+                .sort_values('date', kind='mergesort'))
 
     def downloadSheetToDf(self, countySheetId, worksheetName=None):
         """downloadSheetToDf.  Downloads a worksheet to a pandas dataframe
@@ -104,25 +285,19 @@ class SheetsIngest:
             page name for the upload
         """
 
-        googleSheet = self.gc.open_by_key(countySheetId)
-        worksheet = googleSheet.worksheet(worksheetName)
-
-        data = worksheet.get_all_values()  # Empty for blank worksheet
+        # Empty for blank worksheet.  Reused from the last download when the
+        # sheet has not changed since.
+        data = self.cache.getAllValues(countySheetId, worksheetName)
         try:
             headers = data.pop(0)
         except IndexError:
             headers = []
 
+        # Every cell is returned as a string.  Case columns are cast to the
+        # case schema; dates are normalized and flags become booleans.
         df = pd.DataFrame(data, columns=headers)
         if df.shape[0] > 0:
-            # Cast timestamp date column to date strings.
-            df['date'] = pd.to_datetime(df['date']).apply(
-                lambda x: str(x.date()))
-            # Years are read as floats maybe?
-            df['year'] = df['year'].astype(str)
-            # Boolean flag columns are returned as strings.
-            df['writ_of_restitution'] = df['writ_of_restitution'].apply(eval)
-            df['evicted_flag'] = df['evicted_flag'].apply(eval)
+            df = coerceCases(df)
 
         return df
 
@@ -150,14 +325,14 @@ class SheetsIngest:
         notesColumns = [col for col in oldCases.columns
                         if col not in newlyScrapedCases.columns]
 
-        oldNotes = oldCases[['case_number'] + notesColumns]
+        # One row of notes per case number, the last the sheet lists.
+        oldNotes = oldCases.set_index('case_number')[notesColumns]
+        oldNotes = oldNotes[~oldNotes.index.duplicated(keep='last')]
         oldCases = oldCases.drop(notesColumns, axis=1)
 
+        # Notes follow their case number, whichever row it resolved to.
         return (self.joinAndDedupe(newlyScrapedCases, oldCases)
-                .merge(oldNotes,
-                       how='left',
-                       left_on='case_number',
-                       right_on='case_number')
+                .join(oldNotes, on='case_number')
                 .dropna(subset=['case_number']))
 
     def joinAndDedupe(self, newlyScrapedCases, oldCases):
@@ -165,6 +340,10 @@ class SheetsIngest:
         where duplicate case numbers are filtered to keep only the most recent
         when ordered by date and scraped_on.
 
+        Only case numbers in newlyScrapedCases, and any oldCases lists more
+        than once, are resolved and have num_hearings counted again.  Every
+        other old row is kept as it is, and the resolved rows follow them.
+
         Parameters
         ----------
         newlyScrapedCases : pandas.DataFrame
@@ -173,22 +352,32 @@ class SheetsIngest:
             dataframe of previously existing cases downloaded from sheets.
         """
 
-        dataWithDupes = (pd.concat([oldCases, newlyScrapedCases])
-                         .drop('num_hearings', axis=1))
+        oldCases = oldCases.set_index('case_number')
+        newlyScrapedCases = newlyScrapedCases.set_index('case_number')
+
+        touched = oldCases.index.isin(newlyScrapedCases.index) | (
+            oldCases.index.duplicated(keep=False))
+        dataWithDupes = (pd.concat([oldCases[touched], newlyScrapedCases])
+                         .drop('num_hearings', axis=1, errors='ignore'))
 
-        # Refresh this column with the new data
-        numHearings = numHearingsPerCase(dataWithDupes)
+        # Refresh this column for the touched cases, counting their rows on
+        # the date each resolves to.
+        numHearings = (numHearingsPerCase(dataWithDupes.reset_index())
+                       .set_index(['case_number', 'date'])['num_hearings'])
 
-        return (dataWithDupes
-                .sort_values(['date', 'scraped_on'])
-                .groupby('case_number').last()
-                .merge(
-                    numHearings,
-                    left_on=['case_number', 'date'],
-                    right_on=['case_number', 'date']))
+        resolved = (dataWithDupes
+                    .sort_values(['date', 'scraped_on'], kind='mergesort')
+                    .groupby(level='case_number', sort=False).last())
+        resolved['num_hearings'] = numHearings.reindex(
+            pd.MultiIndex.from_arrays([resolved.index, resolved['date']])
+        ).values
+
+        return pd.concat([oldCases[~touched], resolved]).reset_index()
 
     def uploadToSheets(self, toUploadData, countySheetId, worksheetName=None):
-        """uploadToSheets.  Uploads a dataframe.
+        """uploadToSheets.  Uploads a dataframe over a whole worksheet, row
+        by row.  Only cells that differ are written, rows past the end of
+        the dataframe are deleted and columns it does not have are blanked.
 
         Parameters
         ----------
@@ -197,12 +386,59 @@ class SheetsIngest:
         countySheetId : str
             sheet id of target
         worksheetName : str
-            page name for the upload
+            page name for the upload.  Sheet1 by default.
         """
 
-        d2g.upload(
-            toUploadData,
-            countySheetId,
-            wks_name=worksheetName,
-            credentials=self.credentials,
-            row_names=False)
+        self.uploads.upload(countySheetId,
+                            [TabUpload(toUploadData,
+                                       worksheetName or 'Sheet1',
+                                       clearColumns=True)])
+
+
+def parseBreakdowns(spec):
+    """parseBreakdowns.  (period, dimensions) pairs from a comma separated
+    list of period:dimension, with several dimensions joined by +, e.g.
+    'month:room,quarter:plaintiff+plaintiff_entity'.  'none' or blank for
+    no breakdowns.  Breakdowns must be kept in the rollup store, see
+    analyze.agg_cube.isStored.
+
+    Parameters
+    ----------
+    spec : str
+        breakdowns to parse
+    """
+    breakdowns = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item in ('', 'none'):
+            continue
+
+        period, _, dimensions = item.partition(':')
+        dimensions = [dim for dim in dimensions.split('+') if dim]
+        if period not in PERIOD_FREQS:
+            raise ValueError('Unknown period %s in breakdown %s.'
+                             % (period, item))
+        unknown = [dim for dim in dimensions if dim not in DIMENSIONS]
+        if not dimensions or unknown:
+            raise ValueError('Breakdown %s needs dimensions from %s.'
+                             % (item, ', '.join(DIMENSIONS)))
+        if not isStored(period, dimensions):
+            raise ValueError('Breakdown %s is not kept in the rollup store.  '
+                             'Plaintiffs and attorneys are kept by month, '
+                             'and only with their own entities.' % item)
+        breakdowns.append((period, dimensions))
+
+    return breakdowns
+
+
+def breakdownName(period, dimensions):
+    """breakdownName.  Worksheet name of a breakdown, e.g. monthly_by_room.
+
+    Parameters
+    ----------
+    period : str
+        one of analyze.agg_cube.PERIOD_FREQS
+    dimensions : list[str]
+        columns broken down by
+    """
+    return '%s_by_%s' % (PERIOD_NAMES[period], '_and_'.join(dimensions))
@@ -0,0 +1,343 @@
+from gspread.utils import rowcol_to_a1
+import numpy as np
+import pandas as pd
+
+# Ranges sent in one values_batch_update call.
+MAX_RANGES_PER_CALL = 1000
+
+
+def applyPlans(spreadsheet, targets, call=None, executor=None):
+    """applyPlans.  Write plans to worksheets of one spreadsheet in as few
+    calls as the API allows: one batch_update growing every grid too small for
+    its plan, values_batch_update calls of up to MAX_RANGES_PER_CALL ranges
+    from any of the worksheets, then one batch_update deleting stale rows.
+
+    Parameters
+    ----------
+    spreadsheet : gspread.models.Spreadsheet
+        spreadsheet holding the worksheets
+    targets : list[tuple]
+        (worksheet, plan) pairs, plan the output of diffPlan
+    call : function
+        makes each API call as call(method, *args, **kwargs), e.g. under a
+        rate limiter.  Calls are made directly by default.
+    executor : concurrent.futures.Executor
+        values_batch_update calls are sent through it at once.  Sent one
+        after another by default.
+    """
+    if call is None:
+        def call(method, *args, **kwargs):
+            return method(*args, **kwargs)
+
+    resizes = [gridRequest(worksheet.id,
+                           max(worksheet.row_count, plan['numRows']),
+                           max(worksheet.col_count, plan['numCols']))
+               for worksheet, plan in targets
+               if worksheet.row_count < plan['numRows']
+               or worksheet.col_count < plan['numCols']]
+    if resizes:
+        call(spreadsheet.batch_update, {'requests': resizes})
+
+    data = [{'range': rangeName(worksheet.title, row, col, values),
+             'values': values}
+            for worksheet, plan in targets
+            for row, col, values in plan['ranges']]
+    batches = [data[i:i + MAX_RANGES_PER_CALL]
+               for i in range(0, len(data), MAX_RANGES_PER_CALL)]
+
+    def send(batch):
+        return call(spreadsheet.values_batch_update,
+                    params={'valueInputOption': 'RAW'},
+                    body={'data': batch})
+
+    # Ranges never overlap, so the calls can land in any order.
+    if executor is None:
+        for batch in batches:
+            send(batch)
+    else:
+        list(executor.map(send, batches))
+
+    # Bottom up, so earlier deletions do not shift later ones.
+    deletes = [{'deleteDimension': {'range': {
+                   'sheetId': worksheet.id,
+                   'dimension': 'ROWS',
+                   'startIndex': start - 1,
+                   'endIndex': end,
+               }}}
+               for worksheet, plan in targets
+               for start, end in reversed(runs(plan['staleRows']))]
+    if deletes:
+        call(spreadsheet.batch_update, {'requests': deletes})
+
+    for worksheet, plan in targets:
+        print('Wrote %d cells in %d ranges to %s.  Appended %d rows, '
+              'deleted %d.' % (sum(len(values) * len(values[0])
+                                   for _, _, values in plan['ranges']),
+                               len(plan['ranges']), worksheet.title,
+                               plan['numAppended'], len(plan['staleRows'])))
+
+
+def gridRequest(sheetId, rows, cols):
+    """gridRequest.  batch_update request resizing a worksheet's grid to rows
+    by cols.
+
+    Parameters
+    ----------
+    sheetId : int
+        worksheet id
+    rows : int
+        rows of the grid
+    cols : int
+        columns of the grid
+    """
+    return {'updateSheetProperties': {
+        'properties': {
+            'sheetId': sheetId,
+            'gridProperties': {'rowCount': rows, 'columnCount': cols},
+        },
+        'fields': 'gridProperties/rowCount,gridProperties/columnCount',
+    }}
+
+
+def diffPlan(oldValues, df, key=None, preserveColumns=(),
+             clearColumns=False):
+    """diffPlan.  What to write to a worksheet holding oldValues so that it
+    holds df.  Rows are matched by key, new rows are appended below the last
+    row, and only the cells that changed are rewritten, grouped into as few
+    rectangular ranges as possible.  Rows whose key is gone are deleted.
+    Returns a dict of
+
+    ranges
+        (row, col, values) to write, 1-based, values a list of rows
+    staleRows
+        worksheet rows to delete, ascending
+    numRows, numCols
+        grid size needed before deleting
+    numAppended
+        rows added below the existing ones
+
+    Parameters
+    ----------
+    oldValues : list[list[str]]
+        worksheet contents, header first, as from get_all_values
+    df : pandas.DataFrame
+        dataframe to upload
+    key : str
+        column identifying rows.  Rows are matched by position if None.
+    preserveColumns : list[str]
+        columns only written for new rows
+    clearColumns : bool
+        blank worksheet columns that are not in df, header included.  Kept
+        as they are by default, e.g. organizers' notes.
+    """
+    new = cellValues(df)
+
+    header = list(oldValues[0]) if oldValues else []
+    while header and header[-1] == '':
+        header.pop()
+    columns = header + [col for col in new.columns if col not in header]
+    width = len(columns)
+
+    ranges = []
+    if width > len(header):
+        ranges.append((1, len(header) + 1, [columns[len(header):]]))
+
+    old = np.full((max(len(oldValues) - 1, 0), width), '', dtype=object)
+    for i, row in enumerate(oldValues[1:]):
+        row = row[:width]
+        old[i, :len(row)] = row
+
+    # Positions of df's columns in the worksheet, first match wins.
+    positions = [columns.index(col) for col in new.columns]
+    grid = np.full((new.shape[0], width), '', dtype=object)
+    grid[:, positions] = new.values
+
+    if key is not None and key not in header and old.shape[0] > 0:
+        raise ValueError('Worksheet has rows but no %s column.' % key)
+    sheetRows = matchRows(old, grid, columns, key)
+    matched = np.flatnonzero(sheetRows >= 0)
+    appended = np.flatnonzero(sheetRows < 0)
+
+    # Only df's own columns are written to existing rows, minus preserved
+    # ones, unless the others are cleared.  Contiguous runs of writable
+    # columns are diffed separately, so a range never spans a column that
+    # must not be written.
+    writable = np.zeros(width, dtype=bool)
+    writable[[columns.index(col) for col in new.columns
+              if col not in preserveColumns]] = True
+    if clearColumns:
+        cleared = np.ones(width, dtype=bool)
+        cleared[positions] = False
+        writable |= cleared
+        named = np.array([col != '' for col in columns], dtype=bool)
+        for start, end in runs(np.flatnonzero(cleared & named)):
+            ranges.append((1, start + 1, [[''] * (end - start + 1)]))
+    changed = old[sheetRows[matched]] != grid[matched]
+    changed &= writable
+
+    for start, end in runs(np.flatnonzero(writable)):
+        block = changed[:, start:end + 1]
+        rows = np.flatnonzero(block.any(axis=1))
+        lo = start + block[rows].argmax(axis=1)
+        hi = end - block[rows, ::-1].argmax(axis=1)
+        ranges += blockRanges(sheetRows[matched][rows], lo, hi,
+                              grid[matched][rows])
+
+    if len(appended) > 0:
+        ranges.append((old.shape[0] + 2, 1, grid[appended].tolist()))
+
+    kept = set(sheetRows[matched].tolist())
+    staleRows = [i + 2 for i in range(old.shape[0]) if i not in kept]
+
+    return {
+        'ranges': ranges,
+        'staleRows': staleRows,
+        'numRows': old.shape[0] + len(appended) + 1,
+        'numCols': width,
+        'numAppended': len(appended),
+    }
+
+
+def applyPlan(oldValues, plan):
+    """applyPlan.  Worksheet contents after writing a plan, as get_all_values
+    would return them.
+
+    Parameters
+    ----------
+    oldValues : list[list[str]]
+        worksheet contents before, header first
+    plan : dict
+        output of diffPlan for oldValues
+    """
+    width = max([plan['numCols']] + [len(row) for row in oldValues])
+    grid = [list(row) + [''] * (width - len(row)) for row in oldValues]
+    grid += [[''] * width for _ in range(plan['numRows'] - len(grid))]
+
+    for row, col, values in plan['ranges']:
+        for i, vals in enumerate(values):
+            grid[row - 1 + i][col - 1:col - 1 + len(vals)] = vals
+    for row in reversed(plan['staleRows']):
+        del grid[row - 1]
+
+    while grid and not any(grid[-1]):
+        grid.pop()
+    width = max([max([i + 1 for i, val in enumerate(row) if val] or [0])
+                 for row in grid] or [0])
+
+    return [row[:width] for row in grid]
+
+
+def matchRows(old, grid, columns, key):
+    """matchRows.  Row of old (0-based) each row of grid replaces, or -1 for
+    new rows.  Rows sharing a key are matched in order: the second row of a
+    key replaces the second worksheet row with that key, and so on.
+
+    Parameters
+    ----------
+    old : numpy.ndarray
+        worksheet cells, without the header
+    grid : numpy.ndarray
+        new cells in worksheet column order
+    columns : list[str]
+        worksheet columns
+    key : str
+        column identifying rows, or None to match by position
+    """
+    if key is None:
+        positions = np.arange(grid.shape[0])
+        return np.where(positions < old.shape[0], positions, -1)
+
+    col = columns.index(key)
+    oldKeys = pd.Series(old[:, col])
+    newKeys = pd.Series(grid[:, col])
+
+    found = pd.MultiIndex.from_arrays(
+        [oldKeys, oldKeys.groupby(oldKeys).cumcount()]
+    ).get_indexer(pd.MultiIndex.from_arrays(
+        [newKeys, newKeys.groupby(newKeys).cumcount()]))
+
+    return found
+
+
+def blockRanges(sheetRows, lo, hi, grid):
+    """blockRanges.  Ranges covering changed cells of one block of columns.
+    Consecutive worksheet rows with the same changed span share a range.
+
+    Parameters
+    ----------
+    sheetRows : numpy.ndarray
+        worksheet rows (0-based, without the header) with a change
+    lo : numpy.ndarray
+        first changed column of each row
+    hi : numpy.ndarray
+        last changed column of each row
+    grid : numpy.ndarray
+        new cells of each row, in worksheet column order
+    """
+    order = np.argsort(sheetRows, kind='mergesort')
+
+    ranges = []
+    for i in order:
+        row, values = sheetRows[i] + 2, grid[i, lo[i]:hi[i] + 1].tolist()
+        if ranges:
+            lastRow, lastCol, lastValues = ranges[-1]
+            if (lastRow + len(lastValues) == row and lastCol == lo[i] + 1
+                    and len(lastValues[0]) == len(values)):
+                lastValues.append(values)
+                continue
+        ranges.append((row, lo[i] + 1, [values]))
+
+    return ranges
+
+
+def cellValues(df):
+    """cellValues.  df as strings the way they are written to the worksheet.
+    Missing values are empty strings.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        dataframe to upload
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [str(col) for col in df.columns]
+
+    return df.astype(object).where(df.notna(), '').astype(str)
+
+
+def runs(values):
+    """runs.  Sorted integers as (first, last) pairs of consecutive runs.
+
+    Parameters
+    ----------
+    values : list[int]
+        sorted integers
+    """
+    found = []
+    for value in values:
+        if found and found[-1][1] + 1 == value:
+            found[-1] = (found[-1][0], value)
+        else:
+            found.append((value, value))
+
+    return found
+
+
+def rangeName(title, row, col, values):
+    """rangeName.  A1 range of a block of values in a worksheet.
+
+    Parameters
+    ----------
+    title : str
+        worksheet title
+    row : int
+        first row, 1-based
+    col : int
+        first column, 1-based
+    values : list[list[str]]
+        rows of values
+    """
+    return "'%s'!%s:%s" % (
+        title.replace("'", "''"),
+        rowcol_to_a1(row, col),
+        rowcol_to_a1(row + len(values) - 1, col + len(values[0]) - 1))
@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+from gspread.exceptions import APIError
+from gspread.urls import SPREADSHEETS_API_V4_BASE_URL
+from gspread.utils import fill_gaps
+from ingest.sheets_sink import applyPlan, applyPlans, diffPlan
+from scrapers.rate_limiter import AdaptiveRateLimiter
+import random
+import time
+
+# The Sheets API allows 60 requests a minute per user.
+MAX_REQUESTS_PER_SECOND = 1.0
+
+# Statuses worth retrying: out of quota, and server errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TabUpload:
+    """TabUpload.  A dataframe to upload to one worksheet.  See
+    ingest.sheets_sink.diffPlan for key, preserveColumns and clearColumns.
+    """
+
+    def __init__(self, df, worksheetName, key=None, preserveColumns=(),
+                 clearColumns=False):
+        """__init__.  Create a TabUpload.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            dataframe to upload.  Will not upload index.
+        worksheetName : str
+            page name for the upload.  Created if missing.
+        key : str
+            column identifying rows, e.g. case_number.  Rows are matched by
+            position if None.
+        preserveColumns : list[str]
+            columns only written for new rows.
+        clearColumns : bool
+            blank worksheet columns that are not in df.
+        """
+        self.df = df
+        self.worksheetName = worksheetName
+        self.key = key
+        self.preserveColumns = preserveColumns
+        self.clearColumns = clearColumns
+
+
+class UploadScheduler:
+    """UploadScheduler.  Uploads dataframes to several worksheets of one
+    spreadsheet together, writing only what changed.
+
+    Every worksheet is read, diffed and written at once rather than one after
+    another: one metadata call finds them all, worksheets not in the cache
+    are downloaded in one call, missing worksheets are created and grids
+    grown in one call, changed cells of every worksheet share
+    values_batch_update calls (sent concurrently when there are several),
+    and stale rows of every worksheet are deleted in one call.  Worksheets
+    are diffed concurrently.
+
+    Every API call waits on a rate limiter shared by the whole run, and calls
+    that fail for quota or server errors back off and are retried.
+    """
+
+    def __init__(self, gc, cache=None, rateLimiter=None, maxWorkers=4,
+                 maxRetries=3, backoffBase=1.0, backoffCap=30.0):
+        """__init__.  Create an UploadScheduler.
+
+        Parameters
+        ----------
+        gc : gspread.Client
+            authorized client, or ingest.local_sheets.LocalSheetsClient.
+            Reused for every call.
+        cache : ingest.sheet_cache.SheetCache
+            snapshots of worksheets.  Worksheets are read from it rather than
+            downloaded when unchanged, and it is kept up to date with what is
+            written.  Worksheets are downloaded every time by default.
+        rateLimiter : scrapers.rate_limiter.RateLimiter
+            limiter to wait on before each call and report outcomes to.
+            Backs off from MAX_REQUESTS_PER_SECOND by default.
+        maxWorkers : int
+            worksheets diffed, and calls sent, at once.
+        maxRetries : int
+            retries after the first attempt for quota and server errors.
+        backoffBase : float
+            seconds of backoff before the first retry, doubling after that.
+        backoffCap : float
+            most seconds to back off before any one retry.
+        """
+        self.gc = gc
+        self.cache = cache
+        self.rateLimiter = (rateLimiter or
+                            AdaptiveRateLimiter(MAX_REQUESTS_PER_SECOND))
+        self.maxWorkers = maxWorkers
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffCap = backoffCap
+
+    def upload(self, countySheetId, uploads):
+        """upload.  Make each worksheet hold its dataframe.  Returns the plan
+        applied to each worksheet by page name, see
+        ingest.sheets_sink.diffPlan.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id of target
+        uploads : list[TabUpload]
+            dataframes to upload, at most one per worksheet
+        """
+        # Read before worksheets are created, which changes the sheet too.
+        if self.cache is not None:
+            marker = self.call(self.cache.modifiedTime, countySheetId)
+
+        spreadsheet = self.call(self.gc.open_by_key, countySheetId)
+        worksheets = {worksheet.title: worksheet
+                      for worksheet in self.call(spreadsheet.worksheets)}
+
+        oldValues = self.read(countySheetId, spreadsheet,
+                              [upload.worksheetName for upload in uploads
+                               if upload.worksheetName in worksheets],
+                              marker if self.cache is not None else None)
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            plans = dict(zip(
+                [upload.worksheetName for upload in uploads],
+                executor.map(
+                    lambda upload: diffPlan(
+                        oldValues.get(upload.worksheetName, []), upload.df,
+                        upload.key, upload.preserveColumns,
+                        upload.clearColumns),
+                    uploads)))
+
+            created = [name for name in plans if name not in worksheets]
+            if created:
+                self.call(spreadsheet.batch_update, {'requests': [
+                    {'addSheet': {'properties': {
+                        'title': name,
+                        'sheetType': 'GRID',
+                        'gridProperties': {
+                            'rowCount': plans[name]['numRows'],
+                            'columnCount': plans[name]['numCols'],
+                        },
+                    }}} for name in created]})
+                worksheets = {worksheet.title: worksheet for worksheet
+                              in self.call(spreadsheet.worksheets)}
+
+            changed = [name for name, plan in plans.items()
+                       if plan['ranges'] or plan['staleRows']]
+            applyPlans(spreadsheet,
+                       [(worksheets[name], plans[name]) for name in changed],
+                       call=self.call, executor=executor)
+
+        if self.cache is not None and (created or changed):
+            self.cache.wroteAll(
+                countySheetId,
+                {name: applyPlan(oldValues.get(name, []), plans[name])
+                 for name in set(created + changed)},
+                marker,
+                self.call(self.cache.modifiedTime, countySheetId))
+
+        return plans
+
+    def read(self, countySheetId, spreadsheet, worksheetNames, marker=None):
+        """read.  Contents of worksheets, as get_all_values returns them, by
+        page name.  Worksheets not in the cache are downloaded in one call.
+
+        Parameters
+        ----------
+        countySheetId : str
+            sheet id
+        spreadsheet : gspread.models.Spreadsheet
+            the spreadsheet
+        worksheetNames : list[str]
+            page names of existing worksheets
+        marker : str
+            modifiedTime of the spreadsheet, if using the cache
+        """
+        values = {}
+        if self.cache is not None:
+            for name in worksheetNames:
+                found = self.cache.lookup(countySheetId, name, marker)
+                if found is not None:
+                    print('Using cached %s.' % name)
+                    values[name] = found
+
+        missing = [name for name in worksheetNames if name not in values]
+        if missing:
+            print('Downloading %s.' % ', '.join(missing))
+            response = self.call(spreadsheet.values_batch_get,
+                                 ["'%s'" % name.replace("'", "''")
+                                  for name in missing])
+            for name, valueRange in zip(missing, response['valueRanges']):
+                # Rows come back without trailing empty cells, and blank
+                # worksheets without values.
+                rows = valueRange.get('values', [])
+                values[name] = fill_gaps(rows) if rows else []
+                if self.cache is not None:
+                    self.cache.store(countySheetId, name, values[name],
+                                     marker)
+
+        return values
+
+    def call(self, method, *args, **kwargs):
+        """call.  Make an API call under the rate limiter, retrying quota and
+        server errors with jittered exponential backoff.
+
+        Parameters
+        ----------
+        method : function
+            gspread method making one request
+        """
+        for attempt in range(self.maxRetries + 1):
+            self.rateLimiter.wait(SPREADSHEETS_API_V4_BASE_URL)
+            start = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except APIError as e:
+                status = getattr(e.response, 'status_code', None)
+                self.rateLimiter.record(SPREADSHEETS_API_V4_BASE_URL,
+                                        time.monotonic() - start, False)
+                if status not in RETRY_STATUSES or attempt == self.maxRetries:
+                    raise
+
+                delay = min(self.backoffCap, self.backoffBase * 2 ** attempt)
+                print('Sheets API returned %s.  Retrying in %.1fs.'
+                      % (status, delay))
+                time.sleep(random.uniform(delay / 2, delay))
+                continue
+
+            self.rateLimiter.record(SPREADSHEETS_API_V4_BASE_URL,
+                                    time.monotonic() - start, True)
+
+            return result
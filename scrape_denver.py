@@ -1,16 +1,38 @@
-from analyze.agg_tables import AggTables
-from analyze.derived_columns import addDerivedColumns
+from analyze.chunked import MEMORY_LIMIT
 from dotenv import load_dotenv
-from glob import glob
-from ingest.sheets_ingest import SheetsIngest
+from ingest.sheets_ingest import (DEFAULT_BREAKDOWNS, SheetsIngest,
+                                  parseBreakdowns)
 from itertools import product
+from scrapers.case_state_store import CaseStateStore
 from scrapers.denver_case_scraper import DenverCaseScraper
 from scrapers.denver_dockets import DenverDocketScraper
+from scrapers.denver_pipeline import DenverPipeline
+from scrapers.denver_session import DenverSession
+from scrapers.fetch_policy import FetchPolicy
+from scrapers.rate_limiter import AdaptiveRateLimiter
+from scrapers.response_cache import CachedSession, ResponseCache
+from scrapers.run_journal import RunJournal
+import argparse
 import os
 import pandas as pd
 
 load_dotenv()
 
+parser = argparse.ArgumentParser()
+parser.add_argument('--replay', action='store_true',
+                    help='Run against cached pages only, without touching the '
+                    'court site.')
+parser.add_argument('--resume', action='store_true',
+                    help='Pick up an interrupted run where it left off, '
+                    'reusing dockets and cases it already scraped.')
+parser.add_argument('--refresh-closed', action='store_true',
+                    help='Fetch closed cases again instead of reusing their '
+                    'stored records.')
+parser.add_argument('--chunked', action='store_true',
+                    help='Join the cases with the sheet\'s history a '
+                    'partition at a time, under HISTORY_MEMORY_MB.')
+args = parser.parse_args()
+
 # Set parameters in the .env in this directory (ignored by git.  DENVER_SESS_ID
 # is the PHPSESSID cookie, which can be found by looking around in the developer
 # tools menu of most web browsers (chrome, firefox, etc.).  URL_TOKEN can be
@@ -21,6 +43,31 @@ sessId = os.getenv('DENVER_SESS_ID')
 urlToken = os.getenv('DENVER_URL_TOKEN')
 outputName = os.getenv('DENVER_OUTPUT_FILENAME')
 
+# Concurrency settings for case requests.  The rate ceiling is shared by every
+# scraper in the run so it holds for the court site as a whole, and backs off
+# when the site slows down or errors.
+maxWorkers = int(os.getenv('DENVER_MAX_WORKERS') or 8)
+maxRequestsPerSecond = float(os.getenv('DENVER_MAX_REQUESTS_PER_SECOND') or 4)
+maxRetries = int(os.getenv('DENVER_MAX_RETRIES') or 3)
+fetchPolicy = FetchPolicy(AdaptiveRateLimiter(maxRequestsPerSecond),
+                          maxRetries=maxRetries)
+
+# Dockets are parsed across this many processes.
+docketProcesses = int(os.getenv('DENVER_DOCKET_PROCESSES') or 1)
+
+# One pooled session for every scraper so connections to the court site are
+# reused across the whole run.  Pages are cached under out/ so a replay can
+# rebuild the output without the court site.
+cache = ResponseCache(os.getenv('DENVER_CACHE_DIR') or 'out/http_cache')
+if args.replay:
+    print('Replaying from cached pages at %s.' % cache.cacheDir)
+    # Cache keys leave these out, so any placeholder will do.
+    sessId = sessId or ''
+    urlToken = urlToken or ''
+    session = CachedSession(None, cache, replay=True)
+else:
+    session = CachedSession(DenverSession(sessId, poolSize=maxWorkers), cache)
+
 # Courtrooms.
 rooms = [
     '104',
@@ -35,33 +82,54 @@ DENVER_DATA = {
 
 
 dates = [str(_.date()) for _ in pd.date_range(firstDate, lastDate)]
-allCasesDf = pd.DataFrame(columns=DenverCaseScraper.outputColumns)
-
-for date, room in product(dates, rooms):
-    print('Grabbing cases on %s in room %s.' % (date, room))
-
-    docketScraper = DenverDocketScraper(date, sessId, room, urlToken)
-    docketDf = docketScraper.scrape()
 
-    if docketDf.shape[0] == 0:
-        print('No cases.')
-        continue
+docketScrapers = [DenverDocketScraper(date, sessId, room, urlToken,
+                                      session=session,
+                                      fetchPolicy=fetchPolicy)
+                  for date, room in product(dates, rooms)]
 
-    # CaseScraper can now scrape all dockets at once, but that takes forever,
-    # so we do one docket at a time.
-    caseScraper = DenverCaseScraper(sessId, urlToken)
-    casesDf = caseScraper.scrape(docketDf)
+# Progress is journaled for every run so that any run can be resumed.
+journal = RunJournal(os.getenv('DENVER_JOURNAL') or
+                     'out/journal__%s__%s.sqlite' % (firstDate, lastDate))
+if args.resume:
+    print('Resuming run from journal at %s.' % journal.path)
+else:
+    journal.reset()
 
-    print('Saving csv backup at %s.' % outputName)
-    casesDf.to_csv('%s__%s__%s.csv' % (outputName, date, room), index=False)
+# Last known state of every case, so unchanged and closed cases are cheap.  A
+# replay is there to parse cached pages again, so it goes without.
+stateStore = None
+if not args.replay:
+    stateStore = CaseStateStore(os.getenv('DENVER_CASE_STATE') or
+                                'out/case_state.sqlite')
 
-    allCasesDf = pd.concat([allCasesDf, casesDf])
+caseScraper = DenverCaseScraper(sessId, urlToken,
+                                maxWorkers=maxWorkers,
+                                fetchPolicy=fetchPolicy,
+                                session=session,
+                                journal=journal,
+                                stateStore=stateStore,
+                                refreshClosed=args.refresh_closed)
 
-# pandas.concat can result in duplicate index values.  This causes d2g to error.
-ingestDf = allCasesDf.reset_index(drop=True)
+# Dockets are fetched ahead while cases for earlier dockets are scraped, and
+# derived columns and csv backups run as their own stages.
+print('Grabbing %d dockets.' % len(docketScrapers))
+pipeline = DenverPipeline(docketScrapers, caseScraper,
+                          outputName=outputName,
+                          docketProcesses=docketProcesses,
+                          journal=journal)
+ingestDf = pipeline.run()
 
 print('Ingesting FED cases to google sheets')
-sheetsIngest = SheetsIngest(serviceAccountConfigLoc=os.getenv('GOOGLE_TOKEN'))
+# Uploads share one ceiling on Sheets API calls, backing off when over quota.
+sheetsRequestsPerSecond = float(
+    os.getenv('SHEETS_MAX_REQUESTS_PER_SECOND') or 1)
+sheetsIngest = SheetsIngest(
+    serviceAccountConfigLoc=os.getenv('GOOGLE_TOKEN'),
+    rateLimiter=AdaptiveRateLimiter(sheetsRequestsPerSecond),
+    breakdowns=parseBreakdowns(os.getenv('SHEETS_BREAKDOWNS') or
+                               DEFAULT_BREAKDOWNS),
+    memoryLimit=MEMORY_LIMIT if args.chunked else None)
 sheetsIngest.ingestNewBatchAndUpload(
     newlyScrapedCases=ingestDf,
     countySheetId=DENVER_DATA['sheet_id']
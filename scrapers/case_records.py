@@ -0,0 +1,76 @@
+import pandas as pd
+
+
+class CaseRecords:
+    """CaseRecords.  Columnar accumulator for scraped cases.
+
+    Rows are appended to one list per column and turned into a DataFrame once,
+    instead of growing a DataFrame row by row or concatenating one per docket,
+    both of which copy everything scraped so far on every step.
+    """
+
+    __slots__ = ('columns', 'data', 'numRows')
+
+    def __init__(self, columns):
+        """__init__.  Construct an empty CaseRecords instance.
+
+        Parameters
+        ----------
+        columns : list[str]
+            output columns, in order.
+        """
+        self.columns = list(columns)
+        self.data = {col: [] for col in self.columns}
+        self.numRows = 0
+
+    def __len__(self):
+        return self.numRows
+
+    def append(self, row):
+        """append.  Add one row.
+
+        Parameters
+        ----------
+        row : list
+            values in the same order as columns.
+        """
+        if len(row) != len(self.columns):
+            raise ValueError('Expected %d values but got %d.'
+                             % (len(self.columns), len(row)))
+
+        for col, val in zip(self.columns, row):
+            self.data[col].append(val)
+        self.numRows += 1
+
+    def appendDf(self, df):
+        """appendDf.  Add every row of a dataframe.  Columns of df that are not
+        in columns are ignored and missing ones are filled with None.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            rows to add
+        """
+        for col in self.columns:
+            if col in df.columns:
+                self.data[col].extend(df[col].tolist())
+            else:
+                self.data[col].extend([None] * df.shape[0])
+        self.numRows += df.shape[0]
+
+    def toDf(self):
+        """toDf.  Build a DataFrame of everything appended so far.  Columns
+        of an empty DataFrame are object, as string columns would be.  """
+        if self.numRows == 0:
+            return pd.DataFrame(columns=self.columns, dtype=object)
+
+        return pd.DataFrame(self.data, columns=self.columns)
+
+    def drain(self):
+        """drain.  Build a DataFrame of everything appended so far and start
+        over empty.  Use to stream rows out in chunks.  """
+        df = self.toDf()
+        self.data = {col: [] for col in self.columns}
+        self.numRows = 0
+
+        return df
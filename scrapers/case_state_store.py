@@ -0,0 +1,135 @@
+from analyze.derived_columns import evictedFlag, getHistoryDf
+from scrapers.denver_case_parser import PARSER_VERSION
+from threading import Lock
+import json
+import os
+import sqlite3
+import time
+
+
+class CaseStateStore:
+    """CaseStateStore.  Local store of the last known state of every case,
+    keyed by case number.
+
+    For each case it keeps a hash of the last case page, the record extracted
+    from it, and whether the case is closed.  DenverCaseScraper uses it to
+    skip parsing pages that have not changed and to skip fetching closed
+    cases entirely.  The store is stamped with
+    denver_case_parser.PARSER_VERSION and emptied when that changes, so a
+    parser fix reaches every case.
+    """
+
+    def __init__(self, path='out/case_state.sqlite'):
+        """__init__.  Open (or create) a CaseStateStore.
+
+        Parameters
+        ----------
+        path : str
+            sqlite file for the store.  Parent directories are created.
+        """
+        self.path = path
+        self.lock = Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+        version = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'parser_version'").fetchone()
+        if version is None or version[0] != PARSER_VERSION:
+            if version is not None:
+                print('Parser version changed from %s to %s.  Dropping '
+                      'stored cases.' % (version[0], PARSER_VERSION))
+            self.conn.execute('DROP TABLE IF EXISTS cases')
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('parser_version', ?)",
+                (PARSER_VERSION,))
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS cases ('
+            'case_number TEXT PRIMARY KEY, page_hash TEXT, record TEXT, '
+            'terminal INTEGER, updated_at REAL)')
+        self.conn.commit()
+
+    def get(self, caseNum):
+        """get.  Return the stored state of a case as a dict, or None.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT page_hash, record, terminal FROM cases '
+                'WHERE case_number = ?',
+                (caseNum,)).fetchone()
+
+        if found is None:
+            return None
+
+        return {
+            'page_hash': found[0],
+            'record': json.loads(found[1]),
+            'terminal': bool(found[2]),
+        }
+
+    def put(self, caseNum, pageHash, record):
+        """put.  Store the latest state of a case.  Returns the stored state.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number
+        pageHash : str
+            hash of the case page the record was extracted from
+        record : dict
+            extracted record, as from parseCasePage plus scraped_on.  Keeps
+            the actions list, so reused records still yield action events.
+        """
+        terminal = isClosed(record['action_history'])
+
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?)',
+                (caseNum, pageHash, json.dumps(record, sort_keys=True),
+                 int(terminal), time.time()))
+            self.conn.commit()
+
+        return {
+            'page_hash': pageHash,
+            'record': record,
+            'terminal': terminal,
+        }
+
+
+def isClosed(actionHistory):
+    """isClosed.  Whether the case is closed, i.e., its latest action is a
+    dismissal or it ended in a writ of restitution that was not later
+    dismissed.
+
+    Parameters
+    ----------
+    actionHistory : str
+        a value from the action_history column
+    """
+    try:
+        df = getHistoryDf(actionHistory)
+    except Exception:
+        # Unreadable history.  Never treat it as closed.
+        return False
+
+    df = df.dropna(subset=['timestamp'])
+    if df.shape[0] == 0:
+        return False
+
+    # getHistoryDf sorts by timestamp, so the latest action is last.
+    latest = df.iloc[-1]
+    terminal = (latest['action'].startswith('DISMISSED')
+                or evictedFlag(actionHistory))
+
+    return bool(terminal)
@@ -0,0 +1,173 @@
+from bs4 import UnicodeDammit
+import lxml.html
+import numpy as np
+
+
+def tableXPath(cl):
+    """tableXPath.  XPath for every table tag with cl among its classes.
+
+    Parameters
+    ----------
+    cl : str
+        class for the table tag
+    """
+    return ("//table[contains(concat(' ', normalize-space(@class), ' '), "
+            "' %s ')]" % cl)
+
+
+# Version of what is extracted from case pages.  Bump it with any change to
+# parseCasePage or DenverCaseScraper.parseWithSoup, so stored records of
+# earlier parses are dropped.
+PARSER_VERSION = 2
+
+STATUS_XPATH = tableXPath('status')
+PARTY_XPATH = tableXPath('party')
+ACTIONS_XPATH = tableXPath('actions')
+
+
+def parseCasePage(content):
+    """parseCasePage.  Extract case facts from a denvercountycourt.org case
+    page in one pass over the status, party and actions tables.
+
+    Output is identical to the BeautifulSoup path in DenverCaseScraper, and it
+    fails on the same malformed pages, but it builds no DataFrames along the
+    way.  Returns a dict keyed by DenverCaseScraper.outputColumns, plus actions,
+    the list of [act date, description, status] behind action_history.
+
+    Parameters
+    ----------
+    content : bytes
+        raw html of the case page
+    """
+
+    # Decode the same way BeautifulSoup does so both engines see the same text.
+    markup = UnicodeDammit(content, is_html=True).unicode_markup
+    root = lxml.html.fromstring(markup)
+
+    statusTables = root.xpath(STATUS_XPATH)
+    if len(statusTables) == 0:
+        raise RuntimeError('Case page has no status table.')
+
+    # Every labeled cell in the status table, scanned once.
+    statusHits = {}
+    for row in statusTables[0].iter('tr'):
+        cells = rowCells(row)
+        for cell, nextCell in zip(cells[:-1], cells[1:]):
+            if nextCell.tag == 'td':
+                statusHits.setdefault(cell.text_content(), []).append(
+                    nextCell.text_content())
+
+    # Parties are kept in one table for each party.
+    partyRows = []
+    for table in root.xpath(PARTY_XPATH):
+        partyRows.extend(tableRecords(table))
+    if len(partyRows) == 0:
+        raise RuntimeError('Case page has no parties.')
+
+    plaintiffs = [row for row in partyRows
+                  if row.get('Party Type') == 'PLAINTIFF']
+    defendants = [row for row in partyRows
+                  if row.get('Party Type') == 'DEFENDANT']
+
+    actionTables = root.xpath(ACTIONS_XPATH)
+    if len(actionTables) == 0:
+        raise RuntimeError('Case page has no actions table.')
+    actions = tableRecords(actionTables[0])
+
+    # Mirror DataFrame.sort_values, which sorts with an unstable quicksort.
+    actDates = np.array([row['Act Date'] for row in actions], dtype=object)
+    actions = [actions[i] for i in actDates.argsort(kind='quicksort')]
+
+    return {
+        'case_title': statusValue(statusHits, 'Case Title:'),
+        'type': statusValue(statusHits, 'Type:'),
+        'total_amount': statusValue(statusHits, 'Total:'),
+        'plaintiff': collect(plaintiffs, 'Name', sep='|'),
+        'defendant': collect(defendants, 'Name', sep='|'),
+        'plaintiff_attorney': collect(plaintiffs, 'Attorney Name', sep='|'),
+        'defendant_attorney': collect(defendants, 'Attorney Name', sep='|'),
+        'action_history': collect(
+            [{'full_history': (row['Act Date'] + '|' +
+                               row['Description'] + '|' +
+                               row['Status'])}
+             for row in actions],
+            'full_history'),
+        'actions': [[row['Act Date'], row['Description'], row['Status']]
+                    for row in actions],
+    }
+
+
+def rowCells(row):
+    """rowCells.  Every tag below a tr, in document order.
+
+    Parameters
+    ----------
+    row : lxml.html.HtmlElement
+        a tr element
+    """
+    return [el for el in row.iterdescendants() if isinstance(el.tag, str)]
+
+
+def tableRecords(table):
+    """tableRecords.  Read a table into a list of dicts keyed by the first row.
+    Rows that do not match the header width are skipped.
+
+    Parameters
+    ----------
+    table : lxml.html.HtmlElement
+        a table element
+    """
+    rows = list(table.iter('tr'))
+    headers = [cell.text_content() for cell in rowCells(rows[0])]
+
+    records = []
+    for row in rows[1:]:
+        cells = [cell.text_content() for cell in rowCells(row)]
+        if len(cells) != len(headers):
+            print('Failed to record row.  Continuing.')
+            continue
+        records.append(dict(zip(headers, cells)))
+
+    return records
+
+
+def statusValue(statusHits, label):
+    """statusValue.  Value of the cell labeled by label.  Raises RuntimeError
+    if there is more than one.
+
+    Parameters
+    ----------
+    statusHits : dict
+        label to list of values, as scanned from the status table
+    label : str
+        label to look for
+    """
+    hits = statusHits.get(label, [])
+
+    if len(hits) == 0:
+        print('Did not find any hits for cell %s.' % label)
+        return ''
+    elif len(hits) > 1:
+        raise RuntimeError('Found too many hits for cell %s.' % label)
+    else:
+        return hits[0]
+
+
+def collect(records, key, sep=','):
+    """collect.  Join one field of every record into a delimited string.
+    Raises if there are no records or the field is missing, as the DataFrame
+    path does.
+
+    Parameters
+    ----------
+    records : list[dict]
+        records to collect from
+    key : str
+        field to collect
+    sep : str
+        delimiter for the resulting string.  Comma by default.
+    """
+    if len(records) == 0:
+        raise ValueError('Nothing to collect for %s.' % key)
+
+    return (sep + ' ').join(record[key] for record in records)
@@ -1,10 +1,19 @@
+from analyze.action_history import (caseFlags, eventTable,
+                                    splitActionHistory)
 from analyze.derived_columns import addDerivedColumns
 from bs4 import BeautifulSoup
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from functools import reduce
 from pyquery import PyQuery as pq
+from scrapers.case_records import CaseRecords
+from scrapers.denver_case_parser import parseCasePage
+from scrapers.denver_session import DenverSession
+from scrapers.fetch_policy import FetchFailure, FetchPolicy, ParseFailure
+from threading import Lock
+import hashlib
 import pandas as pd
-import requests
 
 
 class DenverCaseScraper:
@@ -30,7 +39,21 @@ class DenverCaseScraper:
         'scraped_on',
     ]
 
-    def __init__(self, sessId, urlToken):
+    # Raw action events, one row per action on a case.  See
+    # analyze.action_history.eventTable for the typed table.
+    eventColumns = [
+        'case_number',
+        'date',
+        'room',
+        'seq',
+        'act_date',
+        'description',
+        'status',
+    ]
+
+    def __init__(self, sessId, urlToken, maxWorkers=1, rateLimiter=None,
+                 session=None, engine='lxml', journal=None, stateStore=None,
+                 refreshClosed=False, fetchPolicy=None):
         """__init__.  Construct a DenverCaseScraper instance.
 
         Parameters
@@ -43,11 +66,54 @@ class DenverCaseScraper:
             room to scrape.  Used for constructing the URL
         urlToken : str
             token for constructing the case URL
+        maxWorkers : int
+            maximum number of case requests in flight at once.
+        rateLimiter : scrapers.rate_limiter.RateLimiter
+            per-host request ceiling.  Share one between scrapers to hold the
+            ceiling across a whole run.  No ceiling by default.  Ignored if
+            fetchPolicy is given.
+        session : scrapers.denver_session.DenverSession
+            pooled session to request through.  Share one between scrapers to
+            reuse connections.  A new session is opened by default.
+        engine : str
+            'lxml' for the single-pass parser in scrapers.denver_case_parser,
+            or 'bs4' for the original BeautifulSoup parser.
+        journal : scrapers.run_journal.RunJournal
+            progress journal.  Cases already in it are not scraped again and
+            newly scraped cases are recorded in it.
+        stateStore : scrapers.case_state_store.CaseStateStore
+            last known state of every case.  Pages that have not changed since
+            they were stored are not parsed again, and closed cases are not
+            fetched at all.
+        refreshClosed : bool
+            fetch closed cases anyway.
+        fetchPolicy : scrapers.fetch_policy.FetchPolicy
+            rate limit and retry policy for case requests.  By default, a
+            policy over rateLimiter.
         """
+        if engine not in ('lxml', 'bs4'):
+            raise ValueError('Unknown engine %s.' % engine)
+
+        self.engine = engine
         self.scrapedOn = str(date.today())
         self.token = urlToken
         self.sessId = sessId
-        self.soup = None
+        self.maxWorkers = maxWorkers
+        self.fetchPolicy = fetchPolicy or FetchPolicy(rateLimiter)
+        self.session = session or DenverSession(sessId, poolSize=maxWorkers)
+        self.journal = journal
+        self.stateStore = stateStore
+        self.refreshClosed = refreshClosed
+
+        # Cases that failed, waiting for one more try at the end of the run,
+        # and cases that failed that too.
+        self.lock = Lock()
+        self.retryQueue = []
+        self.failures = []
+
+        # Actions of every FED case scraped so far, by case number, date and
+        # room.
+        self.caseActions = {}
 
     def scrape(self, docketDf):
         """scrape.  Scrape every case number in docket_df.
@@ -58,6 +124,37 @@ class DenverCaseScraper:
             docketDf - dataframe with case number, room, and date.
         """
 
+        casesDf = self.scrapeRaw(docketDf)
+        retriedDf = self.retryFailed()
+        if retriedDf.shape[0] > 0:
+            casesDf = pd.concat([casesDf, retriedDf], ignore_index=True)
+
+        return self.addDerivedColumns(casesDf)
+
+    def addDerivedColumns(self, casesDf):
+        """addDerivedColumns.  derived_columns.addDerivedColumns, with the
+        flags read off the cases' action events rather than their
+        action_history strings.
+
+        Parameters
+        ----------
+        casesDf : pandas.DataFrame
+            FED cases scraped by this scraper
+        """
+        flags = caseFlags(casesDf, self.eventsDf(casesDf))
+
+        return addDerivedColumns(casesDf, flags=flags)
+
+    def scrapeRaw(self, docketDf):
+        """scrapeRaw.  Scrape every case number in docket_df, keeping only FED
+        cases, without adding derived columns.
+
+        Parameters
+        ----------
+        docketDf : pandas.DataFrame
+            docketDf - dataframe with case number, room, and date.
+        """
+
         # Drop all cases with empty fields (they seem to all have vacated court
         # dates) and also de-dupe repeat rows by case.  This can happen for
         # multiple parties on a given case.
@@ -65,32 +162,139 @@ class DenverCaseScraper:
               .dropna(subset=['case_number'])
               .drop_duplicates(subset=['case_number', 'date', 'room']))
 
-        outputDf = pd.DataFrame(columns=DenverCaseScraper.outputColumns)
+        records = CaseRecords(DenverCaseScraper.outputColumns)
+        cases = list(zip(df['case_number'], df['date'], df['room']))
+
+        print('Grabbing {} cases.'.format(len(cases)))
+        # Executor.map yields results in submission order, so the output rows
+        # line up with the docket no matter which request finishes first.
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            rows = executor.map(lambda case: self.tryScrapeCase(*case), cases)
+            for row in rows:
+                if row is not None:
+                    records.append(row)
+
+        outputDf = records.toDf()
+
+        # Dropping non-FED cases for space savings and privacy of parties.
+        return outputDf[outputDf['type'] == 'FED']
+
+    def retryFailed(self):
+        """retryFailed.  Give every case on the retry queue one more try, one
+        at a time.  Returns the FED cases that succeeded, without derived
+        columns.  Cases that fail again are kept in self.failures.  """
+
+        with self.lock:
+            queued, self.retryQueue = self.retryQueue, []
+
+        records = CaseRecords(DenverCaseScraper.outputColumns)
+        if len(queued) > 0:
+            print('Retrying %d failed cases.' % len(queued))
 
-        print('Grabbing {} cases.'.format(len(df['case_number'])))
-        for i, idx in enumerate(df.index):
-            caseNum = df.loc[idx, 'case_number']
-            date = df.loc[idx, 'date']
-            room = df.loc[idx, 'room']
+        for caseNum, date, room, _ in queued:
+            row = self.tryScrapeCase(caseNum, date, room)
+            if row is not None:
+                records.append(row)
 
+        with self.lock:
+            self.failures.extend(self.retryQueue)
+            self.retryQueue = []
+
+            if len(self.failures) > 0:
+                kinds = Counter(failure.kind
+                                for _, _, _, failure in self.failures)
+                print('Gave up on %d cases: %s.' % (
+                    len(self.failures),
+                    ', '.join('%d %s' % (n, kind)
+                              for kind, n in sorted(kinds.items()))))
+
+        outputDf = records.toDf()
+        return outputDf[outputDf['type'] == 'FED']
+
+    def tryScrapeCase(self, caseNum, date, room):
+        """tryScrapeCase.  Scrape a single case, returning None and putting it
+        on the retry queue if it fails.  The actions of FED cases are added to
+        self.events.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number to scrape
+        date : str
+            date of the docket the case was found on
+        room : str
+            room of the docket the case was found on
+        """
+
+        row = None
+        if self.journal is not None:
+            row = self.journal.scrapedCase(caseNum, date, room)
+
+        if row is not None:
+            actions = self.journal.scrapedActions(caseNum, date, room)
+            if actions is None:
+                actions = splitActionHistory(
+                    row[self.columnIndex('action_history')])
+        else:
             print('Grabbing case number: ' + caseNum)
             try:
-                row = self.scrapeSingleCase(caseNum, date, room)
-            except:
-                print('Scraping failed for case number %s.' % caseNum)
-                row = ([caseNum, date, room, self.scrapedOn] +
-                       [''] * (len(DenverCaseScraper.outputColumns) - 4))
+                row, actions = self.scrapeSingleCase(caseNum, date, room)
+            except FetchFailure as failure:
+                print('Scraping failed for case number %s (%s: %s).'
+                      % (caseNum, failure.kind, failure))
+                with self.lock:
+                    self.retryQueue.append((caseNum, date, room, failure))
+                return None
 
-            outputDf.loc[i] = row
+            # Failures are left out of the journal so a resumed run retries
+            # them.
+            if self.journal is not None:
+                self.journal.recordCase(row, actions)
 
-        # Dropping non-FED cases for space savings and privacy of parties.
-        outputDf = outputDf[outputDf['type'] == 'FED']
+        # Only FED cases are kept, so only their events are.
+        if row[self.columnIndex('type')] == 'FED':
+            with self.lock:
+                self.caseActions[(caseNum, date, room)] = actions
+
+        return row
+
+    def columnIndex(self, col):
+        return DenverCaseScraper.outputColumns.index(col)
+
+    def eventsDf(self, casesDf=None):
+        """eventsDf.  Typed action events of every FED case scraped so far,
+        ordered by case and then by position in the action history.
 
-        return addDerivedColumns(outputDf)
+        Parameters
+        ----------
+        casesDf : pandas.DataFrame
+            only the events of these cases.  Every case by default.
+        """
+        records = CaseRecords(DenverCaseScraper.eventColumns)
+        with self.lock:
+            if casesDf is None:
+                keys = list(self.caseActions)
+            else:
+                keys = [key for key in zip(casesDf['case_number'],
+                                           casesDf['date'], casesDf['room'])
+                        if key in self.caseActions]
+            for caseNum, date, room in keys:
+                actions = self.caseActions[(caseNum, date, room)]
+                for seq, (actDate, description, status) in enumerate(actions):
+                    records.append([caseNum, date, room, seq, actDate,
+                                    description, status])
+
+        records = records.toDf()
+
+        # Cases finish in whatever order their requests do.
+        records = records.sort_values(['date', 'room', 'case_number', 'seq'],
+                                      kind='mergesort')
+
+        return eventTable(records)
 
     def scrapeSingleCase(self, caseNum, date, room):
-        """scrapeSingleCase.  Scrape a single case number and return a list of
-        the desired information.
+        """scrapeSingleCase.  Scrape a single case number.  Returns a list of
+        the desired information and the list of the case's actions.
 
         Parameters
         ----------
@@ -103,13 +307,77 @@ class DenverCaseScraper:
             '&date=' + date + '&room=' + room + '&token=' + self.token +
             '&searchtype=searchdocket'
         )
-        response = requests.get(url, cookies={'PHPSESSID': self.sessId})
-        self.soup = BeautifulSoup(response.content, 'html.parser')
+        state = None
+        if self.stateStore is not None:
+            state = self.stateStore.get(caseNum)
+
+        if state is not None and state['terminal'] and not self.refreshClosed:
+            print('Case number %s is closed.  Using stored record.' % caseNum)
+            # The page is taken to be unchanged, so cache it under this url
+            # too and a replay of this run finds it.
+            if hasattr(self.session, 'link'):
+                self.session.link(url, state['page_hash'])
+            return (self.toRow(caseNum, date, room, state['record']),
+                    recordActions(state['record']))
+
+        response = self.fetchPolicy.fetch(self.session, url)
+
+        pageHash = hashlib.sha256(response.content).hexdigest()
+        if state is not None and state['page_hash'] == pageHash:
+            # Unchanged since last time, so the stored record still holds.
+            record = dict(state['record'], scraped_on=self.scrapedOn)
+        else:
+            try:
+                if self.engine == 'lxml':
+                    record = parseCasePage(response.content)
+                else:
+                    record = self.parseWithSoup(response.content)
+            except Exception as e:
+                raise ParseFailure('%s: %s' % (type(e).__name__, e)) from e
+            record = dict(record, scraped_on=self.scrapedOn)
+
+        if self.stateStore is not None:
+            self.stateStore.put(caseNum, pageHash, record)
+
+        return (self.toRow(caseNum, date, room, record),
+                recordActions(record))
+
+    def toRow(self, caseNum, date, room, record):
+        """toRow.  Lay out an extracted record as a row of outputColumns.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number
+        date : str
+            date of the docket the case was found on
+        room : str
+            room of the docket the case was found on
+        record : dict
+            extracted case facts, including scraped_on
+        """
+        return ([caseNum, date, room] +
+                [record[col] for col in DenverCaseScraper.outputColumns[3:]])
+
+    def parseWithSoup(self, content):
+        """parseWithSoup.  Extract case facts from a case page with
+        BeautifulSoup.  Slower than scrapers.denver_case_parser.parseCasePage
+        but kept as a reference for it.  Returns a dict keyed by outputColumns,
+        plus actions.
+
+        Parameters
+        ----------
+        content : bytes
+            raw html of the case page
+        """
+
+        # Kept local rather than on self since cases are scraped concurrently.
+        soup = BeautifulSoup(content, 'html.parser')
 
         # Get FED/MONEY by parsing html
 
         # Table containing general facts about case
-        statusTable = self.getTable(cl='status')
+        statusTable = self.getTable(soup, cl='status')
 
         # Get some basic facts
         caseTitle = self.findValInTable(statusTable, 'Case Title:')
@@ -118,19 +386,22 @@ class DenverCaseScraper:
 
         # Get Plaintiff(s) and defendant(s)
         # These results are kept in one table for each party.
-        partyTables = self.getTables(cl='party')
+        partyTables = self.getTables(soup, cl='party')
         partyDf = self.glueTables(partyTables)
 
         # Separate into plaintiffs and defendants
         plaintiffDf = partyDf[partyDf['Party Type'] == 'PLAINTIFF']
         defendantDf = partyDf[partyDf['Party Type'] == 'DEFENDANT']
-        plaintiff = self.collect(plaintiffDf['Name'])
-        plaintiffAttorney = self.collect(plaintiffDf['Attorney Name'])
+        # Names are 'LAST, FIRST', so parties are joined with '|'.
+        plaintiff = self.collect(plaintiffDf['Name'], sep='|')
+        plaintiffAttorney = self.collect(plaintiffDf['Attorney Name'],
+                                         sep='|')
         defendant = self.collect(defendantDf['Name'], sep='|')
-        defendantAttorney = self.collect(defendantDf['Attorney Name'])
+        defendantAttorney = self.collect(defendantDf['Attorney Name'],
+                                         sep='|')
 
         # Actions taken on case.
-        actionTable = self.getTable(cl='actions')
+        actionTable = self.getTable(soup, cl='actions')
         actionDf = (self.tableToDf(actionTable)
                     .sort_values('Act Date')
                     .fillna(''))
@@ -141,21 +412,19 @@ class DenverCaseScraper:
             actionDf['Status']
         )
         actionHistory = self.collect(actionDf['full_history'])
-
-        return [
-            caseNum,
-            date,
-            room,
-            caseTitle,
-            caseType,
-            totalAmt,
-            plaintiff,
-            defendant,
-            plaintiffAttorney,
-            defendantAttorney,
-            actionHistory,
-            self.scrapedOn,
-        ]
+        actions = actionDf[['Act Date', 'Description', 'Status']].values.tolist()
+
+        return {
+            'case_title': caseTitle,
+            'type': caseType,
+            'total_amount': totalAmt,
+            'plaintiff': plaintiff,
+            'defendant': defendant,
+            'plaintiff_attorney': plaintiffAttorney,
+            'defendant_attorney': defendantAttorney,
+            'action_history': actionHistory,
+            'actions': actions,
+        }
 
     def collect(self, series, sep=','):
         """collect.  Converts series to string with entries comma-separated
@@ -222,25 +491,29 @@ class DenverCaseScraper:
 
         return headers
 
-    def getTable(self, cl):
+    def getTable(self, soup, cl):
         """getTable.
 
         Parameters
         ----------
+        soup : bs4.BeautifulSoup
+            parsed case page
         cl : str
             class for the table tag.  This will find the first instance.
         """
-        return self.soup.findChild(name='table', attrs={'class': cl})
+        return soup.findChild(name='table', attrs={'class': cl})
 
-    def getTables(self, cl):
+    def getTables(self, soup, cl):
         """getTables.  Get list of tables of the given class
 
         Parameters
         ----------
+        soup : bs4.BeautifulSoup
+            parsed case page
         cl : str
             class for the table tag.  This will find the first instance.
         """
-        return self.soup.findChildren(name='table', attrs={'class': cl})
+        return soup.findChildren(name='table', attrs={'class': cl})
 
     def findValInTable(self, tableOb, val):
         """findValInTable.  Find value of cell labeled by value of val, i.e.,
@@ -289,3 +562,18 @@ class DenverCaseScraper:
                 hits.append(nextCell.text)
 
         return hits
+
+
+def recordActions(record):
+    """recordActions.  Actions of an extracted record.  Records stored before
+    actions were extracted fall back to splitting action_history.
+
+    Parameters
+    ----------
+    record : dict
+        extracted case facts
+    """
+    if 'actions' in record:
+        return record['actions']
+
+    return splitActionHistory(record['action_history'])
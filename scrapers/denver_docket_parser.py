@@ -0,0 +1,41 @@
+from io import BytesIO
+from lxml import etree
+
+
+def parseDocketPage(content):
+    """parseDocketPage.  Stream the rows of a denvercountycourt.org docket page
+    once and return the case number of every case row, in page order.
+
+    Header rows (those with th cells) and rows without a case_no cell are
+    skipped in place.  Text is kept exactly as it appears on the page, so a
+    vacated court date still shows up as a blank case number.
+
+    Parameters
+    ----------
+    content : bytes
+        raw html of the docket page
+    """
+
+    caseNumbers = []
+    rows = etree.iterparse(BytesIO(content), events=('end',), tag='tr',
+                           html=True, recover=True)
+    for _, row in rows:
+        caseNo = None
+        isHeader = False
+        for el in row.iterdescendants():
+            if not isinstance(el.tag, str):
+                continue
+            if el.tag == 'th':
+                isHeader = True
+                break
+            if caseNo is None and 'case_no' in el.get('class', '').split():
+                caseNo = el
+
+        if not isHeader and caseNo is not None and caseNo.tag == 'td':
+            caseNumbers.append(caseNo.xpath('string()'))
+
+        # Rows are not needed once read, so keep memory flat on big calendars.
+        row.clear()
+
+    return caseNumbers
+
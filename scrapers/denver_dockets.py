@@ -1,6 +1,7 @@
-from bs4 import BeautifulSoup
+from scrapers.denver_docket_parser import parseDocketPage
+from scrapers.denver_session import DenverSession
+from scrapers.fetch_policy import FetchPolicy
 import pandas as pd
-import requests
 
 
 class DenverDocketScraper:
@@ -15,7 +16,8 @@ class DenverDocketScraper:
         'room',
     ]
 
-    def __init__(self, date=None, sessId=None, room=None, urlToken=None):
+    def __init__(self, date=None, sessId=None, room=None, urlToken=None,
+                 session=None, fetchPolicy=None):
         """__init__.  Construct a DenverDocketScraper instance.
 
         Parameters
@@ -28,70 +30,45 @@ class DenverDocketScraper:
             room to query
         urlToken : str
             token
+        session : scrapers.denver_session.DenverSession
+            pooled session to request through.  Share one between scrapers to
+            reuse connections.  A new session is opened by default.
+        fetchPolicy : scrapers.fetch_policy.FetchPolicy
+            rate limit and retry policy for the docket request.  Share the
+            case scraper's to hold one ceiling for the court site.  No ceiling
+            by default.
         """
         self.date = date
         self.sessId = sessId
         self.room = room
         self.urlToken = urlToken
+        self.session = session
+        self.fetchPolicy = fetchPolicy or FetchPolicy()
 
-    def parse(self, trOb, classname):
-        """parse.  Finds element of row with given class and returns text.
+    def toDf(self, caseNumbers):
+        """toDf.  Build the docket dataframe from parsed case numbers.
 
         Parameters
         ----------
-        trOb : bs4.element.Tag
-            An element of tr tag representing a row of the docket
-        classname : str
-            class name to look for in children
+        caseNumbers : list[str]
+            case numbers from scrapers.denver_docket_parser.parseDocketPage
         """
-        try:
-            obText = trOb.findChild(attrs={'class': classname}).getText()
-        except:
-            obText = None
-        return obText
+        return pd.DataFrame({
+            'case_number': caseNumbers,
+            'date': self.date,
+            'room': self.room,
+        }, columns=DenverDocketScraper.outputColumns)
 
-    def postProcess(self, df):
-        """postProcess.  Rename and drop columns from the raw scraped data.
-
-        Parameters
-        ----------
-        df : pandas.DataFrame
-            raw scraped output from the docket page.
-        """
-        # Fix columns for compatibility with CaseScraper
-        df['case_number'] = df['case_no']
-
-        # Columns which are redundant or totally blank.
-        dropCols = [
-            'case_no',
-            'defendant',
-            'center',
-            'disposition',
-            'courtroom',
-            'date',
-        ]
-
-        cleanedDf = (df
-                     # Remove first row because the corresponding tr cell is
-                     # empty.  FIXME: That should be handled in situ.
-                     .iloc[1:]
-                     .drop(dropCols, axis=1)
-                     .dropna(subset=['case_number'])
-                     .reset_index(drop=True))
-        cleanedDf['date'] = self.date
-        cleanedDf['room'] = self.room
-
-        return cleanedDf
-
-    def scrape(self):
-        """scrape.  Scrape all cases from the docket.  """
+    def fetch(self):
+        """fetch.  Request the raw html of the docket.  Raises
+        scrapers.fetch_policy.FetchFailure if the docket could not be fetched,
+        rather than returning an error page that parses as no cases.  """
 
         # Check to make sure all variables have been set
         requiredParams = [self.urlToken, self.sessId, self.date, self.room]
         if any([x is None for x in requiredParams]):
             raise Exception('Error: Need to set all docket parameters first.')
 
-        # Get the html and parse
         url = (
             'https://www.denvercountycourt.org/courtroom-calendar/' +
             '?searchtype=searchdocket' +
@@ -100,31 +77,16 @@ class DenverDocketScraper:
             '&token=' + self.urlToken
         )
 
-        response = requests.get(url, cookies={'PHPSESSID': self.sessId})
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Get all tr opbjects
-        trObs = soup.find_all(name='tr')
-
-        # Get all td objects with a given class and parse text.
-        # When this is blank, the court date has probably been vacated,
-        # however they show up in the docket anyway.
-        keys = [
-            'case_no',
-            'center',
-            'courtroom',
-            'disposition',
+        if self.session is None:
+            self.session = DenverSession(self.sessId)
 
-            # Point of confusion.  This is called defendant, but could be
-            # either party.
-            'defendant',
+        return self.fetchPolicy.fetch(self.session, url).content
 
-            'date'
-        ]
+    def scrape(self):
+        """scrape.  Scrape all cases from the docket.  """
 
-        textDict = {
-            key: list(map(lambda x: self.parse(x, key), trObs)) for key in keys
-        }
+        # Every row with a case_no cell is a case.  When the cell is blank, the
+        # court date has probably been vacated, however they show up in the
+        # docket anyway.
+        return self.toDf(parseDocketPage(self.fetch()))
 
-        docketDf = pd.DataFrame(textDict)
-        return self.postProcess(docketDf)
@@ -0,0 +1,301 @@
+from analyze.action_history import saveEvents
+from analyze.derived_columns import DERIVED_COLUMNS
+from analyze.timeline_metrics import addTimelineColumns
+from concurrent.futures import Future, ProcessPoolExecutor
+from queue import Queue
+from scrapers.case_records import CaseRecords
+from scrapers.denver_case_scraper import DenverCaseScraper
+from scrapers.denver_docket_parser import parseDocketPage
+from scrapers.fetch_policy import FetchFailure
+from scrapers.response_cache import CacheMiss
+from threading import Event, Thread
+
+# Marks the end of a stage's output.
+STOP = object()
+
+
+class DenverPipeline:
+    """DenverPipeline.  Runs a Denver scrape as a pipeline of stages joined by
+    bounded queues, so dockets for later dates are fetched while cases for
+    earlier ones are still being scraped.
+
+    Stages, each on its own thread:
+        dockets -> cases -> derived columns -> csv backup and accumulate
+
+    A full queue blocks the stage feeding it, so no stage runs more than
+    queueSize dockets ahead of the next.  Dockets parsed on a process pool are
+    passed on as futures, so the docket stage fetches the next docket while
+    earlier ones are parsed.
+    """
+
+    def __init__(self, docketScrapers, caseScraper, outputName=None,
+                 queueSize=4, docketProcesses=None, journal=None):
+        """__init__.  Construct a DenverPipeline instance.
+
+        Parameters
+        ----------
+        docketScrapers : list[scrapers.denver_dockets.DenverDocketScraper]
+            dockets to scrape, in order.
+        caseScraper : scrapers.denver_case_scraper.DenverCaseScraper
+            scraper used for the cases of every docket.
+        outputName : str
+            prefix for per-docket csv backups.  No backups are written if None.
+        queueSize : int
+            maximum number of dockets waiting between any two stages.
+        docketProcesses : int
+            size of the process pool used to parse dockets.  Parsed on the
+            docket thread by default.
+        journal : scrapers.run_journal.RunJournal
+            progress journal.  Finished dockets are not fetched again, and each
+            docket is marked finished once its csv backup is written.  Give the
+            same journal to caseScraper so finished cases are reloaded from it.
+        """
+        self.docketScrapers = docketScrapers
+        self.caseScraper = caseScraper
+        self.outputName = outputName
+        self.queueSize = queueSize
+        self.docketProcesses = docketProcesses
+        self.journal = journal
+
+        self.failed = Event()
+        self.errors = []
+        # Dockets that could not be fetched, as (docket scraper, failure).
+        # They are left out of the journal so a resumed run fetches them.
+        self.failedDockets = []
+        self.allCases = CaseRecords(
+            DenverCaseScraper.outputColumns + DERIVED_COLUMNS)
+
+    def run(self):
+        """run.  Run every stage to completion, retry failed cases once more,
+        and return all scraped cases as one dataframe, with the timeline
+        metrics of each case read off its action events.  The action events
+        are saved to parquet next to the csv backups.  Re-raises the first
+        error hit by any stage.  """
+
+        docketQueue = Queue(maxsize=self.queueSize)
+        caseQueue = Queue(maxsize=self.queueSize)
+        derivedQueue = Queue(maxsize=self.queueSize)
+
+        executor = None
+        if self.docketProcesses and self.docketProcesses > 1:
+            executor = ProcessPoolExecutor(max_workers=self.docketProcesses)
+
+        threads = [
+            Thread(target=self.runSource,
+                   args=(lambda docketScraper:
+                         self.fetchDocket(docketScraper, executor),
+                         self.docketScrapers, docketQueue)),
+            Thread(target=self.runStage,
+                   args=(self.scrapeCases, docketQueue, caseQueue)),
+            Thread(target=self.runStage,
+                   args=(self.deriveColumns, caseQueue, derivedQueue)),
+            Thread(target=self.runStage,
+                   args=(self.saveCases, derivedQueue, None)),
+        ]
+
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if self.errors:
+            raise self.errors[0]
+
+        if len(self.failedDockets) > 0:
+            print('Gave up on %d dockets: %s.  Resume the run to fetch them '
+                  'again.' % (len(self.failedDockets), ', '.join(
+                      '%s in room %s' % (docket.date, docket.room)
+                      for docket, _ in self.failedDockets)))
+
+        # Cases that failed along the way get one more try now that the rest
+        # of the run is done.
+        retriedDf = self.caseScraper.retryFailed()
+        if retriedDf.shape[0] > 0:
+            retriedDf = self.caseScraper.addDerivedColumns(retriedDf)
+            if self.outputName is not None:
+                csvName = '%s__retries.csv' % self.outputName
+                print('Saving csv backup at %s.' % csvName)
+                retriedDf.to_csv(csvName, index=False)
+            self.allCases.appendDf(retriedDf)
+
+        events = self.caseScraper.eventsDf()
+        if self.outputName is not None:
+            eventsName = '%s__events.parquet' % self.outputName
+            print('Saving action events at %s.' % eventsName)
+            saveEvents(events, eventsName)
+
+        return addTimelineColumns(self.allCases.toDf(), events)
+
+    def runSource(self, fn, items, outQueue):
+        """runSource.  Feed fn(item) for each item into outQueue, stopping early
+        if any stage has failed.
+
+        Parameters
+        ----------
+        fn : callable
+            work for one item.  Results of None are not passed on.
+        items : iterable
+            work to do, in order
+        outQueue : queue.Queue
+            queue feeding the next stage
+        """
+        try:
+            for item in items:
+                if self.failed.is_set():
+                    break
+                result = fn(item)
+                if result is not None:
+                    outQueue.put(result)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            outQueue.put(STOP)
+
+    def runStage(self, fn, inQueue, outQueue):
+        """runStage.  Apply fn to everything from inQueue and pass results on to
+        outQueue.  After a failure anywhere, keeps draining inQueue without
+        doing work so upstream stages never block on a full queue.
+
+        Parameters
+        ----------
+        fn : callable
+            work for one item.  Results of None are not passed on.
+        inQueue : queue.Queue
+            queue fed by the previous stage
+        outQueue : queue.Queue
+            queue feeding the next stage, or None for the last stage
+        """
+        while True:
+            item = inQueue.get()
+            if item is STOP:
+                break
+            if self.failed.is_set():
+                continue
+
+            try:
+                result = fn(item)
+            except Exception as e:
+                self.fail(e)
+                continue
+
+            if outQueue is not None and result is not None:
+                outQueue.put(result)
+
+        if outQueue is not None:
+            outQueue.put(STOP)
+
+    def fail(self, error):
+        self.errors.append(error)
+        self.failed.set()
+
+    def fetchDocket(self, docketScraper, executor):
+        """fetchDocket.  Docket stage.  Fetch one docket and parse it, or
+        submit it for parsing.  Returns the docket scraper with its case
+        numbers, or a future of them.
+
+        Parameters
+        ----------
+        docketScraper : scrapers.denver_dockets.DenverDocketScraper
+            docket to scrape
+        executor : concurrent.futures.ProcessPoolExecutor
+            pool to parse on, or None to parse on this thread
+        """
+        if self.journal is not None:
+            caseNumbers = self.journal.finishedDocket(docketScraper.date,
+                                                      docketScraper.room)
+            if caseNumbers is not None:
+                print('Docket on %s in room %s already finished.  Reloading.'
+                      % (docketScraper.date, docketScraper.room))
+                return docketScraper, caseNumbers
+
+        print('Grabbing docket on %s in room %s.'
+              % (docketScraper.date, docketScraper.room))
+        try:
+            page = docketScraper.fetch()
+        except CacheMiss:
+            print('Docket not cached.  Skipping.')
+            return None
+        except FetchFailure as failure:
+            print('Fetching docket on %s in room %s failed (%s: %s).  '
+                  'Skipping.' % (docketScraper.date, docketScraper.room,
+                                 failure.kind, failure))
+            self.failedDockets.append((docketScraper, failure))
+            return None
+
+        if executor is None:
+            return docketScraper, parseDocketPage(page)
+
+        return docketScraper, executor.submit(parseDocketPage, page)
+
+    def scrapeCases(self, item):
+        """scrapeCases.  Case stage.  Scrape every case on one docket.
+
+        Parameters
+        ----------
+        item : tuple
+            docket scraper and its case numbers, or a future of them
+        """
+        docketScraper, caseNumbers = item
+        if isinstance(caseNumbers, Future):
+            caseNumbers = caseNumbers.result()
+        docketDf = docketScraper.toDf(caseNumbers)
+        if docketDf.shape[0] == 0:
+            print('No cases on %s in room %s.'
+                  % (docketScraper.date, docketScraper.room))
+            self.markDone(docketScraper, docketDf)
+            return None
+
+        print('Grabbing cases on %s in room %s.'
+              % (docketScraper.date, docketScraper.room))
+        return (docketScraper, docketDf,
+                self.caseScraper.scrapeRaw(docketDf))
+
+    def deriveColumns(self, item):
+        """deriveColumns.  Derived column stage.
+
+        Parameters
+        ----------
+        item : tuple
+            docket scraper, its docket dataframe and its raw scraped cases
+        """
+        docketScraper, docketDf, casesDf = item
+        return (docketScraper, docketDf,
+                self.caseScraper.addDerivedColumns(casesDf))
+
+    def saveCases(self, item):
+        """saveCases.  Sink stage.  Write a csv backup of one docket's cases and
+        add them to the run's output.
+
+        Parameters
+        ----------
+        item : tuple
+            docket scraper, its docket dataframe and its finished cases
+        """
+        docketScraper, docketDf, casesDf = item
+        if self.outputName is not None:
+            csvName = '%s__%s__%s.csv' % (
+                self.outputName, docketScraper.date, docketScraper.room)
+            print('Saving csv backup at %s.' % csvName)
+            casesDf.to_csv(csvName, index=False)
+
+        self.allCases.appendDf(casesDf)
+        self.markDone(docketScraper, docketDf)
+
+    def markDone(self, docketScraper, docketDf):
+        """markDone.  Record a finished docket in the journal, if any.
+
+        Parameters
+        ----------
+        docketScraper : scrapers.denver_dockets.DenverDocketScraper
+            finished docket
+        docketDf : pandas.DataFrame
+            its docket dataframe
+        """
+        if self.journal is not None:
+            self.journal.markDocketDone(docketScraper.date,
+                                        docketScraper.room,
+                                        docketDf['case_number'].tolist())
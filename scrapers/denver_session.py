@@ -0,0 +1,52 @@
+from requests.adapters import HTTPAdapter
+import requests
+
+
+class DenverSession:
+    """DenverSession.  A pooled keep-alive HTTP session for
+    denvercountycourt.org.
+
+    Construct once per run and hand the same instance to every
+    DenverDocketScraper and DenverCaseScraper so they reuse open connections
+    instead of paying a new TCP and TLS handshake per request.
+    """
+
+    def __init__(self, sessId, poolSize=10, timeout=60):
+        """__init__.  Construct a DenverSession instance.
+
+        Parameters
+        ----------
+        sessId : str
+            PHPSESSID cookie for requesting as part of the active session.
+        poolSize : int
+            number of connections kept open to the court site.  Should be at
+            least the number of case requests in flight at once.
+        timeout : float
+            seconds to wait on the court site before giving up on a request.
+        """
+        self.sessId = sessId
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self.session.cookies.set('PHPSESSID', sessId)
+
+    def get(self, url):
+        """get.  Request url over the pooled session.
+
+        Parameters
+        ----------
+        url : str
+            url to request
+        """
+        return self.session.get(url, timeout=self.timeout)
+
+    def close(self):
+        """close.  Close all pooled connections.  """
+        self.session.close()
@@ -0,0 +1,169 @@
+from scrapers.rate_limiter import RateLimiter
+import random
+import requests
+import time
+
+
+class FetchFailure(Exception):
+    """FetchFailure.  A case (or page) that could not be scraped.
+
+    kind names the class of failure for reporting, and transient failures are
+    worth retrying.
+    """
+
+    kind = 'failure'
+    transient = False
+
+
+class TimeoutFailure(FetchFailure):
+    kind = 'timeout'
+    transient = True
+
+
+class ConnectionFailure(FetchFailure):
+    kind = 'connection'
+    transient = True
+
+
+class ResponseFailure(FetchFailure):
+    """ResponseFailure.  A response cut short or garbled in transit.  """
+    kind = 'response'
+    transient = True
+
+
+class ServerFailure(FetchFailure):
+    """ServerFailure.  5xx, or 429 when the site asks us to slow down.  """
+    kind = 'server'
+    transient = True
+
+    def __init__(self, message, retryAfter=None):
+        super().__init__(message)
+        self.retryAfter = retryAfter
+
+
+class ClientFailure(FetchFailure):
+    kind = 'client'
+
+
+class ParseFailure(FetchFailure):
+    kind = 'parse'
+
+
+class RequestFailure(FetchFailure):
+    """RequestFailure.  Any other error requests raises, such as too many
+    redirects.  """
+    kind = 'request'
+
+
+class FetchPolicy:
+    """FetchPolicy.  Requests pages under a rate limiter, retrying transient
+    failures with jittered exponential backoff and classifying the rest.
+
+    Pages a scrapers.response_cache.CachedSession can serve from its cache
+    are returned without waiting on, or reporting to, the limiter, since the
+    site never sees them.
+    """
+
+    def __init__(self, rateLimiter=None, maxRetries=3, backoffBase=1.0,
+                 backoffCap=30.0):
+        """__init__.  Construct a FetchPolicy instance.
+
+        Parameters
+        ----------
+        rateLimiter : scrapers.rate_limiter.RateLimiter
+            limiter to wait on before each request and report outcomes to.
+            No ceiling by default.
+        maxRetries : int
+            retries after the first attempt for transient failures.
+        backoffBase : float
+            seconds of backoff before the first retry, doubling after that.
+        backoffCap : float
+            most seconds to back off before any one retry.
+        """
+        self.rateLimiter = rateLimiter or RateLimiter()
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffCap = backoffCap
+
+    def fetch(self, session, url):
+        """fetch.  Request url through session.  Returns the response, or
+        raises a FetchFailure once retries are used up or the failure is not
+        transient.
+
+        Parameters
+        ----------
+        session : scrapers.denver_session.DenverSession
+            session (or cached session) to request through
+        url : str
+            url to request
+        """
+        if hasattr(session, 'cached'):
+            response = session.cached(url)
+            if response is not None:
+                return response
+
+        for attempt in range(self.maxRetries + 1):
+            self.rateLimiter.wait(url)
+            start = time.monotonic()
+            try:
+                response = session.get(url)
+                failure = self.classify(response)
+            except requests.Timeout as e:
+                failure = TimeoutFailure(str(e))
+            except requests.ConnectionError as e:
+                failure = ConnectionFailure(str(e))
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError) as e:
+                failure = ResponseFailure(str(e))
+            except requests.RequestException as e:
+                failure = RequestFailure('%s: %s' % (type(e).__name__, e))
+            elapsed = time.monotonic() - start
+
+            self.rateLimiter.record(url, elapsed,
+                                    ok=failure is None or not failure.transient)
+            if failure is None:
+                return response
+            if not failure.transient or attempt == self.maxRetries:
+                raise failure
+
+            print('%s fetching %s.  Retrying.' % (failure.kind, url))
+            time.sleep(self.backoff(attempt, failure))
+
+    def classify(self, response):
+        """classify.  Return the FetchFailure a response amounts to, or None if
+        it is fine.
+
+        Parameters
+        ----------
+        response : requests.Response
+            response to check
+        """
+        status = response.status_code
+        if status == 429 or status >= 500:
+            retryAfter = response.headers.get('Retry-After')
+            try:
+                retryAfter = float(retryAfter)
+            except (TypeError, ValueError):
+                retryAfter = None
+            return ServerFailure('HTTP %d' % status, retryAfter=retryAfter)
+        if not 200 <= status < 300:
+            return ClientFailure('HTTP %d' % status)
+
+        return None
+
+    def backoff(self, attempt, failure):
+        """backoff.  Seconds to wait before retrying, with full jitter.
+
+        Parameters
+        ----------
+        attempt : int
+            zero-based attempt that just failed
+        failure : FetchFailure
+            how it failed
+        """
+        retryAfter = getattr(failure, 'retryAfter', None)
+        if retryAfter is not None:
+            return min(self.backoffCap, retryAfter)
+
+        return random.uniform(
+            0, min(self.backoffCap, self.backoffBase * 2 ** attempt))
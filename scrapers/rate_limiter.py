@@ -0,0 +1,158 @@
+from threading import Lock
+from urllib.parse import urlparse
+import time
+
+
+class RateLimiter:
+    """RateLimiter.  A thread-safe ceiling on the number of requests per second
+    sent to each host.
+
+    Share one instance between scrapers so the ceiling holds across the whole
+    run rather than per scraper.
+    """
+
+    def __init__(self, maxPerSecond=None):
+        """__init__.  Construct a RateLimiter instance.
+
+        Parameters
+        ----------
+        maxPerSecond : float
+            maximum number of requests per second to any one host.  None means
+            no ceiling.
+        """
+        self.maxPerSecond = maxPerSecond
+        self.lock = Lock()
+        self.nextSlot = {}
+
+    def wait(self, url):
+        """wait.  Block until a request to the host of url is allowed.
+
+        Parameters
+        ----------
+        url : str
+            url about to be requested.
+        """
+        if not self.maxPerSecond:
+            return
+
+        host = urlparse(url).netloc
+        interval = 1.0 / self.maxPerSecond
+
+        # Reserve the next free slot for this host, then sleep outside the
+        # lock so other hosts (and other slots) are not held up.
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot.get(host, now))
+            self.nextSlot[host] = slot + interval
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, url, seconds, ok):
+        """record.  Report how a request went.  The fixed ceiling ignores it.
+
+        Parameters
+        ----------
+        url : str
+            url that was requested
+        seconds : float
+            time the request took
+        ok : bool
+            False if the request failed in a way that suggests backing off.
+        """
+        pass
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """AdaptiveRateLimiter.  A thread-safe token bucket per host whose rate
+    adapts to how the host is coping.
+
+    The rate starts at maxPerSecond.  It is halved on every failure and cut
+    back when requests get slow, then grows back by a fixed step with each
+    fast success, never leaving [minPerSecond, maxPerSecond].
+    """
+
+    def __init__(self, maxPerSecond, minPerSecond=0.2, burst=1,
+                 slowSeconds=5.0):
+        """__init__.  Construct an AdaptiveRateLimiter instance.
+
+        Parameters
+        ----------
+        maxPerSecond : float
+            highest rate to any one host.
+        minPerSecond : float
+            lowest rate to back off to.
+        burst : int
+            requests that may go out back to back after an idle spell.
+        slowSeconds : float
+            requests slower than this count as a sign of strain.
+        """
+        super().__init__(maxPerSecond)
+        self.minPerSecond = minPerSecond
+        self.burst = burst
+        self.slowSeconds = slowSeconds
+        self.step = maxPerSecond / 20.0
+        self.rates = {}
+        self.buckets = {}
+
+    def rate(self, url):
+        """rate.  Current rate to the host of url.
+
+        Parameters
+        ----------
+        url : str
+            any url on the host
+        """
+        return self.rates.get(urlparse(url).netloc, self.maxPerSecond)
+
+    def wait(self, url):
+        """wait.  Block until the host's bucket has a token, then take it.
+
+        Parameters
+        ----------
+        url : str
+            url about to be requested.
+        """
+        host = urlparse(url).netloc
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                rate = self.rates.setdefault(host, self.maxPerSecond)
+                tokens, updated = self.buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * rate)
+
+                if tokens >= 1:
+                    self.buckets[host] = (tokens - 1, now)
+                    return
+
+                self.buckets[host] = (tokens, now)
+                delay = (1 - tokens) / rate
+
+            time.sleep(delay)
+
+    def record(self, url, seconds, ok):
+        """record.  Adapt the host's rate to how a request went.
+
+        Parameters
+        ----------
+        url : str
+            url that was requested
+        seconds : float
+            time the request took
+        ok : bool
+            False if the request failed in a way that suggests backing off.
+        """
+        host = urlparse(url).netloc
+
+        with self.lock:
+            rate = self.rates.get(host, self.maxPerSecond)
+            if not ok:
+                rate = rate / 2
+            elif seconds > self.slowSeconds:
+                rate = rate * 0.8
+            else:
+                rate = rate + self.step
+            self.rates[host] = min(self.maxPerSecond,
+                                   max(self.minPerSecond, rate))
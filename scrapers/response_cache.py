@@ -0,0 +1,314 @@
+from scrapers.fetch_policy import FetchFailure
+from threading import Lock
+from urllib.parse import parse_qs, urlencode, urlparse
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class CacheMiss(FetchFailure):
+    """CacheMiss.  Raised in replay mode when a page was never cached.  """
+    kind = 'cache miss'
+
+
+class CachedResponse:
+    """CachedResponse.  Minimal stand-in for requests.Response served from the
+    cache.  """
+
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+
+class ResponseCache:
+    """ResponseCache.  Content-addressed on-disk cache of court pages.
+
+    Pages are keyed on the normalized docket (date, room) or case (casenumber,
+    date, room) URL with the volatile session token left out, so a cached page
+    stays valid across sessions.  Bodies are stored once per content hash under
+    objects/ and an sqlite index maps keys to hashes.  The least recently used
+    entries are evicted once the bodies outgrow maxBytes.
+    """
+
+    # URL parameters that identify each kind of page.  Everything else (token,
+    # searchtype) is left out of the key.
+    RESOURCE_PARAMS = {
+        'docket': ['date', 'room'],
+        'case': ['casenumber', 'date', 'room'],
+    }
+
+    # Seconds a cached page is served before it is fetched again.
+    DEFAULT_TTLS = {
+        'docket': 24 * 60 * 60,
+        'case': 12 * 60 * 60,
+    }
+
+    def __init__(self, cacheDir='out/http_cache', ttls=None,
+                 maxBytes=2 * 1024 ** 3):
+        """__init__.  Construct a ResponseCache instance.
+
+        Parameters
+        ----------
+        cacheDir : str
+            directory for the index and page bodies.  Created if missing.
+        ttls : dict
+            seconds each resource ('docket', 'case') stays fresh.  Merged over
+            DEFAULT_TTLS.
+        maxBytes : int
+            size ceiling for stored page bodies.
+        """
+        self.cacheDir = cacheDir
+        self.ttls = dict(ResponseCache.DEFAULT_TTLS, **(ttls or {}))
+        self.maxBytes = maxBytes
+        self.lock = Lock()
+
+        os.makedirs(os.path.join(cacheDir, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cacheDir, 'index.sqlite'),
+                                    check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, resource TEXT, digest TEXT, size INTEGER, '
+            'fetched_at REAL, accessed_at REAL)')
+        self.conn.commit()
+
+    def normalize(self, url):
+        """normalize.  Return (resource, key) for a docket or case url.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        """
+        params = {k: v[0] for k, v in parse_qs(urlparse(url).query).items()}
+        resource = 'case' if 'casenumber' in params else 'docket'
+        keyParams = [(name, params.get(name, ''))
+                     for name in ResponseCache.RESOURCE_PARAMS[resource]]
+
+        return resource, resource + '?' + urlencode(keyParams)
+
+    def get(self, url, ignoreTtl=False):
+        """get.  Return the cached body for url, or None if missing or stale.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        ignoreTtl : bool
+            serve stale pages too.  Used for replay.
+        """
+        resource, key = self.normalize(url)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT digest, fetched_at FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+
+            digest, fetchedAt = row
+            if not ignoreTtl and now - fetchedAt > self.ttls[resource]:
+                return None
+
+            try:
+                with open(self.objectPath(digest), 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.conn.commit()
+                return None
+
+            self.conn.execute(
+                'UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+
+        return content
+
+    def put(self, url, content):
+        """put.  Store a page body for url.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        content : bytes
+            page body
+        """
+        resource, key = self.normalize(url)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.objectPath(digest)
+        now = time.time()
+
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmpPath = path + '.tmp'
+                with open(tmpPath, 'wb') as f:
+                    f.write(content)
+                os.replace(tmpPath, path)
+
+            self.addEntry(resource, key, digest, len(content), now)
+
+    def link(self, url, digest):
+        """link.  Point url at a body already stored under another url, as if
+        it had been fetched now.  Returns False if no such body is stored.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        digest : str
+            sha256 hex digest of the body
+        """
+        resource, key = self.normalize(url)
+        path = self.objectPath(digest)
+
+        with self.lock:
+            if not os.path.exists(path):
+                return False
+
+            self.addEntry(resource, key, digest, os.path.getsize(path),
+                          time.time())
+
+        return True
+
+    def addEntry(self, resource, key, digest, size, now):
+        """addEntry.  Map key to a stored body, dropping the body it pointed to
+        if nothing else uses it.  Caller must hold the lock.  """
+
+        oldDigest = self.conn.execute(
+            'SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+            (key, resource, digest, size, now, now))
+        if oldDigest is not None and oldDigest[0] != digest:
+            self.removeIfUnreferenced(oldDigest[0])
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """evict.  Drop least recently used entries until stored bodies fit in
+        maxBytes.  Caller must hold the lock.  """
+
+        total = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM '
+            '(SELECT DISTINCT digest, size FROM entries)').fetchone()[0]
+        if total <= self.maxBytes:
+            return
+
+        rows = self.conn.execute(
+            'SELECT key, digest, size FROM entries ORDER BY accessed_at'
+        ).fetchall()
+        for key, digest, size in rows:
+            if total <= self.maxBytes:
+                break
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            if self.removeIfUnreferenced(digest):
+                total -= size
+
+    def removeIfUnreferenced(self, digest):
+        """removeIfUnreferenced.  Delete a body no entry points to anymore.
+        Returns True if the body was deleted.  Caller must hold the lock.
+
+        Parameters
+        ----------
+        digest : str
+            content hash of the body
+        """
+        stillUsed = self.conn.execute(
+            'SELECT 1 FROM entries WHERE digest = ? LIMIT 1',
+            (digest,)).fetchone()
+        if stillUsed is not None:
+            return False
+
+        try:
+            os.remove(self.objectPath(digest))
+        except FileNotFoundError:
+            pass
+
+        return True
+
+    def objectPath(self, digest):
+        return os.path.join(self.cacheDir, 'objects', digest[:2], digest)
+
+
+class CachedSession:
+    """CachedSession.  Serves court pages from a ResponseCache, falling back to
+    a DenverSession on a miss.
+
+    Drop-in for DenverSession, so either scraper can sit on top of it.  In
+    replay mode the network is never touched and a miss raises CacheMiss.
+    """
+
+    def __init__(self, session, cache, replay=False):
+        """__init__.  Construct a CachedSession instance.
+
+        Parameters
+        ----------
+        session : scrapers.denver_session.DenverSession
+            session used on a cache miss.  May be None in replay mode.
+        cache : ResponseCache
+            cache to read from and write to
+        replay : bool
+            serve cached pages only, regardless of age.
+        """
+        self.session = session
+        self.cache = cache
+        self.replay = replay
+
+    def get(self, url):
+        """get.  Return the cached page for url, fetching it on a miss.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        """
+        response = self.cached(url)
+        if response is not None:
+            return response
+
+        response = self.session.get(url)
+        # Only cache good pages so a transient error is retried next run.
+        if response.status_code == 200:
+            self.cache.put(url, response.content)
+
+        return response
+
+    def cached(self, url):
+        """cached.  Return the cached page for url without fetching, or None if
+        it would be fetched.  Raises CacheMiss on a miss in replay mode.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        """
+        content = self.cache.get(url, ignoreTtl=self.replay)
+        if content is not None:
+            return CachedResponse(content)
+
+        if self.replay:
+            raise CacheMiss('No cached page for %s.' % url)
+
+        return None
+
+    def link(self, url, digest):
+        """link.  Cache url as the page with the given sha256 digest, for pages
+        known not to have changed without fetching them.  Returns False if that
+        page is not cached.
+
+        Parameters
+        ----------
+        url : str
+            docket or case url
+        digest : str
+            sha256 hex digest of the page
+        """
+        return self.cache.link(url, digest)
+
+    def close(self):
+        """close.  Close the underlying session.  """
+        if self.session is not None:
+            self.session.close()
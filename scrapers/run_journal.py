@@ -0,0 +1,151 @@
+from threading import Lock
+import json
+import os
+import sqlite3
+import time
+
+
+class RunJournal:
+    """RunJournal.  Progress journal for a scrape run, kept in sqlite.
+
+    Records every case scraped and every docket finished, so a run that
+    crashes or loses its session can be resumed without scraping finished work
+    again.
+    """
+
+    def __init__(self, path):
+        """__init__.  Open (or create) a RunJournal.
+
+        Parameters
+        ----------
+        path : str
+            sqlite file for the journal.  Parent directories are created.
+        """
+        self.path = path
+        self.lock = Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS dockets ('
+            'date TEXT, room TEXT, case_numbers TEXT, completed_at REAL, '
+            'PRIMARY KEY (date, room))')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS cases ('
+            'case_number TEXT, date TEXT, room TEXT, row TEXT, '
+            'PRIMARY KEY (case_number, date, room))')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS case_actions ('
+            'case_number TEXT, date TEXT, room TEXT, actions TEXT, '
+            'PRIMARY KEY (case_number, date, room))')
+        self.conn.commit()
+
+    def reset(self):
+        """reset.  Forget all progress.  Used when starting a run over.  """
+        with self.lock:
+            self.conn.execute('DELETE FROM dockets')
+            self.conn.execute('DELETE FROM cases')
+            self.conn.execute('DELETE FROM case_actions')
+            self.conn.commit()
+
+    def recordCase(self, row, actions=None):
+        """recordCase.  Record one successfully scraped case.
+
+        Parameters
+        ----------
+        row : list
+            row as returned by DenverCaseScraper.scrapeSingleCase, starting
+            with case number, date and room.
+        actions : list
+            the case's actions, as returned by
+            DenverCaseScraper.scrapeSingleCase.
+        """
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?)',
+                (row[0], row[1], row[2], json.dumps(row)))
+            if actions is not None:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO case_actions VALUES (?, ?, ?, ?)',
+                    (row[0], row[1], row[2], json.dumps(actions)))
+            self.conn.commit()
+
+    def scrapedCase(self, caseNum, date, room):
+        """scrapedCase.  Return the recorded row for a case, or None.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number
+        date : str
+            date of the docket the case was found on
+        room : str
+            room of the docket the case was found on
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT row FROM cases '
+                'WHERE case_number = ? AND date = ? AND room = ?',
+                (caseNum, date, room)).fetchone()
+
+        return None if found is None else json.loads(found[0])
+
+    def scrapedActions(self, caseNum, date, room):
+        """scrapedActions.  Return the recorded actions for a case, or None.
+
+        Parameters
+        ----------
+        caseNum : str
+            case number
+        date : str
+            date of the docket the case was found on
+        room : str
+            room of the docket the case was found on
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT actions FROM case_actions '
+                'WHERE case_number = ? AND date = ? AND room = ?',
+                (caseNum, date, room)).fetchone()
+
+        return None if found is None else json.loads(found[0])
+
+    def markDocketDone(self, date, room, caseNumbers):
+        """markDocketDone.  Record that every stage has finished a docket.
+
+        Parameters
+        ----------
+        date : str
+            date of the docket
+        room : str
+            room of the docket
+        caseNumbers : list[str]
+            case numbers listed on the docket
+        """
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO dockets VALUES (?, ?, ?, ?)',
+                (date, room, json.dumps(list(caseNumbers)), time.time()))
+            self.conn.commit()
+
+    def finishedDocket(self, date, room):
+        """finishedDocket.  Return the case numbers of a finished docket, or
+        None if the docket has not been finished.
+
+        Parameters
+        ----------
+        date : str
+            date of the docket
+        room : str
+            room of the docket
+        """
+        with self.lock:
+            found = self.conn.execute(
+                'SELECT case_numbers FROM dockets WHERE date = ? AND room = ?',
+                (date, room)).fetchone()
+
+        return None if found is None else json.loads(found[0])
@@ -0,0 +1,79 @@
+from analyze.action_history import (EVENT_COLUMNS, caseFlags, eventTable,
+                                    historyFlags)
+from scrapers.denver_case_scraper import DenverCaseScraper
+import pandas as pd
+
+
+def test_empty_event_table_is_typed():
+    records = pd.DataFrame(columns=DenverCaseScraper.eventColumns,
+                           dtype=float)
+
+    events = eventTable(records)
+
+    assert events.columns.tolist() == EVENT_COLUMNS
+    assert events.shape[0] == 0
+    assert events['timestamp'].dtype == 'datetime64[ns]'
+    assert events['case_number'].dtype == object
+
+
+def test_event_table_normalizes_actions():
+    events = eventTable(pd.DataFrame({
+        'case_number': ['20C100001', '20C100001'],
+        'date': '2020-09-01',
+        'room': '104',
+        'seq': [0, 1],
+        'act_date': ['08/20/2020', 'not a date'],
+        'description': ['Complaint Filed', 'Writ of Restitution'],
+        'status': ['Open', 'Closed'],
+    }))
+
+    assert events['action'].astype(str).tolist() == [
+        'COMPLAINTFILED', 'WRITOFRESTITUTION']
+    assert events['timestamp'].iloc[0] == pd.Timestamp('2020-08-20')
+    assert pd.isna(events['timestamp'].iloc[1])
+
+
+ACTIONS = {
+    '20C100001': [['08/20/2020', 'Complaint Filed', 'Open'],
+                  ['09/01/2020', 'Writ of Restitution', 'Open']],
+    '20C100002': [['09/01/2020', 'Writ of Restitution', 'Open'],
+                  ['09/03/2020', 'Dismissed Without Prejudice', 'Closed']],
+    '20C100003': [],
+}
+
+
+def eventsOf(caseNumbers):
+    return eventTable(pd.DataFrame(
+        [[caseNum, '2020-09-01', '104', seq] + action
+         for caseNum in caseNumbers
+         for seq, action in enumerate(ACTIONS[caseNum])],
+        columns=DenverCaseScraper.eventColumns))
+
+
+def test_case_flags_match_history_flags():
+    cases = pd.DataFrame({
+        'case_number': ['20C100003', '20C100002', '20C100001'],
+        'date': '2020-09-01',
+        'room': '104',
+    })
+    histories = [','.join('|'.join(action) for action in ACTIONS[caseNum])
+                 for caseNum in cases['case_number']]
+
+    flags = caseFlags(cases, eventsOf(sorted(ACTIONS)))
+
+    pd.testing.assert_frame_equal(flags, historyFlags(pd.Series(histories)))
+    assert flags['writ_of_restitution'].tolist() == [False, True, True]
+    assert flags['evicted_flag'].tolist() == [False, False, True]
+
+
+def test_case_flags_without_events():
+    cases = pd.DataFrame({
+        'case_number': ['20C100003'],
+        'date': '2020-09-01',
+        'room': '104',
+    })
+
+    flags = caseFlags(cases, eventsOf(['20C100003']))
+
+    assert flags.to_dict('records') == [
+        {'writ_of_restitution': False, 'evicted_flag': False}]
@@ -0,0 +1,26 @@
+from scrapers.denver_case_parser import parseCasePage
+from scrapers.denver_case_scraper import DenverCaseScraper
+import glob
+import os
+import pytest
+
+CASE_PAGES = sorted(glob.glob(os.path.join(
+    os.path.dirname(__file__), 'fixtures', 'case_pages', '*.html')))
+
+
+@pytest.fixture
+def scraper():
+    # parseWithSoup only needs the scraper's table helpers, not a session.
+    return DenverCaseScraper(None, None, session=object())
+
+
+@pytest.mark.parametrize('path', CASE_PAGES, ids=os.path.basename)
+def test_parse_case_page_matches_soup(path, scraper):
+    with open(path, 'rb') as f:
+        page = f.read()
+
+    assert parseCasePage(page) == scraper.parseWithSoup(page)
+
+
+def test_fixtures_found():
+    assert len(CASE_PAGES) >= 4
@@ -0,0 +1,105 @@
+from analyze.derived_columns import DERIVED_COLUMNS
+from scrapers.denver_case_scraper import DenverCaseScraper
+from scrapers.fetch_policy import FetchPolicy
+from scrapers.run_journal import RunJournal
+import pandas as pd
+import pytest
+import requests
+
+
+class StatusSession:
+    """StatusSession.  Answers every request with the same status and an
+    empty page.  """
+
+    def __init__(self, status):
+        self.status = status
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = b'<html><body></body></html>'
+        return response
+
+
+class RaisingSession:
+    """RaisingSession.  Raises the same error on every request.  """
+
+    def __init__(self, error):
+        self.error = error
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        raise self.error
+
+
+def docket(*caseNums):
+    return pd.DataFrame({'case_number': list(caseNums),
+                         'date': '2020-09-01',
+                         'room': '104'})
+
+
+def test_all_failed_docket_is_empty():
+    session = StatusSession(404)
+    scraper = DenverCaseScraper(None, 'token', session=session,
+                                fetchPolicy=FetchPolicy(maxRetries=0))
+
+    casesDf = scraper.scrape(docket('20C100001'))
+
+    assert casesDf.shape[0] == 0
+    assert set(casesDf.columns) == set(DenverCaseScraper.outputColumns +
+                                       DERIVED_COLUMNS)
+    assert [failure.kind for _, _, _, failure in scraper.failures] == [
+        'client']
+    assert scraper.eventsDf().shape[0] == 0
+
+
+def test_empty_docket_is_empty():
+    scraper = DenverCaseScraper(None, 'token', session=StatusSession(200))
+
+    assert scraper.scrape(docket()).shape[0] == 0
+
+
+@pytest.mark.parametrize('error, kind', [
+    (requests.ConnectionError('refused'), 'connection'),
+    (requests.exceptions.InvalidURL('bad url'), 'request'),
+    (requests.exceptions.TooManyRedirects('loop'), 'request'),
+])
+def test_request_error_skips_case(error, kind):
+    session = RaisingSession(error)
+    scraper = DenverCaseScraper(None, 'token', session=session,
+                                fetchPolicy=FetchPolicy(maxRetries=0))
+
+    casesDf = scraper.scrape(docket('20C100001', '20C100002'))
+
+    assert casesDf.shape[0] == 0
+    assert sorted((caseNum, failure.kind)
+                  for caseNum, _, _, failure in scraper.failures) == [
+        ('20C100001', kind), ('20C100002', kind)]
+    # Tried once in the docket and once more from the retry queue.
+    assert len(session.urls) == 4
+
+
+def test_journaled_case_is_not_fetched(tmp_path):
+    journal = RunJournal(str(tmp_path / 'journal.sqlite'))
+    actions = [['08/20/2020', 'Complaint Filed', 'Open'],
+               ['09/01/2020', 'Writ of Restitution', 'Open']]
+    journal.recordCase([
+        '20C100001', '2020-09-01', '104', 'ACME LLC V. DOE', 'FED', '',
+        'ACME LLC', 'DOE, JANE', 'LEE, KIM', '',
+        ','.join('|'.join(action) for action in actions), '2020-09-02',
+    ], actions)
+    session = StatusSession(503)
+    scraper = DenverCaseScraper(None, 'token', session=session,
+                                journal=journal,
+                                fetchPolicy=FetchPolicy(maxRetries=0))
+
+    casesDf = scraper.scrape(docket('20C100001'))
+
+    assert session.urls == []
+    assert casesDf['case_number'].tolist() == ['20C100001']
+    assert casesDf['writ_of_restitution'].tolist() == [True]
+    assert scraper.eventsDf()['action'].astype(str).tolist() == [
+        'COMPLAINTFILED', 'WRITOFRESTITUTION']
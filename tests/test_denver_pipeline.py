@@ -0,0 +1,60 @@
+from scrapers.denver_case_scraper import DenverCaseScraper
+from scrapers.denver_dockets import DenverDocketScraper
+from scrapers.denver_pipeline import DenverPipeline
+from scrapers.fetch_policy import FetchPolicy
+from scrapers.run_journal import RunJournal
+from tests.test_denver_case_scraper import StatusSession
+import pytest
+
+
+class RoomSession:
+    """RoomSession.  Answers docket requests with a status per room.  """
+
+    def __init__(self, statuses):
+        self.sessions = {room: StatusSession(status)
+                         for room, status in statuses.items()}
+
+    def get(self, url):
+        room = url.split('&room=')[1].split('&')[0]
+        return self.sessions[room].get(url)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return RunJournal(str(tmp_path / 'journal.sqlite'))
+
+
+def pipeline(statuses, journal):
+    session = RoomSession(statuses)
+    policy = FetchPolicy(maxRetries=0)
+    dockets = [DenverDocketScraper('2020-09-01', 'sess', room, 'token',
+                                   session=session, fetchPolicy=policy)
+               for room in statuses]
+    caseScraper = DenverCaseScraper('sess', 'token', session=session,
+                                    fetchPolicy=policy, journal=journal)
+
+    return DenverPipeline(dockets, caseScraper, journal=journal)
+
+
+def test_failed_docket_is_not_journaled(journal):
+    run = pipeline({'104': 503, '170': 200}, journal)
+
+    casesDf = run.run()
+
+    assert casesDf.shape[0] == 0
+    assert [(docket.room, failure.kind)
+            for docket, failure in run.failedDockets] == [('104', 'server')]
+    # The empty docket is done, the failed one is fetched again on resume.
+    assert journal.finishedDocket('2020-09-01', '170') == []
+    assert journal.finishedDocket('2020-09-01', '104') is None
+
+
+def test_finished_docket_is_not_fetched_on_resume(journal):
+    journal.markDocketDone('2020-09-01', '104', [])
+    run = pipeline({'104': 503}, journal)
+
+    casesDf = run.run()
+
+    assert casesDf.shape[0] == 0
+    assert run.failedDockets == []
+    assert run.caseScraper.session.sessions['104'].urls == []
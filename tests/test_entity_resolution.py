@@ -0,0 +1,47 @@
+from analyze.entity_resolution import EntityResolver, splitNames
+import pandas as pd
+
+
+def test_split_names_keeps_last_first_names():
+    names = splitNames(pd.Series([
+        'HOLLAND, MARK| HOLLAND, MARK', 'LEE, KIM', 'ACME, LLC| DOE, JANE',
+        '']))
+
+    assert names.values.tolist() == [
+        [0, 'HOLLAND, MARK'], [0, 'HOLLAND, MARK'], [1, 'LEE, KIM'],
+        [2, 'ACME, LLC'], [2, 'DOE, JANE']]
+
+
+def test_resolve_column_keeps_last_first_attorney(tmp_path):
+    resolver = EntityResolver(str(tmp_path / 'entities.sqlite'))
+
+    entities = resolver.resolveColumn(
+        pd.Series(['LEE, KIM', 'LEE, KIM| HOLLAND, MARK', '']),
+        'plaintiff_attorney', canonical=True)
+
+    assert entities.tolist() == ['LEE, KIM', 'HOLLAND, MARK| LEE, KIM', '']
+
+
+def test_entities_are_stable_across_runs(tmp_path):
+    path = str(tmp_path / 'entities.sqlite')
+    first = EntityResolver(path).resolve(
+        pd.Series(['ACME PROPERTIES LLC', 'PINE STREET HOMES', '']),
+        'plaintiff')
+
+    # Spellings of a known name join its entity, and a new name gets a new
+    # one without renumbering the others.
+    second = EntityResolver(path).resolve(
+        pd.Series(['PINE STREET HOMES', 'Acme Properties, LLC',
+                   'ACME PROPERTY LLC', 'ACME HOLDINGS']),
+        'plaintiff')
+
+    assert first.tolist() == [1, 2, None]
+    assert second.tolist() == [2, 1, 1, 3]
+
+
+def test_entities_are_per_kind(tmp_path):
+    resolver = EntityResolver(str(tmp_path / 'entities.sqlite'))
+    resolver.resolve(pd.Series(['ACME PROPERTIES LLC']), 'plaintiff')
+
+    assert resolver.resolve(pd.Series(['PINE STREET HOMES']),
+                            'plaintiff_attorney').tolist() == [1]
@@ -0,0 +1,75 @@
+from scrapers.fetch_policy import FetchFailure, FetchPolicy
+from scrapers.rate_limiter import RateLimiter
+from tests.test_denver_case_scraper import StatusSession
+import pytest
+import requests
+
+
+class ScriptedSession:
+    """ScriptedSession.  Raises or answers with a status, one step of script
+    per request.  """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def get(self, url):
+        step = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        if isinstance(step, Exception):
+            raise step
+        return StatusSession(step).get(url)
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.outcomes = []
+
+    def record(self, url, seconds, ok):
+        self.outcomes.append(ok)
+
+
+def policy(maxRetries=2, limiter=None):
+    return FetchPolicy(limiter, maxRetries=maxRetries, backoffBase=0,
+                       backoffCap=0)
+
+
+@pytest.mark.parametrize('error, kind, transient', [
+    (requests.Timeout('slow'), 'timeout', True),
+    (requests.ConnectionError('reset'), 'connection', True),
+    (requests.exceptions.ChunkedEncodingError('cut'), 'response', True),
+    (requests.exceptions.ContentDecodingError('gzip'), 'response', True),
+    (requests.TooManyRedirects('loop'), 'request', False),
+    (requests.exceptions.InvalidURL('bad'), 'request', False),
+])
+def test_request_errors_are_classified(error, kind, transient):
+    session = ScriptedSession(error)
+
+    with pytest.raises(FetchFailure) as raised:
+        policy().fetch(session, 'https://example.com/')
+
+    assert raised.value.kind == kind
+    assert raised.value.transient == transient
+    # Transient failures are retried, the rest are not.
+    assert session.calls == (3 if transient else 1)
+
+
+@pytest.mark.parametrize('status, kind', [
+    (503, 'server'), (429, 'server'), (404, 'client'), (302, 'client')])
+def test_statuses_are_classified(status, kind):
+    with pytest.raises(FetchFailure) as raised:
+        policy(maxRetries=0).fetch(StatusSession(status),
+                                   'https://example.com/')
+
+    assert raised.value.kind == kind
+
+
+def test_transient_failures_are_retried():
+    limiter = RecordingLimiter()
+    session = ScriptedSession(requests.Timeout('slow'), 503, 200)
+
+    response = policy(limiter=limiter).fetch(session, 'https://example.com/')
+
+    assert response.status_code == 200
+    assert limiter.outcomes == [False, False, True]
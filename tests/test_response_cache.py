@@ -0,0 +1,89 @@
+from scrapers.response_cache import CacheMiss, CachedSession, ResponseCache
+from tests.test_denver_case_scraper import StatusSession
+import itertools
+import os
+import pytest
+
+CASE_URL = ('https://www.denvercountycourt.org/search/?casenumber=%s'
+            '&date=2020-09-01&room=104&token=%s&searchtype=searchdocket')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / 'http_cache'))
+
+
+def numBodies(cache):
+    return sum(len(files) for _, _, files in
+               os.walk(os.path.join(cache.cacheDir, 'objects')))
+
+
+def test_token_is_left_out_of_key(cache):
+    cache.put(CASE_URL % ('20C100001', 'old'), b'page')
+
+    assert cache.get(CASE_URL % ('20C100001', 'new')) == b'page'
+    assert cache.get(CASE_URL % ('20C100002', 'old')) is None
+    assert cache.normalize(CASE_URL % ('20C100001', 'old')) == (
+        'case', 'case?casenumber=20C100001&date=2020-09-01&room=104')
+
+
+def test_stale_page_is_only_replayed(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'http_cache'), ttls={'case': -1})
+    url = CASE_URL % ('20C100001', 'token')
+    cache.put(url, b'page')
+
+    assert cache.get(url) is None
+    assert cache.get(url, ignoreTtl=True) == b'page'
+
+
+def test_equal_pages_share_a_body(cache):
+    cache.put(CASE_URL % ('20C100001', 'token'), b'page')
+    cache.put(CASE_URL % ('20C100002', 'token'), b'page')
+    assert numBodies(cache) == 1
+
+    # The body stays while another page still points at it.
+    cache.put(CASE_URL % ('20C100001', 'token'), b'changed')
+    assert numBodies(cache) == 2
+    assert cache.get(CASE_URL % ('20C100002', 'token')) == b'page'
+
+    cache.put(CASE_URL % ('20C100002', 'token'), b'changed')
+    assert numBodies(cache) == 1
+
+
+def test_least_recently_used_page_is_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr('scrapers.response_cache.time.time',
+                        lambda: next(clock))
+    cache = ResponseCache(str(tmp_path / 'http_cache'), maxBytes=12)
+    first, second, third = [CASE_URL % ('20C10000%d' % i, 'token')
+                            for i in range(1, 4)]
+
+    cache.put(first, b'aaaaaa')
+    cache.put(second, b'bbbbbb')
+    cache.get(first)
+    cache.put(third, b'cccccc')
+
+    assert cache.get(first) == b'aaaaaa'
+    assert cache.get(second) is None
+    assert cache.get(third) == b'cccccc'
+    assert numBodies(cache) == 2
+
+
+def test_only_good_pages_are_cached(cache):
+    url = CASE_URL % ('20C100001', 'token')
+    failing = StatusSession(503)
+    assert CachedSession(failing, cache).get(url).status_code == 503
+    assert cache.get(url) is None
+
+    working = StatusSession(200)
+    session = CachedSession(working, cache)
+    session.get(url)
+    assert session.get(url).content == b'<html><body></body></html>'
+    assert working.urls == [url]
+
+
+def test_replay_miss_raises(cache):
+    session = CachedSession(None, cache, replay=True)
+
+    with pytest.raises(CacheMiss):
+        session.get(CASE_URL % ('20C100001', 'token'))
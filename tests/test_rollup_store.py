@@ -0,0 +1,115 @@
+from analyze.agg_tables import AggTables, caseContributions
+from analyze.rollup_store import RollupStore, contributionDigests
+import pandas as pd
+
+
+def cases(*rows):
+    """cases.  Processed cases from (case_number, date, room, plaintiff,
+    evicted) tuples.  """
+
+    return pd.DataFrame([{
+        'case_number': caseNum,
+        'date': date,
+        'room': room,
+        'plaintiff': plaintiff,
+        'plaintiff_attorney': 'LEE, KIM',
+        'plaintiff_entity': plaintiff,
+        'plaintiff_attorney_entity': 'LEE, KIM',
+        'writ_of_restitution': evicted,
+        'evicted_flag': evicted,
+    } for caseNum, date, room, plaintiff, evicted in rows])
+
+
+HISTORY = cases(
+    ('20C100001', '2020-09-01', '104', 'ACME LLC', False),
+    ('20C100002', '2020-09-01', '104', 'ACME LLC', True),
+    ('20C100003', '2020-09-01', '170', 'PINE LLC', False),
+    ('20C100004', '2020-09-15', '104', 'ACME LLC', False),
+    ('20C100005', '2020-10-02', '104', 'PINE LLC', False),
+)
+
+
+def test_rollups_collapse():
+    store = RollupStore(':memory:')
+    store.rebuild(caseContributions(HISTORY))
+
+    assert store.numRows() == 5
+    assert store.rollup('daily')[['date', 'room', 'num_fed_hearings']
+                                 ].values.tolist() == [
+        ['2020-09-01', '104', 2], ['2020-09-01', '170', 1],
+        ['2020-09-15', '104', 1], ['2020-10-02', '104', 1]]
+    assert store.rollup('monthly_plaintiff')[
+        ['month_start', 'plaintiff', 'num_fed_hearings', 'num_evictions']
+    ].values.tolist() == [
+        ['2020-09-01', 'ACME LLC', 3, 1], ['2020-09-01', 'PINE LLC', 1, 0],
+        ['2020-10-01', 'PINE LLC', 1, 0]]
+
+
+def test_update_matches_rebuild():
+    store = RollupStore(':memory:')
+    AggTables(HISTORY, store=store)
+
+    # A case moves to another plaintiff and month, and a new case comes in.
+    changed = cases(
+        ('20C100002', '2020-10-05', '104', 'PINE LLC', True),
+        ('20C100006', '2020-10-05', '170', 'ACME LLC', False),
+    )
+    history = pd.concat([HISTORY[HISTORY['case_number'] != '20C100002'],
+                         changed], ignore_index=True)
+    updated = AggTables(history, store=store, changedCases=changed)
+    rebuilt = AggTables(history)
+
+    pd.testing.assert_frame_equal(updated.aggStatsWeekly(),
+                                  rebuilt.aggStatsWeekly())
+    for period, dimensions in [('month', ['room']),
+                               ('quarter', ['plaintiff_entity'])]:
+        pd.testing.assert_frame_equal(
+            updated.breakdown(period, dimensions),
+            rebuilt.breakdown(period, dimensions))
+
+
+def test_mark_is_dropped_by_changes():
+    store = RollupStore(':memory:')
+    store.rebuild(caseContributions(HISTORY))
+    store.mark('2020-10-05T00:00:00Z')
+    assert store.marker() == '2020-10-05T00:00:00Z'
+
+    store.update(caseContributions(HISTORY.iloc[:0]))
+    assert store.marker() == '2020-10-05T00:00:00Z'
+
+    store.update(caseContributions(HISTORY.iloc[:1]))
+    assert store.marker() is None
+
+
+def test_digests_match_contributions():
+    contributions = caseContributions(HISTORY)
+    store = RollupStore(':memory:')
+    store.rebuild(contributions)
+
+    stored = store.digests().sort_values('case_number')
+
+    assert stored['case_number'].tolist() == HISTORY['case_number'].tolist()
+    assert stored['digest'].tolist() == (
+        contributionDigests(contributions).tolist())
+    # Counts read back from a sheet as strings digest the same.
+    assert (contributionDigests(contributions.astype(str)).tolist() ==
+            contributionDigests(contributions).tolist())
+
+
+def test_edited_case_is_caught():
+    store = RollupStore(':memory:')
+    AggTables(HISTORY, store=store)
+
+    # A case edited by hand in the sheet, and a new case.
+    history = HISTORY.copy()
+    history.loc[0, ['plaintiff', 'plaintiff_entity']] = 'PINE LLC'
+    new = cases(('20C100006', '2020-10-05', '170', 'ACME LLC', False))
+    history = pd.concat([history, new], ignore_index=True)
+
+    assert not AggTables(None, store=store).inSync(history, new)
+    assert AggTables(None, store=store, verify=False).inSync(history, new)
+
+    updated = AggTables(history, store=store, changedCases=new)
+    pd.testing.assert_frame_equal(updated.breakdown('month', ['plaintiff']),
+                                  AggTables(history).breakdown(
+                                      'month', ['plaintiff']))
@@ -0,0 +1,31 @@
+from scrapers.run_journal import RunJournal
+
+ROW = ['20C100001', '2020-09-01', '104', 'ACME LLC V. DOE', 'FED']
+ACTIONS = [['08/20/2020', 'Complaint Filed', 'Open']]
+
+
+def test_journal_survives_reopen(tmp_path):
+    path = str(tmp_path / 'journal.sqlite')
+    journal = RunJournal(path)
+    journal.recordCase(ROW, ACTIONS)
+    journal.markDocketDone('2020-09-01', '104', ['20C100001'])
+
+    resumed = RunJournal(path)
+
+    assert resumed.scrapedCase('20C100001', '2020-09-01', '104') == ROW
+    assert resumed.scrapedActions('20C100001', '2020-09-01', '104') == ACTIONS
+    assert resumed.finishedDocket('2020-09-01', '104') == ['20C100001']
+    assert resumed.scrapedCase('20C100001', '2020-09-02', '104') is None
+    assert resumed.finishedDocket('2020-09-01', '170') is None
+
+
+def test_reset_forgets_progress(tmp_path):
+    journal = RunJournal(str(tmp_path / 'journal.sqlite'))
+    journal.recordCase(ROW, ACTIONS)
+    journal.markDocketDone('2020-09-01', '104', ['20C100001'])
+
+    journal.reset()
+
+    assert journal.scrapedCase('20C100001', '2020-09-01', '104') is None
+    assert journal.scrapedActions('20C100001', '2020-09-01', '104') is None
+    assert journal.finishedDocket('2020-09-01', '104') is None
@@ -0,0 +1,299 @@
+from analyze.derived_columns import addDerivedColumns
+from analyze.rollup_store import RollupStore
+from gspread.utils import rowcol_to_a1
+from ingest.local_sheets import LocalSheetsClient, LocalWorksheet
+from ingest.sheets_ingest import SheetsIngest, parseBreakdowns
+from scrapers.denver_case_scraper import DenverCaseScraper
+from scrapers.rate_limiter import RateLimiter
+import pandas as pd
+import pytest
+
+SHEET_ID = 'denver'
+
+
+def scrapedCases(*cases):
+    """scrapedCases.  Cases as the Denver scrape hands them to the ingest,
+    from (case_number, date, action_history, scraped_on) tuples.  """
+
+    rows = []
+    for caseNum, date, history, scrapedOn in cases:
+        rows.append({
+            'case_number': caseNum,
+            'date': date,
+            'room': '104',
+            'case_title': 'ACME v. DOE',
+            'type': 'FED',
+            'total_amount': '$1,000.00',
+            'plaintiff': 'ACME LLC',
+            'defendant': 'DOE, JANE',
+            'plaintiff_attorney': 'LEE, KIM',
+            'defendant_attorney': '',
+            'action_history': history,
+            'scraped_on': scrapedOn,
+        })
+
+    return addDerivedColumns(
+        pd.DataFrame(rows, columns=DenverCaseScraper.outputColumns))
+
+
+def sheetDf(gc, worksheetName):
+    values = gc.open_by_key(SHEET_ID).find(worksheetName).values()
+    return pd.DataFrame(values[1:], columns=values[0])
+
+
+@pytest.fixture
+def gc():
+    gc = LocalSheetsClient()
+    gc.open_by_key(SHEET_ID).add_worksheet('all_cases', 1, 1)
+    return gc
+
+
+@pytest.fixture
+def ingest(gc, tmp_path):
+    return SheetsIngest(None, rollupDir=str(tmp_path / 'rollups'),
+                        cacheDir=str(tmp_path / 'sheet_cache'),
+                        rateLimiter=RateLimiter(), gc=gc)
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """writes.  Every cell written to any worksheet, as (title, row, col),
+    1-based.  """
+
+    written = set()
+    write = LocalWorksheet.write
+
+    def recordWrite(self, row, col, values):
+        for i, vals in enumerate(values):
+            for j in range(len(vals)):
+                written.add((self.title, row + i, col + j))
+        write(self, row, col, values)
+
+    monkeypatch.setattr(LocalWorksheet, 'write', recordWrite)
+    return written
+
+
+def test_ingest_new_batch_and_upload(gc, ingest, writes):
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100001', '2020-09-01', '08/20/2020|Complaint Filed|Open',
+         '2020-09-01'),
+        ('20C100002', '2020-09-02', '08/21/2020|Complaint Filed|Open',
+         '2020-09-01'),
+        ('20C100003', '2020-09-14',
+         '08/22/2020|Complaint Filed|Open, '
+         '09/14/2020|Writ of Restitution|Closed',
+         '2020-09-14'),
+    ), SHEET_ID)
+
+    cases = sheetDf(gc, 'all_cases')
+    assert cases['case_number'].tolist() == [
+        '20C100001', '20C100002', '20C100003']
+    assert cases['week'].tolist() == ['36', '36', '38']
+    assert cases['month'].tolist() == ['9', '9', '9']
+    assert cases['num_hearings'].tolist() == ['1', '1', '1']
+
+    # An organizer adds notes in a column of their own.
+    spreadsheet = gc.open_by_key(SHEET_ID)
+    notesCol = cases.shape[1] + 1
+    spreadsheet.find('all_cases').resize(4, notesCol)
+    spreadsheet.values_batch_update(body={'data': [
+        {'range': "'all_cases'!%s" % rowcol_to_a1(1, notesCol),
+         'values': [['notes']]},
+        {'range': "'all_cases'!%s" % rowcol_to_a1(3, notesCol),
+         'values': [['called tenant']]},
+    ]})
+    before = gc.open_by_key(SHEET_ID).find('all_cases').values()
+    writes.clear()
+
+    # 20C100002 is continued to October, and 20C100004 is new with two
+    # hearings on the same day.
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100002', '2020-10-05',
+         '08/21/2020|Complaint Filed|Open, 09/02/2020|Continued|Open',
+         '2020-09-20'),
+        ('20C100004', '2020-09-16', '09/01/2020|Complaint Filed|Open',
+         '2020-09-20'),
+        ('20C100004', '2020-09-16', '09/01/2020|Complaint Filed|Open',
+         '2020-09-20'),
+    ), SHEET_ID)
+
+    cases = sheetDf(gc, 'all_cases').set_index('case_number')
+    assert cases.index.tolist() == [
+        '20C100001', '20C100002', '20C100003', '20C100004']
+    assert cases.loc['20C100002', 'notes'] == 'called tenant'
+    assert cases.loc['20C100004', 'notes'] == ''
+    assert cases['date'].tolist() == [
+        '2020-09-01', '2020-10-05', '2020-09-14', '2020-09-16']
+    assert cases['week'].tolist() == ['36', '41', '38', '38']
+    assert cases['month'].tolist() == ['9', '10', '9', '9']
+    assert cases['num_hearings'].tolist() == ['1', '1', '1', '2']
+
+    # Only the continued case and the new one were written, and the notes
+    # column only for the new row.  Each row is written from its first to
+    # its last changed cell.
+    header = before[0]
+    after = gc.open_by_key(SHEET_ID).find('all_cases').values()
+    written = {(row, col) for title, row, col in writes
+               if title == 'all_cases'}
+    assert {row for row, col in written} == {3, 5}
+    assert (3, header.index('notes') + 1) not in written
+    changed = {(3, col + 1)
+               for col, (old, new) in enumerate(zip(before[2], after[2]))
+               if old != new}
+    assert changed == {(3, header.index(col) + 1) for col in [
+        'date', 'action_history', 'scraped_on', 'month', 'week',
+        'num_continuances']}
+    assert changed <= written
+
+    # Rollups count one hearing per case, in the period of its latest date.
+    monthly = sheetDf(gc, 'monthly_totals').set_index('month')
+    assert monthly.loc['9', 'num_fed_hearings'] == '3'
+    assert monthly.loc['10', 'num_fed_hearings'] == '1'
+    assert monthly.loc['9', 'num_writ_restitution'] == '1'
+    assert monthly.loc['9', 'num_evictions'] == '1'
+    assert monthly.loc['9', 'days_to_writ_p50'] == '23.0'
+
+    weekly = sheetDf(gc, 'weekly_totals').set_index('week_start')
+    assert weekly.index.tolist() == ['2020-08-31', '2020-09-14', '2020-10-05']
+    assert weekly['num_fed_hearings'].tolist() == ['1', '2', '1']
+
+    assert cases['plaintiff_entity'].unique().tolist() == ['ACME LLC']
+    assert cases['plaintiff_attorney_entity'].unique().tolist() == [
+        'LEE, KIM']
+    assert cases['days_to_writ'].tolist() == ['', '', '23', '']
+    assert cases['num_continuances'].tolist() == ['0', '1', '0', '0']
+
+    # Breakdowns are summed from the same stored rollups.
+    byRoom = sheetDf(gc, 'monthly_by_room')
+    assert byRoom[['month', 'room', 'num_fed_hearings']].values.tolist() == [
+        ['2020-09', '104', '3'], ['2020-10', '104', '1']]
+    byPlaintiff = sheetDf(gc, 'quarterly_by_plaintiff_entity')
+    assert byPlaintiff[['quarter', 'plaintiff_entity',
+                        'num_fed_hearings']].values.tolist() == [
+        ['2020Q3', 'ACME LLC', '3'], ['2020Q4', 'ACME LLC', '1']]
+
+    # Breakdowns carry timeline percentiles, and histograms bin them.
+    assert byRoom['days_to_writ_p50'].tolist() == ['23.0', '']
+    histogram = sheetDf(gc, 'monthly_days_to_writ_histogram')
+    assert histogram[['month', '[7, 14)', '[14, 30)']].values.tolist() == [
+        ['2020-09', '0', '1']]
+
+
+def test_unchanged_sheet_is_not_downloaded(gc, ingest):
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100001', '2020-09-01', '08/20/2020|Complaint Filed|Open',
+         '2020-09-01'),
+    ), SHEET_ID)
+    gc.calls.clear()
+
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100002', '2020-09-02', '08/21/2020|Complaint Filed|Open',
+         '2020-09-02'),
+    ), SHEET_ID)
+
+    # Every worksheet comes from the local cache, since only our own
+    # uploads changed the sheet.
+    assert gc.calls['get_all_values'] == 0
+    assert gc.calls['values_batch_get'] == 0
+    assert sheetDf(gc, 'all_cases')['case_number'].tolist() == [
+        '20C100001', '20C100002']
+
+
+def test_unchanged_sheet_is_not_verified(gc, ingest, monkeypatch):
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100001', '2020-09-01', '08/20/2020|Complaint Filed|Open',
+         '2020-09-01'),
+    ), SHEET_ID)
+
+    # all_cases is still what was uploaded, so the stored contributions of
+    # its cases are not read back to look for hand edits.
+    def digests(self):
+        raise AssertionError('Unchanged cases were verified.')
+
+    monkeypatch.setattr(RollupStore, 'digests', digests)
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100002', '2020-09-02', '08/21/2020|Complaint Filed|Open',
+         '2020-09-02'),
+    ), SHEET_ID)
+
+    monthly = sheetDf(gc, 'monthly_totals').set_index('month')
+    assert monthly.loc['9', 'num_fed_hearings'] == '2'
+
+
+def test_chunked_ingest_matches(tmp_path):
+    batches = [scrapedCases(
+        ('20C100001', '2020-09-01', '08/20/2020|Complaint Filed|Open',
+         '2020-09-01'),
+        ('20C100002', '2020-09-02', '08/21/2020|Complaint Filed|Open',
+         '2020-09-01'),
+        ('20C100003', '2020-09-03', '08/22/2020|Complaint Filed|Open',
+         '2020-09-03'),
+        ('20C100004', '2020-09-04', '08/23/2020|Complaint Filed|Open',
+         '2020-09-04'),
+    ), scrapedCases(
+        ('20C100002', '2020-10-05',
+         '08/21/2020|Complaint Filed|Open, '
+         '10/05/2020|Writ of Restitution|Closed',
+         '2020-10-05'),
+        ('20C100005', '2020-10-06', '09/30/2020|Complaint Filed|Open',
+         '2020-10-06'),
+    )]
+
+    sheets = []
+    for memoryLimit in [None, 4096]:
+        gc = LocalSheetsClient()
+        gc.open_by_key(SHEET_ID).add_worksheet('all_cases', 1, 1)
+        ingest = SheetsIngest(
+            None, rollupDir=str(tmp_path / str(memoryLimit)),
+            cacheDir=str(tmp_path / str(memoryLimit) / 'sheet_cache'),
+            rateLimiter=RateLimiter(), gc=gc, memoryLimit=memoryLimit)
+        for batch in batches:
+            ingest.ingestNewBatchAndUpload(batch.copy(), SHEET_ID)
+        sheets.append(gc)
+
+    # Rows may come in another order within a date.
+    whole, chunked = [sheetDf(gc, 'all_cases').sort_values('case_number')
+                      .reset_index(drop=True) for gc in sheets]
+    pd.testing.assert_frame_equal(whole, chunked)
+    assert whole['date'].tolist() == [
+        '2020-09-01', '2020-10-05', '2020-09-03', '2020-09-04', '2020-10-06']
+    for worksheetName in ['monthly_totals', 'monthly_by_room']:
+        pd.testing.assert_frame_equal(sheetDf(sheets[0], worksheetName),
+                                      sheetDf(sheets[1], worksheetName))
+
+
+def test_breakdowns_must_be_stored():
+    assert parseBreakdowns('week:room,year:plaintiff+plaintiff_entity') == [
+        ('week', ['room']), ('year', ['plaintiff', 'plaintiff_entity'])]
+
+    with pytest.raises(ValueError):
+        parseBreakdowns('week:plaintiff_entity')
+    with pytest.raises(ValueError):
+        parseBreakdowns('month:room+plaintiff_entity')
+
+
+def test_hand_edits_reach_rollups(gc, ingest):
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100001', '2020-09-01', '08/20/2020|Complaint Filed|Open',
+         '2020-09-01'),
+        ('20C100002', '2020-09-02', '08/21/2020|Complaint Filed|Open',
+         '2020-09-01'),
+    ), SHEET_ID)
+
+    # An organizer corrects a flag by hand, which leaves the row count alone.
+    spreadsheet = gc.open_by_key(SHEET_ID)
+    header = spreadsheet.find('all_cases').values()[0]
+    spreadsheet.values_batch_update(body={'data': [{
+        'range': "'all_cases'!%s" % rowcol_to_a1(
+            3, header.index('writ_of_restitution') + 1),
+        'values': [['TRUE']],
+    }]})
+
+    ingest.ingestNewBatchAndUpload(scrapedCases(
+        ('20C100003', '2020-09-03', '08/22/2020|Complaint Filed|Open',
+         '2020-09-03'),
+    ), SHEET_ID)
+
+    monthly = sheetDf(gc, 'monthly_totals').set_index('month')
+    assert monthly.loc['9', 'num_fed_hearings'] == '3'
+    assert monthly.loc['9', 'num_writ_restitution'] == '1'